@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Continuous-Batching Story Server for Pine Hollow Mystery
+Queues story-step requests and admits them into the running GPT-2 decode batch at every step,
+so a request starts as soon as there is room instead of waiting for the batch ahead of it to finish
+
+Usage:
+    python batch_server.py --port 8060 --max-batch-size 16
+    curl -X POST localhost:8060/generate -d '{"scenario_id": 3, "max_new_tokens": 40}'
+    curl localhost:8060/metrics
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from benchmark_generation import percentile
+from generation_engine import DEFAULT_TOP_K, GenerationEngine, build_prompt, sample_next_tokens
+from model_loader import DEFAULT_MODEL_NAME, load_model
+
+DEFAULT_MAX_BATCH_SIZE = 16
+DEFAULT_PORT = 8060
+METRICS_WINDOW = 1000  # recent requests and steps the latency and occupancy metrics cover
+MAX_SEED = 2 ** 63 - 1  # torch.Generator seeds
+
+
+def _integer(value, name, minimum=None, maximum=None):
+    """
+    Check a request field is an integer (JSON true/false and floats don't count) within bounds
+    """
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise TypeError(f"{name} must be an integer, got {value!r}")
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise ValueError(f"{name} must be between {minimum} and {maximum}, got {value}")
+    return value
+
+
+class StoryRequest:
+    """
+    One queued or decoding story step and its timings
+    """
+
+    def __init__(self, prompt, max_new_tokens, temperature, seed, sentence_stop, future):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.seed = seed
+        self.sentence_stop = sentence_stop
+        self.future = future
+        self.tokens = []
+        self.generator = None
+        self.stop_reason = None
+        self.enqueued_at = time.perf_counter()
+        self.admitted_at = None
+        self.first_token_at = None
+
+    def result(self, tokenizer):
+        finished_at = time.perf_counter()
+        return {
+            "continuation": tokenizer.decode(self.tokens, skip_special_tokens=True).strip(),
+            "generated_tokens": len(self.tokens),
+            "stop_reason": self.stop_reason,
+            "queue_seconds": self.admitted_at - self.enqueued_at,
+            "first_token_seconds": self.first_token_at - self.enqueued_at,
+            "latency_seconds": finished_at - self.enqueued_at
+        }
+
+
+class ContinuousBatchScheduler:
+    """
+    Decode loop over one shared KV batch: queued requests join between steps and finished ones leave,
+    each row stopping at its own eos, sentence end or budget
+    """
+
+    def __init__(self, engine, max_batch_size=DEFAULT_MAX_BATCH_SIZE, top_k=DEFAULT_TOP_K):
+        self.engine = engine
+        self.tokenizer = engine.tokenizer
+        self.max_batch_size = max_batch_size
+        self.top_k = top_k
+        self.max_positions = engine.model.config.n_positions
+        self.queue = asyncio.Queue()
+        self.active = []   # the request behind each row of self.state
+        self.state = None
+        self.stats = Counter()
+        self.latencies = deque(maxlen=METRICS_WINDOW)
+        self.queue_waits = deque(maxlen=METRICS_WINDOW)
+        self.first_tokens = deque(maxlen=METRICS_WINDOW)
+        self.occupancy = deque(maxlen=METRICS_WINDOW)
+        self.started_at = time.perf_counter()
+        # torch runs on one thread of its own so the event loop keeps accepting requests during a step
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, prompt, max_new_tokens=40, temperature=0.8, seed=None, sentence_stop=None):
+        """
+        Queue a story step and wait for it to finish
+        Raises: TypeError or ValueError for a malformed request, before it can join the shared batch
+        Returns: dict with the continuation, its token count, stop reason and timings
+        """
+        # Every row decodes in the same step, so one bad field would fail the whole batch
+        if not isinstance(prompt, str) or not prompt:
+            raise TypeError(f"prompt must be a non-empty string, got {prompt!r}")
+        max_new_tokens = _integer(max_new_tokens, "max_new_tokens", 1, self.max_positions)
+        if isinstance(temperature, bool) or not isinstance(temperature, (int, float)):
+            raise TypeError(f"temperature must be a number, got {temperature!r}")
+        if not 0 < temperature < float('inf'):
+            raise ValueError("temperature must be positive")
+        if seed is not None:
+            seed = _integer(seed, "seed", 0, MAX_SEED)
+        if sentence_stop is not None:
+            sentence_stop = _integer(sentence_stop, "sentence_stop", 0, max_new_tokens)
+
+        prompt_length = len(self.tokenizer.encode(prompt))
+        if prompt_length + max_new_tokens > self.max_positions:
+            raise ValueError(f"prompt ({prompt_length} tokens) plus max_new_tokens exceeds GPT-2's "
+                             f"{self.max_positions}-token context")
+
+        request = StoryRequest(prompt, max_new_tokens, float(temperature), seed, sentence_stop,
+                               asyncio.get_running_loop().create_future())
+        await self.queue.put(request)
+        return await request.future
+
+    async def run(self):
+        """
+        Serve requests until cancelled
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            admitted = []
+            if not self.active:
+                # Nothing to decode: sleep until a request arrives
+                admitted.append(await self.queue.get())
+            while len(self.active) + len(admitted) < self.max_batch_size and not self.queue.empty():
+                admitted.append(self.queue.get_nowait())
+
+            try:
+                finished = await loop.run_in_executor(self._executor, self._step, admitted)
+            except Exception as e:
+                # A failed step loses the whole batch; fail its requests and start clean
+                for request in self.active + [r for r in admitted if r not in self.active]:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                self.active, self.state = [], None
+                continue
+
+            for request in finished:
+                self.latencies.append(time.perf_counter() - request.enqueued_at)
+                self.queue_waits.append(request.admitted_at - request.enqueued_at)
+                self.first_tokens.append(request.first_token_at - request.enqueued_at)
+                self.stats["completed_requests"] += 1
+                if not request.future.done():
+                    request.future.set_result(request.result(self.tokenizer))
+
+    def _step(self, admitted):
+        """
+        Prefill newly admitted requests into the batch, then sample one token for every row
+        Returns: requests that finished on this step
+        """
+        import torch
+
+        with torch.no_grad():
+            if admitted:
+                now = time.perf_counter()
+                for request in admitted:
+                    request.admitted_at = now
+                    request.generator = self.engine.make_generators(
+                        [request.seed if request.seed is not None else random.getrandbits(63)])[0]
+                prefilled = self.engine.prefill([request.prompt for request in admitted])
+                self.state = prefilled if self.state is None else self.state.merge(prefilled)
+                self.active += admitted
+
+            self.occupancy.append(len(self.active) / self.max_batch_size)
+            self.stats["steps"] += 1
+
+            # Each row samples at its own temperature
+            temperatures = torch.tensor([[request.temperature] for request in self.active], device=self.engine.device)
+            next_tokens = sample_next_tokens(self.state.next_logits, temperatures, self.top_k,
+                                             generators=[request.generator for request in self.active]).tolist()
+
+            now = time.perf_counter()
+            keep, finished = [], []
+            for row, (request, token) in enumerate(zip(self.active, next_tokens)):
+                request.first_token_at = request.first_token_at or now
+                if token == self.tokenizer.eos_token_id:
+                    request.stop_reason = 'eos'
+                else:
+                    request.tokens.append(token)
+                    self.stats["generated_tokens"] += 1
+                    if request.sentence_stop is not None and \
+                            self.engine.sentence_stop(request.sentence_stop).ends_sentence(request.tokens):
+                        request.stop_reason = 'sentence'
+                    elif len(request.tokens) >= request.max_new_tokens:
+                        request.stop_reason = 'length'
+                (finished if request.stop_reason else keep).append(row)
+
+            # Finished rows leave before the next forward pass, so they cost nothing further
+            done = [self.active[row] for row in finished]
+            if finished:
+                self.active = [self.active[row] for row in keep]
+                self.state = self.state.select(keep).trim() if keep else None
+            if keep:
+                self.state = self.engine.extend(self.state, [[next_tokens[row]] for row in keep])
+            return done
+
+    def metrics(self):
+        """
+        Returns: dict of queue depth, batch occupancy, throughput and latency percentiles
+        """
+        elapsed = time.perf_counter() - self.started_at
+        return {
+            "queue_depth": self.queue.qsize(),
+            "active_requests": len(self.active),
+            "max_batch_size": self.max_batch_size,
+            "batch_occupancy": len(self.active) / self.max_batch_size,
+            "mean_batch_occupancy": sum(self.occupancy) / len(self.occupancy) if self.occupancy else 0.0,
+            "steps": self.stats["steps"],
+            "completed_requests": self.stats["completed_requests"],
+            "generated_tokens": self.stats["generated_tokens"],
+            "tokens_per_second": self.stats["generated_tokens"] / elapsed if elapsed else 0.0,
+            "latency_p50_seconds": percentile(self.latencies, 50),
+            "latency_p95_seconds": percentile(self.latencies, 95),
+            "queue_wait_p95_seconds": percentile(self.queue_waits, 95),
+            "first_token_p50_seconds": percentile(self.first_tokens, 50)
+        }
+
+
+class StoryHttpServer:
+    """
+    Minimal JSON-over-HTTP front end on asyncio streams, one request per connection
+    """
+
+    def __init__(self, scheduler, scenarios_df=None):
+        self.scheduler = scheduler
+        self.scenarios_df = scenarios_df
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, payload = await self.route(method, path, body)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, payload = 400, {'error': str(e)}
+        except Exception as e:
+            # Whatever went wrong, the client still gets an answer
+            status, payload = 500, {'error': repr(e)}
+
+        data = json.dumps(payload).encode('utf-8')
+        writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                     f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                     f"Connection: close\r\n\r\n".encode('latin-1') + data)
+        await writer.drain()
+        writer.close()
+
+    async def route(self, method, path, body):
+        """
+        Returns: (HTTP status, JSON payload)
+        """
+        if method == 'GET' and path == '/metrics':
+            return 200, self.scheduler.metrics()
+        if method != 'POST' or path != '/generate':
+            return 404, {'error': 'not found'}
+
+        request = json.loads(body or b'{}')
+        if not isinstance(request, dict):
+            return 400, {'error': "request body must be a JSON object"}
+        if 'prompt' not in request and self.scenarios_df is None:
+            return 400, {'error': "no prompt given and no scenarios loaded"}
+        try:
+            if 'prompt' in request:
+                prompt = request['prompt']
+            else:
+                scenario_id = _integer(request.get('scenario_id', 0), "scenario_id", 0, len(self.scenarios_df) - 1)
+                prompt = build_prompt(self.scenarios_df.iloc[scenario_id])
+            result = await self.scheduler.submit(
+                prompt, request.get('max_new_tokens', 40), request.get('temperature', 0.8),
+                request.get('seed'), request.get('sentence_stop'))
+        except (ValueError, TypeError, IndexError) as e:
+            return 400, {'error': str(e)}
+        return 200, result
+
+
+def load_scheduler(model_name=DEFAULT_MODEL_NAME, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+    """
+    Returns: ContinuousBatchScheduler over a freshly loaded (or already loaded) GPT-2
+    """
+    model, tokenizer = load_model(model_name)
+    return ContinuousBatchScheduler(GenerationEngine(model, tokenizer), max_batch_size)
+
+
+async def serve(scheduler, port, scenarios_df=None):
+    server = await asyncio.start_server(StoryHttpServer(scheduler, scenarios_df).handle, 'localhost', port)
+    async with server:
+        await asyncio.gather(server.serve_forever(), scheduler.run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve story steps with continuous batching")
+    parser.add_argument("--model-name", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--data", default="data/pine_hollow_expanded.csv",
+                        help="Scenarios a request can name by scenario_id instead of sending a prompt")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE,
+                        help="Requests decoded together; more wait in the queue")
+    args = parser.parse_args()
+
+    print("🌲 Starting Pine Hollow continuous-batching server")
+    scenarios_df = pd.read_csv(args.data)
+    scheduler = load_scheduler(args.model_name, args.max_batch_size)
+    print(f"🎮 Serving {len(scenarios_df)} scenarios on http://localhost:{args.port} "
+          f"(batch of up to {args.max_batch_size})")
+    try:
+        asyncio.run(serve(scheduler, args.port, scenarios_df))
+    except KeyboardInterrupt:
+        print("\n👋 Story server stopped")
+
+
+if __name__ == "__main__":
+    main()
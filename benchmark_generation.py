@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Generation Benchmark for Pine Hollow Mystery
+Measures GPT-2 throughput, latency and memory over a grid of generation settings
+
+Usage:
+    python benchmark_generation.py --batch-sizes 1 8 --threads 1 4 --max-new-tokens 40
+    python benchmark_generation.py --compare benchmarks/generation_benchmark.json   # fail on throughput regressions
+"""
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from generation_engine import GenerationEngine, bucket_by_length, build_prompt, derive_seed
+from model_loader import DEFAULT_MODEL_NAME, PRECISIONS, load_model, report_startup_times
+
+DEFAULT_DATASETS = ["data/pine_hollow_enhanced_v2.csv", "data/pine_hollow_expanded.csv"]
+DEFAULT_OUTPUT = "benchmarks/generation_benchmark.json"
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of numbers
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    # The smallest value with at least pct% of the values at or below it
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far, in MB
+    (each config runs in its own process, so this is that config's peak)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def load_prompts(paths, limit=None):
+    """
+    Returns: list of (dataset name, scenario id, prompt) across the benchmark datasets
+    """
+    prompts = []
+    for path in paths:
+        df = pd.read_csv(path, usecols=['prompt', 'response'])
+        for scenario_id, row in zip(df.index, df.to_dict('records')):
+            prompts.append((path, scenario_id, build_prompt(row)))
+    return prompts[:limit] if limit else prompts
+
+
+def run_config(engine, prompts, max_new_tokens, seed, temperature=0.8):
+    """
+    Generate every prompt once with the engine's batch size
+    Returns: dict of throughput and latency measurements
+    """
+    import torch
+
+    texts = [prompt for _, _, prompt in prompts]
+    seeds = [derive_seed(seed, f"{path}:{scenario_id}") for path, scenario_id, _ in prompts]
+    lengths = [len(ids) for ids in engine.tokenizer(texts)['input_ids']]
+    batches = bucket_by_length(lengths, engine.batch_size)
+
+    latencies = []
+    first_token = []
+    generated_tokens = 0
+    prompt_tokens = 0
+
+    start = time.perf_counter()
+    with torch.no_grad():
+        for batch in batches:
+            batch_start = time.perf_counter()
+            done_at = [None] * len(batch)
+
+            def on_step(step, finished):
+                now = time.perf_counter()
+                if step == 0:
+                    first_token.append(now - batch_start)
+                for row in finished.nonzero().flatten().tolist():
+                    if done_at[row] is None:
+                        done_at[row] = now
+
+            state = engine.prefill([texts[i] for i in batch])
+            generated, _ = engine.sample_from(state, [max_new_tokens] * len(batch), temperature,
+                                              generators=engine.make_generators([seeds[i] for i in batch]),
+                                              on_step=on_step)
+
+            # A scenario's latency runs from its batch starting to its own last token
+            latencies += [(finish or time.perf_counter()) - batch_start for finish in done_at]
+            generated_tokens += sum(len(tokens) for tokens in generated)
+            prompt_tokens += sum(lengths[i] for i in batch)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "scenarios": len(prompts),
+        "prompt_tokens": prompt_tokens,
+        "generated_tokens": generated_tokens,
+        "elapsed_seconds": elapsed,
+        "tokens_per_second": generated_tokens / elapsed if elapsed else 0.0,
+        "scenarios_per_second": len(prompts) / elapsed if elapsed else 0.0,
+        "latency_p50_seconds": percentile(latencies, 50),
+        "latency_p95_seconds": percentile(latencies, 95),
+        "latency_p99_seconds": percentile(latencies, 99),
+        "ttft_p50_seconds": percentile(first_token, 50),
+        "ttft_p95_seconds": percentile(first_token, 95),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def measure_config(model_name, config, prompts, seed, warmup, report_startup=False):
+    """
+    Load the model and benchmark one config; runs in a fresh process per config
+    Returns: run_config's measurements
+    """
+    import torch
+
+    torch.set_num_threads(config["threads"])
+    model, tokenizer = load_model(model_name, "cpu", precision=config["precision"])
+    if report_startup:
+        report_startup_times()
+    engine = GenerationEngine(model, tokenizer, batch_size=config["batch_size"], device="cpu",
+                              precision=config["precision"])
+
+    if warmup:
+        run_config(engine, prompts[:config["batch_size"] * warmup], config["max_new_tokens"], seed)
+    return run_config(engine, prompts, config["max_new_tokens"], seed)
+
+
+def config_name(config):
+    return "bs{batch_size}_t{threads}_new{max_new_tokens}_{precision}".format(**config)
+
+
+def load_baseline(path):
+    """
+    Returns: dict of config name -> metrics from a saved results JSON
+    """
+    with open(path) as f:
+        return {config_name(r["config"]): r["metrics"] for r in json.load(f)["results"]}
+
+
+def compare_results(results, baseline, max_regression):
+    """
+    Flag configs whose tokens/sec dropped by more than max_regression against a saved run
+    baseline: load_baseline() of the earlier results
+    Returns: list of regression messages (empty when everything held up)
+    """
+    regressions = []
+    for result in results:
+        name = config_name(result["config"])
+        if name not in baseline:
+            continue
+        before = baseline[name]["tokens_per_second"]
+        after = result["metrics"]["tokens_per_second"]
+        if before and (before - after) / before > max_regression:
+            regressions.append(f"{name}: {after:.1f} tok/s vs {before:.1f} baseline ({after / before - 1:+.0%})")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark Pine Hollow generation throughput and latency")
+    parser.add_argument("--model-name", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--data", nargs="+", default=DEFAULT_DATASETS,
+                        help="Scenario CSVs whose prompts are generated")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Only benchmark the first N scenarios")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1],
+                        help="torch intra-op thread counts")
+    parser.add_argument("--max-new-tokens", type=int, nargs="+", default=[40],
+                        help="Continuation budgets in tokens")
+    parser.add_argument("--precisions", nargs="+", default=["fp32"], choices=PRECISIONS)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="Untimed batches per config before measuring")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--compare", default=None,
+                        help="Previous results JSON; exit non-zero if tokens/sec regressed")
+    parser.add_argument("--max-regression", type=float, default=0.10,
+                        help="Allowed tokens/sec drop against --compare (fraction)")
+    parser.add_argument("--no-mlflow", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print("🌲 Starting Pine Hollow generation benchmark")
+
+    import torch
+
+    # Read the baseline before anything runs: --output may be the very file it came from
+    baseline = None
+    if args.compare:
+        try:
+            baseline = load_baseline(args.compare)
+        except (OSError, ValueError, KeyError) as e:
+            sys.exit(f"❌ Could not read baseline {args.compare}: {type(e).__name__}: {e}")
+        print(f"📏 Comparing against {len(baseline)} configs in {args.compare}")
+
+    prompts = load_prompts(args.data, args.limit)
+    print(f"📚 Benchmarking {len(prompts)} scenarios from {len(args.data)} datasets")
+
+    grid = [dict(zip(("precision", "threads", "batch_size", "max_new_tokens"), values))
+            for values in itertools.product(args.precisions, args.threads, args.batch_sizes, args.max_new_tokens)]
+
+    # A fresh process per config keeps one config's peak RSS (and loaded models) out of the next one's numbers
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for index, config in enumerate(grid):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            metrics = pool.submit(measure_config, args.model_name, config, prompts, args.seed, args.warmup,
+                                  report_startup=index == 0).result()
+        results.append({"config": config, "metrics": metrics})
+
+        print(f"⚡ {config_name(config)}: {metrics['tokens_per_second']:.1f} tok/s, "
+              f"p50 {metrics['latency_p50_seconds']:.2f}s, p95 {metrics['latency_p95_seconds']:.2f}s, "
+              f"p99 {metrics['latency_p99_seconds']:.2f}s, TTFT {metrics['ttft_p50_seconds'] * 1000:.0f}ms, "
+              f"RSS {metrics['peak_rss_mb']:.0f}MB")
+
+    report = {
+        "model_name": args.model_name,
+        "datasets": args.data,
+        "torch_version": torch.__version__,
+        "platform": platform.platform(),
+        "results": results
+    }
+    if (args.compare and baseline is None and os.path.exists(args.output)
+            and os.path.samefile(args.compare, args.output)):
+        sys.exit(f"❌ --output {args.output} would overwrite the --compare baseline before it is read")
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"📁 Results: {args.output}")
+
+    if not args.no_mlflow:
+        from tracking import BufferedTracker
+        tracker = BufferedTracker("cyoa_model_experiments", "pine_hollow_generation_benchmark")
+        tracker.log_param("model_name", args.model_name)
+        tracker.log_param("scenarios", len(prompts))
+        tracker.log_param("configs", " ".join(config_name(result["config"]) for result in results))
+        # One run for the whole grid; each config's metrics are prefixed with its name
+        for result in results:
+            name = config_name(result["config"])
+            tracker.log_metrics({f"{name}_{key}": value for key, value in result["metrics"].items()})
+        tracker.log_artifact(args.output)
+        if tracker.close():
+            print("✅ Benchmark logged to MLflow")
+
+    if args.compare:
+        regressions = compare_results(results, baseline, args.max_regression)
+        for message in regressions:
+            print(f"❌ Throughput regression {message}")
+        if regressions:
+            sys.exit(1)
+        print("✅ No throughput regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Best-of-N Sampling for Pine Hollow Mystery
+Encodes each prompt once, samples N continuations from copies of its KV cache, and keeps the candidate
+with the best keyword/atmosphere score and perplexity, reranked in one batched pass
+"""
+
+import math
+import time
+from collections import Counter
+
+import pandas as pd
+
+from generation_engine import DEFAULT_TOP_K, bucket_by_length, derive_seed, token_list
+from keyword_scoring import SUPERNATURAL_ATMOSPHERE_KEYWORDS, MYSTERY_ELEMENT_KEYWORDS, KeywordScorer
+from quality_scoring import perplexities
+
+DEFAULT_BEST_OF = 1
+DEFAULT_PERPLEXITY_WEIGHT = 1.0  # one keyword is worth an e-fold drop in perplexity
+RERANK_COLUMNS = ['candidates', 'rerank_mystery', 'rerank_atmosphere', 'rerank_perplexity', 'rerank_score']
+
+
+def candidate_seeds(seed, n):
+    """
+    Per-candidate seeds: the first candidate keeps the prompt's own seed, so it draws what plain sampling draws
+    """
+    return [seed] + [derive_seed(seed, f"candidate-{i}") for i in range(1, n)]
+
+
+class BestOfNSampler:
+    """
+    Samples N candidates per prompt from one shared prefill and reranks them, keeping only the winner
+    """
+
+    def __init__(self, engine, n, perplexity_weight=DEFAULT_PERPLEXITY_WEIGHT):
+        if engine.model is None:
+            raise ValueError("Best-of-N reranks with the local model; it can't run on a worker pool or warm worker")
+        self.engine = engine
+        self.n = n
+        self.perplexity_weight = perplexity_weight
+        self.scorer = KeywordScorer({'mystery': MYSTERY_ELEMENT_KEYWORDS, 'atmosphere': SUPERNATURAL_ATMOSPHERE_KEYWORDS})
+        self.stats = Counter()
+        self.score_totals = Counter()
+
+    def generate(self, prompts, max_new_tokens, temperature=0.8, top_k=DEFAULT_TOP_K, seeds=None,
+                 sentence_stop=None, prompt_ids=None):
+        """
+        Generate N candidates per prompt and keep the best
+        Returns: per-prompt dicts like GenerationEngine.generate(details=True), plus the RERANK_COLUMNS breakdown
+        """
+        import torch
+
+        engine = self.engine
+        if prompt_ids is None:
+            prompt_ids = engine.tokenizer(list(prompts))['input_ids']
+        prompt_ids = [token_list(ids) for ids in prompt_ids]
+        stop = None if sentence_stop is None else engine.sentence_stop(sentence_stop)
+        n = self.n
+
+        # Every prompt fans out to n rows, so fewer prompts share a batch
+        candidates = [None] * (len(prompts) * n)
+        start = time.perf_counter()
+        for batch in bucket_by_length([len(ids) for ids in prompt_ids], max(engine.batch_size // n, 1)):
+            budgets = [max(max_new_tokens, 1)] * (len(batch) * n)
+            generators = None if seeds is None else engine.make_generators(
+                [seed for i in batch for seed in candidate_seeds(seeds[i], n)])
+            with torch.no_grad():
+                # The prompt is encoded once; its candidates sample from copies of the same cache
+                state = engine.prefill(None, [prompt_ids[i] for i in batch]).expand(n)
+                generated, _ = engine.sample_from(state, budgets, temperature, True, top_k,
+                                                  generators=generators, stop_criteria=stop)
+            for row, result in enumerate(engine.decode_results(generated, budgets, stop)):
+                candidates[batch[row // n] * n + row % n] = result
+            engine.token_counts["prompt_tokens"] += sum(len(prompt_ids[i]) for i in batch)
+            engine.token_counts["generated_tokens"] += sum(len(tokens) for tokens in generated)
+        self.stats["sampling_seconds"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        scores = self.rerank([text for text, _, _ in candidates], [ids for ids in prompt_ids for _ in range(n)])
+        self.stats["rerank_seconds"] += time.perf_counter() - start
+
+        results = []
+        for i, prompt_ids_row in enumerate(prompt_ids):
+            group = scores.iloc[i * n:(i + 1) * n]
+            winner = i * n + int(group['rerank_score'].to_numpy().argmax())
+            text, generated_tokens, stop_reason = candidates[winner]
+            results.append({
+                "continuation": text, "prompt_tokens": len(prompt_ids_row), "generated_tokens": generated_tokens,
+                "stop_reason": stop_reason, "candidates": n, **scores.iloc[winner].to_dict()
+            })
+            # Empty candidates score -inf; they'd make the average (and the gain) infinite
+            finite = group['rerank_score'][group['rerank_score'].map(math.isfinite)]
+            if len(finite):
+                self.score_totals["winner"] += float(finite.max())
+                self.score_totals["candidates"] += float(finite.mean())
+                self.stats["scored_prompts"] += 1
+        self.stats["prompts"] += len(prompts)
+        self.stats["candidates"] += len(candidates)
+        return results
+
+    def rerank(self, texts, context_ids):
+        """
+        Score every candidate at once: keyword counts in one vectorized pass, perplexity given its prompt
+        in one batched forward pass per length bucket
+        Returns: DataFrame with the rerank columns (but `candidates`), aligned with texts
+        """
+        keywords = self.scorer.score(texts)
+        perplexity = perplexities(self.engine.model, self.engine.tokenizer, texts, context_ids=context_ids,
+                                  batch_size=self.engine.batch_size)
+        scores = pd.DataFrame({
+            'rerank_mystery': keywords['mystery'],
+            'rerank_atmosphere': keywords['atmosphere'],
+            'rerank_perplexity': perplexity
+        })
+        # Empty candidates have no perplexity and never win over one that says something
+        log_perplexity = scores['rerank_perplexity'].apply(math.log).fillna(math.inf)
+        scores['rerank_score'] = (scores['rerank_mystery'] + scores['rerank_atmosphere']
+                                  - self.perplexity_weight * log_perplexity)
+        return scores
+
+    def report(self):
+        """
+        Returns: dict of MLflow-ready best-of-N metrics
+        """
+        scored = self.stats["scored_prompts"]
+        return {
+            "best_of_candidates": self.stats["candidates"],
+            # How much reranking gained over keeping a random non-empty candidate
+            "best_of_score_gain": (self.score_totals["winner"] - self.score_totals["candidates"]) / scored
+            if scored else 0.0,
+            "best_of_sampling_seconds": self.stats["sampling_seconds"],
+            "best_of_rerank_seconds": self.stats["rerank_seconds"]
+        }
+
+
+def report_best_of(metrics, n):
+    """
+    Print a run's best-of-N metrics
+    """
+    print(f"\n🏆 Best of {n}: {metrics['best_of_candidates']} candidates sampled in "
+          f"{metrics['best_of_sampling_seconds']:.1f}s, reranked in {metrics['best_of_rerank_seconds']:.1f}s, "
+          f"winners scoring {metrics['best_of_score_gain']:+.2f} over the average candidate")
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Branch Tree Precomputation for Pine Hollow Mystery
+Pre-generates both choices of every scenario, encoding each shared story prefix once and forking its KV cache
+
+Usage:
+    python branch_tree.py --depth 2 --output data/pine_hollow_branch_tree.json
+"""
+
+import argparse
+import json
+import time
+
+import pandas as pd
+
+from generation_engine import DEFAULT_TOP_K, GenerationEngine, build_prompt, derive_seed
+from model_loader import DEFAULT_MODEL_NAME, get_device, load_model
+from story_session import CHOICE_TEMPLATE
+
+CHOICE_KEYS = ('a', 'b')
+
+
+def link_scenarios(scenarios_df):
+    """
+    Chain each scenario to the next one on the same branch_type, in file order
+    Returns: (root scenario ids, dict of scenario id -> next scenario id or None)
+    """
+    next_ids = {}
+    last_seen = {}
+    roots = []
+    for scenario_id, branch_type in zip(scenarios_df.index, scenarios_df['branch_type']):
+        if branch_type in last_seen:
+            next_ids[last_seen[branch_type]] = scenario_id
+        else:
+            roots.append(scenario_id)
+        last_seen[branch_type] = scenario_id
+        next_ids[scenario_id] = None
+    return roots, next_ids
+
+
+def scenario_node(row, scenario_id):
+    return {
+        'scenario_id': int(scenario_id),
+        'branch_type': row['branch_type'],
+        'atmosphere_level': row['atmosphere_level'],
+        'prompt': row['prompt'],
+        'response': row['response'],
+        'choices': {}
+    }
+
+
+class BranchTreeBuilder:
+    """
+    Expands story trees level by level; every open node at a level shares one batched forward pass
+    """
+
+    def __init__(self, engine, scenarios_df, max_new_tokens=40, temperature=0.8, top_k=DEFAULT_TOP_K, seed=42):
+        self.engine = engine
+        self.tokenizer = engine.tokenizer
+        self.scenarios_df = scenarios_df
+        self.roots, self.next_ids = link_scenarios(scenarios_df)
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_k = top_k
+        self.seed = seed
+        self.max_positions = engine.model.config.n_positions
+        self.stats = {'nodes': 0, 'branches': 0, 'prefill_tokens': 0, 'naive_prefill_tokens': 0,
+                      'truncated_branches': 0}
+
+    def build(self, depth=2, root_ids=None):
+        """
+        Returns: list of tree dicts, one per root scenario
+        """
+        import torch
+
+        root_ids = self.roots if root_ids is None else root_ids
+        trees = [scenario_node(self.scenarios_df.loc[i], i) for i in root_ids]
+
+        # Each open node: (tree node, path used for seeding, tokens of the story so far)
+        open_nodes = []
+        with torch.no_grad():
+            prompts = [build_prompt(self.scenarios_df.loc[i]) for i in root_ids]
+            for node, prompt in zip(trees, prompts):
+                open_nodes.append((node, str(node['scenario_id']), self.tokenizer.encode(prompt)))
+            state = self.engine.prefill(prompts)
+            self.stats['prefill_tokens'] += sum(len(ids) for _, _, ids in open_nodes)
+
+            for level in range(depth):
+                if not open_nodes:
+                    break
+                state, open_nodes = self._expand_level(state, open_nodes, last_level=level == depth - 1)
+
+        return trees
+
+    def _expand_level(self, state, open_nodes, last_level):
+        """
+        Fork every open node into its two choices and generate both branches in one batch
+        Returns: (state holding the children that continue, list of those children as open nodes)
+        """
+        branches = []
+        for node, path, story_ids in open_nodes:
+            row = self.scenarios_df.loc[node['scenario_id']]
+            for key in CHOICE_KEYS:
+                choice_ids = self.tokenizer.encode(CHOICE_TEMPLATE.format(choice=row[f'choice_{key}']))
+                branches.append((node, f"{path}/{key}", key, row[f'choice_{key}'], story_ids + choice_ids, choice_ids))
+        self.stats['nodes'] += len(open_nodes)
+        self.stats['branches'] += len(branches)
+
+        # The shared prefix was encoded once; regenerating each branch from scratch would re-encode it per branch
+        self.stats['prefill_tokens'] += sum(len(choice_ids) for *_, choice_ids in branches)
+        self.stats['naive_prefill_tokens'] += sum(len(branch_ids) for *_, branch_ids, _ in branches)
+
+        state = self.engine.extend(state.expand(len(CHOICE_KEYS)), [choice_ids for *_, choice_ids in branches])
+        budgets = [max(min(self.max_new_tokens, self.max_positions - len(branch_ids)), 0)
+                   for *_, branch_ids, _ in branches]
+        generators = self.engine.make_generators([derive_seed(self.seed, path) for _, path, *_ in branches])
+        generated, state = self.engine.sample_from(state, budgets, self.temperature, top_k=self.top_k,
+                                                   generators=generators, keep_cache=not last_level)
+
+        children = []
+        keep_rows = []
+        suffixes = []
+        for row_idx, ((node, path, key, choice, branch_ids, _), tokens) in enumerate(zip(branches, generated)):
+            branch = {'choice': choice,
+                      'continuation': self.tokenizer.decode(tokens, skip_special_tokens=True).strip()}
+            node['choices'][key] = branch
+
+            next_id = self.next_ids[node['scenario_id']]
+            if last_level or next_id is None:
+                continue
+
+            next_row = self.scenarios_df.loc[next_id]
+            next_ids = self.tokenizer.encode(f" {next_row['prompt']} {next_row['response']}")
+            story_ids = branch_ids + tokens + next_ids
+            # Stop before the story outgrows GPT-2's context; serving rebuilds from the tail there anyway
+            if len(story_ids) + self.max_new_tokens + 16 > self.max_positions:
+                self.stats['truncated_branches'] += 1
+                continue
+
+            branch['next'] = scenario_node(next_row, next_id)
+            children.append((branch['next'], path, story_ids))
+            keep_rows.append(row_idx)
+            suffixes.append(next_ids)
+
+        if not children:
+            return None, []
+
+        self.stats['prefill_tokens'] += sum(len(ids) for ids in suffixes)
+        return self.engine.extend(state.select(keep_rows), suffixes), children
+
+    def report(self):
+        saved = self.stats['naive_prefill_tokens'] - self.stats['prefill_tokens']
+        return {
+            **self.stats,
+            'prefill_tokens_saved': saved,
+            'prefill_savings_ratio': saved / self.stats['naive_prefill_tokens'] if self.stats['naive_prefill_tokens'] else 0.0
+        }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Precompute Pine Hollow story branches offline")
+    parser.add_argument("--model-name", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--data", default="data/pine_hollow_expanded.csv",
+                        help="Scenario CSV with choice_a/choice_b and branch_type columns")
+    parser.add_argument("--output", default="data/pine_hollow_branch_tree.json")
+    parser.add_argument("--depth", type=int, default=2,
+                        help="Choice levels to expand below each root scenario")
+    parser.add_argument("--roots", type=int, nargs="*",
+                        help="Root scenario ids (default: the first scenario of each branch_type)")
+    parser.add_argument("--max-new-tokens", type=int, default=40)
+    parser.add_argument("--temperature", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Base seed; every branch samples with a seed derived from its path")
+    parser.add_argument("--no-mlflow", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print("🌲 Precomputing Pine Hollow branch trees")
+
+    scenarios_df = pd.read_csv(args.data)
+    device = get_device()
+    model, tokenizer = load_model(args.model_name, device)
+
+    engine = GenerationEngine(model, tokenizer, device=device)
+    builder = BranchTreeBuilder(engine, scenarios_df, args.max_new_tokens, args.temperature, seed=args.seed)
+
+    start = time.perf_counter()
+    trees = builder.build(args.depth, args.roots)
+    elapsed = time.perf_counter() - start
+    report = builder.report()
+
+    with open(args.output, 'w') as f:
+        json.dump({'model_name': args.model_name, 'depth': args.depth, 'seed': args.seed, 'trees': trees}, f, indent=2)
+
+    print(f"🌳 {len(trees)} trees, {report['nodes']} nodes, {report['branches']} branches in {elapsed:.1f}s")
+    print(f"⚡ Prefill tokens: {report['prefill_tokens']} vs {report['naive_prefill_tokens']} naive "
+          f"({report['prefill_savings_ratio']:.0%} saved)")
+    print(f"📁 Tree: {args.output}")
+
+    if not args.no_mlflow:
+        from tracking import BufferedTracker
+        tracker = BufferedTracker("cyoa_model_experiments", "pine_hollow_branch_tree")
+        tracker.log_param("model_name", args.model_name)
+        tracker.log_param("depth", args.depth)
+        tracker.log_param("seed", args.seed)
+        tracker.log_metric("branch_tree_seconds", elapsed)
+        tracker.log_metrics(report)
+        tracker.log_artifact(args.output)
+        if tracker.close():
+            print("✅ Branch tree logged to MLflow")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,21 +4,52 @@ Data Collection Pipeline for Pine Hollow Mystery
 Collects and processes Twin Peaks scripts for authentic dialogue patterns
 """
 
+import argparse
+import numpy as np
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
 import re
 import time
-import mlflow
+from html.parser import HTMLParser
+from itertools import chain, islice
 from pathlib import Path
+from urllib.parse import urljoin
 
-def collect_twin_peaks_scripts():
+from dataset_registry import DatasetRegistry
+from instrumentation import StageProfiler, add_profile_arguments
+from tracking import BufferedTracker
+
+SOURCE_DATASET = "data/pine_hollow_enhanced_v2.csv"
+ENHANCED_DATASET = "data/pine_hollow_enhanced.csv"
+
+# Dialogue style for each story branch: (substring of branch_type, style), first match wins
+DIALOGUE_STYLE_RULES = [
+    ("sheriff", "straightforward_concerned"),
+    ("diner", "warm_informative"),
+]
+DEFAULT_DIALOGUE_STYLE = "quirky_observational"
+
+# Screenplay layout of the script pages
+SCENE_HEADING = re.compile(r"^(INT\.|EXT\.|INT/EXT\.)")
+CHARACTER_CUE = re.compile(r"^([A-Z][A-Z0-9 .'\-]*[A-Z.])\s*(\([A-Z. ]+\))?$")
+MAX_CUE_LENGTH = 40
+DIALOGUE_COLUMNS = ["character", "dialogue", "context", "source"]
+DIALOGUE_CHUNK_SIZE = 10000
+
+def collect_twin_peaks_scripts(script_urls=None, fetcher=None):
     """
     Collect Twin Peaks scripts from online sources
+    script_urls: script pages to scrape; without them the curated Episode 1 lines are used
+    fetcher: optional script_scraper.ScriptFetcher (cache location, workers, rate limit)
     Returns: DataFrame with dialogue, character, and context
     """
     print("🌲 Collecting Twin Peaks scripts...")
     
+    if script_urls:
+        from script_scraper import scrape_scripts
+        return scrape_scripts(script_urls, fetcher)
+    
     # Real Twin Peaks Episode 1 dialogue patterns from lynchnet.com
     authentic_dialogue = [
         {
@@ -73,6 +104,121 @@ def collect_twin_peaks_scripts():
     
     return pd.DataFrame(authentic_dialogue)
 
+class _ScriptTextParser(HTMLParser):
+    """
+    Incremental HTML-to-text: feed it pieces of a page, collect the text seen so far
+    """
+    LINE_BREAK_TAGS = {"br", "p", "div", "pre", "tr", "li", "h1", "h2", "h3", "h4", "h5", "h6"}
+    SKIPPED_TAGS = {"script", "style"}
+    
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skipping = 0
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self._skipping += 1
+        elif tag in self.LINE_BREAK_TAGS:
+            self.parts.append("\n")
+    
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self._skipping = max(self._skipping - 1, 0)
+        elif tag in self.LINE_BREAK_TAGS:
+            self.parts.append("\n")
+    
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+    
+    def take_text(self):
+        text = "".join(self.parts)
+        self.parts.clear()
+        return text
+
+def read_blocks(path, block_size=1 << 16):
+    """
+    Yield a text file block by block
+    """
+    with open(path, encoding="utf-8", errors="replace") as f:
+        while block := f.read(block_size):
+            yield block
+
+def iter_text_lines(blocks, html=True):
+    """
+    Yield text lines from blocks of a script as they arrive, stripping HTML markup on the way
+    """
+    parser = _ScriptTextParser() if html else None
+    pending = ""
+    for block in blocks:
+        if parser is not None:
+            parser.feed(block)
+            block = parser.take_text()
+        *lines, pending = (pending + block).split("\n")
+        yield from lines
+    
+    if parser is not None:
+        parser.close()
+        pending += parser.take_text()
+    if pending:
+        yield from pending.split("\n")
+
+def iter_dialogue(lines, source=None):
+    """
+    Line-based screenplay state machine: scene headings set the context, a character cue opens a speech
+    and a blank line closes it
+    Yields: dict per speech with character, dialogue, context and source
+    """
+    context = None
+    character = None
+    speech = []
+    
+    for line in chain(lines, [""]):
+        stripped = line.strip()
+        if not stripped or SCENE_HEADING.match(stripped):
+            if character and speech:
+                yield {"character": character, "dialogue": " ".join(speech), "context": context, "source": source}
+            character = None
+            speech = []
+            if stripped:
+                context = stripped
+        elif character is None:
+            cue = CHARACTER_CUE.match(stripped) if len(stripped) <= MAX_CUE_LENGTH else None
+            # Anything else outside a speech is action description
+            if cue:
+                character = cue.group(1).title()
+        elif not (stripped.startswith("(") and stripped.endswith(")")):
+            # Parentheticals like "(smiling)" are stage directions, not dialogue
+            speech.append(stripped)
+
+def write_dialogue_chunks(records, output_path, chunk_size=DIALOGUE_CHUNK_SIZE):
+    """
+    Append dialogue records to a CSV chunk_size rows at a time, so only one chunk is ever in memory
+    Returns: number of rows written
+    """
+    records = iter(records)
+    written = 0
+    
+    # Header first, so a script without dialogue still produces a readable CSV
+    pd.DataFrame(columns=DIALOGUE_COLUMNS).to_csv(output_path, index=False)
+    while chunk := list(islice(records, chunk_size)):
+        pd.DataFrame(chunk, columns=DIALOGUE_COLUMNS).to_csv(output_path, mode="a", header=False, index=False)
+        written += len(chunk)
+    return written
+
+def extract_dialogue(script_paths, output_path, chunk_size=DIALOGUE_CHUNK_SIZE):
+    """
+    Stream dialogue from script files (.html/.htm or plain text) into a CSV with flat memory use
+    Returns: number of dialogue rows written
+    """
+    records = chain.from_iterable(
+        iter_dialogue(iter_text_lines(read_blocks(path), html=Path(path).suffix.lower() in (".html", ".htm")),
+                      source=str(path))
+        for path in script_paths
+    )
+    return write_dialogue_chunks(records, output_path, chunk_size)
+
 def extract_dialogue_patterns(df):
     """
     Extract dialogue patterns and speech characteristics from authentic Twin Peaks script
@@ -120,80 +266,119 @@ def extract_dialogue_patterns(df):
     
     return patterns
 
-def create_mystery_dataset(dialogue_df, patterns):
+def tag_dialogue_styles(pine_hollow_df, rules=None, default=None):
     """
-    Create our Pine Hollow mystery dataset using Twin Peaks patterns
+    Add dialogue style indicators to Pine Hollow scenario rows, one output row per input row
+    rules: (branch substring, dialogue style) pairs, first match wins; unmatched branches get `default`
+           (DIALOGUE_STYLE_RULES and DEFAULT_DIALOGUE_STYLE, read at call time like the registry params)
     """
-    print("🏔️ Creating Pine Hollow mystery dataset...")
+    rules = DIALOGUE_STYLE_RULES if rules is None else rules
+    default = DEFAULT_DIALOGUE_STYLE if default is None else default
+    branches = pine_hollow_df['branch_type'].astype('category')
     
-    # Read our enhanced Pine Hollow data with authentic Twin Peaks patterns
-    pine_hollow_df = pd.read_csv("data/pine_hollow_enhanced_v2.csv")
+    # Rules run once per distinct branch, then broadcast to every row through the category codes
+    styles = [next((style for pattern, style in rules if pattern in branch), default)
+              for branch in branches.cat.categories]
+    lookup = np.array(styles + [default], dtype=object)  # code -1 (missing branch) picks the default
     
-    # Enhance it with Twin Peaks dialogue patterns
-    enhanced_data = []
+    return pine_hollow_df.assign(dialogue_style=lookup[branches.cat.codes.to_numpy()])
+
+def create_mystery_dataset(dialogue_df, patterns, registry=None):
+    """
+    Create our Pine Hollow mystery dataset using Twin Peaks patterns
+    registry: DatasetRegistry recording the build; only rows whose source row changed are re-tagged
+    """
+    print("🏔️ Creating Pine Hollow mystery dataset...")
     
-    for idx, row in pine_hollow_df.iterrows():
-        enhanced_row = row.copy()
-        
-        # Add dialogue style indicators
-        branch = row['branch_type']
-        if 'sheriff' in branch:
-            enhanced_row['dialogue_style'] = 'straightforward_concerned'
-        elif 'diner' in branch:
-            enhanced_row['dialogue_style'] = 'warm_informative'
-        else:
-            enhanced_row['dialogue_style'] = 'quirky_observational'
-            
-        enhanced_data.append(enhanced_row)
+    # Enhance our Pine Hollow data with Twin Peaks dialogue patterns, writing data/pine_hollow_enhanced.csv
+    registry = registry or DatasetRegistry()
+    # The rule table is data, not code, so it joins the transform's identity: editing it re-tags every row
+    enhanced_df, rebuilt = registry.build_rowwise(ENHANCED_DATASET, SOURCE_DATASET, tag_dialogue_styles,
+                                                  params=(DIALOGUE_STYLE_RULES, DEFAULT_DIALOGUE_STYLE))
+    print(f"   • Tagged {rebuilt} new or changed rows, reused {len(enhanced_df) - rebuilt}")
     
-    return pd.DataFrame(enhanced_data)
+    return enhanced_df
 
-def log_to_mlflow(enhanced_df, patterns):
+def log_to_mlflow(enhanced_df, patterns, profiler=None):
     """
     Log our data collection to MLflow for tracking
+    profiler: optional StageProfiler whose stage timings are logged with the run
     """
     print("📊 Logging to MLflow...")
     
-    mlflow.set_experiment("cyoa_mystery_data")
-    
-    with mlflow.start_run(run_name="twin_peaks_data_collection"):
+    # Sent from a background thread; an unreachable tracking store spools instead of failing
+    tracker = BufferedTracker("cyoa_mystery_data", "twin_peaks_data_collection")
+    profiler = profiler or StageProfiler()
+    with profiler.stage("mlflow_logging"):
         # Log parameters
-        mlflow.log_param("data_source", "twin_peaks_scripts") 
-        mlflow.log_param("story_theme", "pine_hollow_mystery")
-        mlflow.log_param("num_story_segments", len(enhanced_df))
-        mlflow.log_param("dialogue_styles", list(patterns.keys()))
+        tracker.log_param("data_source", "twin_peaks_scripts") 
+        tracker.log_param("story_theme", "pine_hollow_mystery")
+        tracker.log_param("num_story_segments", len(enhanced_df))
+        tracker.log_param("dialogue_styles", list(patterns.keys()))
         
+        # Dataset versions this run produced, from the registry create_mystery_dataset updated
+        registry = DatasetRegistry()
+        tracker.log_param("source_dataset_hash", registry.version(SOURCE_DATASET)["hash"])
+        tracker.log_param("enhanced_dataset_hash", registry.version(ENHANCED_DATASET)["hash"])
+    
         # Log metrics
-        mlflow.log_metric("stories_per_branch", len(enhanced_df) / 3)
-        mlflow.log_metric("twin_peaks_atmosphere_level", 1.0)
-        
+        tracker.log_metric("stories_per_branch", len(enhanced_df) / 3)
+        tracker.log_metric("twin_peaks_atmosphere_level", 1.0)
+    
         # Save datasets as artifacts
-        enhanced_df.to_csv("data/pine_hollow_enhanced.csv", index=False)
-        mlflow.log_artifact("data/pine_hollow_enhanced.csv")
-        mlflow.log_artifact("data/character_profiles.csv")
-        
+        tracker.log_artifact(ENHANCED_DATASET)
+        tracker.log_artifact("data/character_profiles.csv")
+        tracker.log_artifact(registry.path)
+    
+    profiler.log_to_mlflow(tracker)
+    if tracker.close():
         print("✅ Data collection logged to MLflow")
 
 def main():
     """
     Main data collection pipeline
     """
+    parser = argparse.ArgumentParser(description="Twin Peaks data collection pipeline")
+    parser.add_argument("--base-url", default=None,
+                        help="Site to scrape script pages from (default: curated Episode 1 lines)")
+    parser.add_argument("--pages", nargs="*", default=[],
+                        help="Script page paths relative to --base-url")
+    parser.add_argument("--script-files", nargs="*", default=[],
+                        help="Local script files (.html or plain text) to stream dialogue from")
+    parser.add_argument("--dialogue-output", default="data/twin_peaks_dialogue.csv",
+                        help="CSV the streamed dialogue from --script-files is written to")
+    args = add_profile_arguments(parser).parse_args()
+    profiler = StageProfiler(args.profile, args.profile_dir)
+    
     print("🎬 Starting Twin Peaks Data Collection Pipeline...")
     
     # Step 1: Collect Twin Peaks scripts
-    dialogue_df = collect_twin_peaks_scripts()
+    with profiler.stage("collect_scripts"):
+        if args.script_files:
+            # Straight from the files to disk; the dialogue rows are never held in memory together
+            dialogue_rows = extract_dialogue(args.script_files, args.dialogue_output)
+            dialogue_df = None  # the pattern catalogue below doesn't depend on the rows
+            print(f"📜 Streamed {dialogue_rows} dialogue lines to {args.dialogue_output}")
+        else:
+            script_urls = [urljoin(args.base_url, page) for page in args.pages] if args.base_url else None
+            dialogue_df = collect_twin_peaks_scripts(script_urls)
+            dialogue_rows = len(dialogue_df)
+    profiler.count("collect_scripts", "rows", dialogue_rows)
     
     # Step 2: Extract patterns
-    patterns = extract_dialogue_patterns(dialogue_df)
+    with profiler.stage("extract_patterns"):
+        patterns = extract_dialogue_patterns(dialogue_df)
     
     # Step 3: Create enhanced mystery dataset  
-    enhanced_df = create_mystery_dataset(dialogue_df, patterns)
+    with profiler.stage("create_dataset"):
+        enhanced_df = create_mystery_dataset(dialogue_df, patterns)
+    profiler.count("create_dataset", "rows", len(enhanced_df))
     
-    # Step 4: Log to MLflow
-    log_to_mlflow(enhanced_df, patterns)
+    # Step 4: Log to MLflow, stage timings included
+    log_to_mlflow(enhanced_df, patterns, profiler)
     
     print("🌲 Pine Hollow data collection complete!")
-    print(f"📁 Enhanced dataset saved: data/pine_hollow_enhanced.csv")
+    print(f"📁 Enhanced dataset saved: {ENHANCED_DATASET}")
     print(f"🎭 Dialogue styles: {list(patterns.keys())}")
 
 if __name__ == "__main__":
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Dataset Registry for Pine Hollow Mystery
+Content-hashes source and derived datasets, records their lineage and rebuilds only the derived rows that changed
+
+Usage:
+    python dataset_registry.py                                    # list registered datasets
+    python dataset_registry.py --lineage data/pine_hollow_enhanced.csv
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import time
+from pathlib import Path
+
+import pandas as pd
+
+DEFAULT_REGISTRY_PATH = "data/dataset_registry.json"
+HASH_LENGTH = 16
+
+
+def content_hash(path, block_size=1 << 20):
+    """
+    SHA-256 of a file's bytes, or of every file under a directory (e.g. Parquet part files)
+    Returns: hex digest truncated to HASH_LENGTH
+    """
+    path = Path(path)
+    files = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+    sha = hashlib.sha256()
+    for file in files:
+        if path.is_dir():
+            sha.update(str(file.relative_to(path)).encode('utf-8'))
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                sha.update(block)
+    return sha.hexdigest()[:HASH_LENGTH]
+
+
+def row_hashes(df):
+    """
+    Returns: one hex hash per row, from the row's values only
+    """
+    return [f"{value:016x}" for value in pd.util.hash_pandas_object(df, index=False)]
+
+
+def transform_id(transform, params=None):
+    """
+    Name plus a hash of the transform's source and params, so editing either invalidates what it derived
+    params: anything else the output depends on that the function's own source doesn't show - rule tables,
+            default arguments, helpers' versions - as a value with a stable repr
+    """
+    source = inspect.getsource(transform) + ("" if params is None else repr(params))
+    source_hash = hashlib.sha256(source.encode('utf-8')).hexdigest()[:8]
+    # No module name: it is __main__ when the pipeline runs as a script
+    return f"{transform.__qualname__}@{source_hash}"
+
+
+class DatasetRegistry:
+    """
+    JSON record of every dataset version: content hash, row count, inputs and the transform that built it
+    """
+
+    def __init__(self, path=DEFAULT_REGISTRY_PATH):
+        self.path = Path(path)
+        self.datasets = json.loads(self.path.read_text())["datasets"] if self.path.exists() else {}
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Write-then-rename so an interrupted save can't leave a truncated registry
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps({"datasets": self.datasets}, indent=2))
+        tmp_path.replace(self.path)
+
+    def version(self, path):
+        """
+        Returns: the latest registered version of a dataset, or None
+        """
+        versions = self.datasets.get(str(path), {}).get("versions")
+        return versions[-1] if versions else None
+
+    def register(self, path, inputs=None, transform=None, rows=None, hashes=None):
+        """
+        Record a dataset's current content; a new hash is appended as a new version
+        inputs: {input path: content hash} it was derived from
+        hashes: per-row hashes of the input rows behind each output row, for incremental rebuilds
+        Returns: the dataset's content hash
+        """
+        digest = content_hash(path)
+        entry = self.datasets.setdefault(str(path), {"versions": []})
+        latest = entry["versions"][-1] if entry["versions"] else None
+        version = {"hash": digest, "rows": rows, "inputs": inputs or {}, "transform": transform}
+
+        is_new = latest is None or latest["hash"] != digest
+        # Re-registering unchanged content without lineage (e.g. a run recording its input) keeps the old entry
+        if not is_new and transform is not None:
+            is_new = (latest["inputs"], latest["transform"]) != (version["inputs"], transform)
+        if is_new:
+            entry["versions"].append({**version, "registered_at": time.strftime('%Y-%m-%dT%H:%M:%S')})
+        if hashes is not None and entry.get("row_hashes") != hashes:
+            entry["row_hashes"] = hashes
+            is_new = True
+        # Runs that only record their unchanged input leave the file alone
+        if is_new:
+            self.save()
+        return digest
+
+    def lineage(self, path, digest=None):
+        """
+        Returns: nested dict of a dataset version and, recursively, the input versions it was built from
+        """
+        versions = self.datasets.get(str(path), {}).get("versions", [])
+        version = next((v for v in reversed(versions) if digest in (None, v["hash"])), None)
+        if version is None:
+            return {"path": str(path), "hash": digest, "registered": False}
+        return {
+            "path": str(path),
+            "hash": version["hash"],
+            "rows": version["rows"],
+            "transform": version["transform"],
+            "registered_at": version["registered_at"],
+            "inputs": [self.lineage(input_path, input_hash) for input_path, input_hash in version["inputs"].items()]
+        }
+
+    def build_rowwise(self, output_path, input_path, transform, params=None):
+        """
+        Derive a CSV from another with a row-wise transform, running it only on new or changed input rows
+        transform: DataFrame -> DataFrame with one output row per input row, in the same order
+        params: data the transform depends on beyond its source (see transform_id)
+        Returns: (derived DataFrame, number of rows the transform was run on)
+        """
+        output_path, input_path = Path(output_path), Path(input_path)
+        inputs = {str(input_path): self.register(input_path)}
+        name = transform_id(transform, params)
+        current = self.version(output_path)
+
+        # Earlier output is only trusted if it is exactly what this transform last wrote
+        reusable = (current is not None and current["transform"] == name and output_path.exists()
+                    and content_hash(output_path) == current["hash"])
+        if reusable and current["inputs"] == inputs:
+            return pd.read_csv(output_path), 0
+
+        source = pd.read_csv(input_path)
+        hashes = row_hashes(source)
+        previous = {}
+        if reusable:
+            old = pd.read_csv(output_path)
+            previous = {h: row for row, h in enumerate(self.datasets[str(output_path)].get("row_hashes", []))}
+
+        changed = [i for i, h in enumerate(hashes) if h not in previous]
+        reused = [i for i, h in enumerate(hashes) if h in previous]
+        parts = []
+        if reused:
+            parts.append(old.iloc[[previous[hashes[i]] for i in reused]].set_axis(reused))
+        if changed or not reused:
+            parts.append(transform(source.iloc[changed]).set_axis(changed))
+        derived = pd.concat(parts).sort_index().reset_index(drop=True)
+
+        derived.to_csv(output_path, index=False)
+        self.register(output_path, inputs=inputs, transform=name, rows=len(derived), hashes=hashes)
+        return derived, len(changed)
+
+
+def print_lineage(node, depth=0):
+    if not node.get("registered_at"):
+        status = "not registered"
+    elif node["rows"] is None:
+        status = node["registered_at"]
+    else:
+        status = f"{node['rows']} rows, {node['registered_at']}"
+    print(f"{'   ' * depth}• {node['path']} @ {node['hash']} ({status})")
+    if node.get("transform"):
+        print(f"{'   ' * depth}  built by {node['transform']}")
+    for child in node.get("inputs", []):
+        print_lineage(child, depth + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the Pine Hollow dataset registry")
+    parser.add_argument("--registry", default=DEFAULT_REGISTRY_PATH)
+    parser.add_argument("--lineage", default=None, help="Dataset path whose lineage to show")
+    args = parser.parse_args()
+
+    registry = DatasetRegistry(args.registry)
+    if args.lineage:
+        print_lineage(registry.lineage(args.lineage))
+        return
+
+    print(f"📚 {len(registry.datasets)} registered datasets")
+    for path, entry in sorted(registry.datasets.items()):
+        latest = entry["versions"][-1]
+        current = content_hash(path) if Path(path).exists() else None
+        status = "" if current == latest["hash"] else " ⚠️ changed since registered"
+        print(f"   • {path}: {latest['hash']}, {len(entry['versions'])} versions{status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Near-Duplicate Index for Pine Hollow Mystery
+MinHash signatures with LSH banding, so near-duplicate prompts, responses and continuations are found
+without comparing every pair
+
+Usage:
+    python dedup_index.py data/pine_hollow_expanded.csv generated_stories_pine_hollow_baseline.csv
+    python dedup_index.py data/*.csv --index .dedup_index     # keep the index, add only new rows next time
+"""
+
+import argparse
+import json
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_THRESHOLD = 0.8      # estimated Jaccard similarity of character shingles
+DEFAULT_NUM_PERM = 128
+DEFAULT_SHINGLE_SIZE = 5
+DEDUP_COLUMNS = ['prompt', 'response', 'human_response', 'ai_response']
+PRIME = (1 << 31) - 1        # keeps a * x + b inside uint64
+
+
+def choose_bands(num_perm, threshold):
+    """
+    Pick bands x rows = num_perm whose LSH threshold (1/bands)^(1/rows) sits closest to the target,
+    preferring a lower one so fewer true duplicates slip through
+    Returns: (bands, rows)
+    """
+    options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    implied = {option: (1 / option[0]) ** (1 / option[1]) for option in options}
+    below = [option for option in options if implied[option] <= threshold] or options
+    return min(below, key=lambda option: abs(implied[option] - threshold))
+
+
+def shingles(text, size=DEFAULT_SHINGLE_SIZE):
+    """
+    Returns: set of character n-grams of the lowercased, whitespace-normalized text
+    """
+    text = ' '.join(str(text).lower().split())
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class DedupIndex:
+    """
+    Incremental MinHash/LSH index: each added row is checked against earlier rows through its band buckets
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, num_perm=DEFAULT_NUM_PERM, shingle_size=DEFAULT_SHINGLE_SIZE,
+                 seed=42):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+
+        # One universal hash a * x + b mod PRIME per permutation
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, PRIME, num_perm, dtype=np.uint64)
+
+        self.keys = []
+        self._key_positions = {}
+        self._signatures = np.empty((1024, num_perm), dtype=np.uint64)  # grown by doubling, first len(keys) rows used
+        self._buckets = [{} for _ in range(self.bands)]
+        self.duplicate_rows = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def signature(self, text):
+        """
+        Returns: MinHash signature of a text, or None for empty text
+        """
+        grams = shingles(text, self.shingle_size)
+        if not grams:
+            return None
+        hashes = np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams))
+        return ((self._a[:, None] * (hashes % PRIME)[None, :] + self._b[:, None]) % PRIME).min(axis=1)
+
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def query(self, text=None, signature=None):
+        """
+        Returns: list of (key, estimated similarity) for indexed rows at or above the threshold, most similar first
+        """
+        signature = self.signature(text) if signature is None else signature
+        if signature is None:
+            return []
+
+        candidates = set()
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(band_key, ()))
+        if not candidates:
+            return []
+
+        # Only rows sharing a band are compared, and then all at once
+        positions = np.fromiter(candidates, dtype=np.int64)
+        similarity = (self._signatures[positions] == signature).mean(axis=1)
+        matches = [(self.keys[p], float(s)) for p, s in zip(positions, similarity) if s >= self.threshold]
+        return sorted(matches, key=lambda match: -match[1])
+
+    def add(self, key, text):
+        """
+        Index a row, unless its key is already indexed
+        Returns: near-duplicates among the rows indexed before it
+        """
+        if key in self._key_positions:
+            return []
+        signature = self.signature(text)
+        if signature is None:
+            return []
+
+        matches = self.query(signature=signature)
+        if matches:
+            self.duplicate_rows += 1
+
+        self._insert(key, signature)
+        return matches
+
+    def _insert(self, key, signature):
+        position = len(self.keys)
+        if position == len(self._signatures):
+            self._signatures = np.concatenate([self._signatures, np.empty_like(self._signatures)])
+        self._signatures[position] = signature
+        self.keys.append(key)
+        self._key_positions[key] = position
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(band_key, []).append(position)
+
+    @property
+    def dedup_ratio(self):
+        """
+        Share of indexed rows that near-duplicate an earlier row
+        """
+        return self.duplicate_rows / len(self.keys) if self.keys else 0.0
+
+    def save(self, path):
+        np.savez_compressed(
+            path, signatures=self._signatures[:len(self.keys)], keys=np.array(self.keys, dtype=str),
+            params=np.array([self.threshold, self.num_perm, self.shingle_size, self.seed, self.duplicate_rows])
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        threshold, num_perm, shingle_size, seed, duplicate_rows = data['params'].tolist()
+        index = cls(threshold, int(num_perm), int(shingle_size), int(seed))
+        for key, signature in zip(data['keys'].tolist(), data['signatures']):
+            index._insert(key, signature)
+        index.duplicate_rows = int(duplicate_rows)
+        return index
+
+
+def index_chunks(chunks, columns, indexes=None, source='', key_column='scenario_id', **index_kwargs):
+    """
+    Feed DataFrame chunks into one index per column as they arrive
+    Returns: (dict of column -> DedupIndex, list of (column, key, duplicate of key, similarity))
+    """
+    indexes = indexes if indexes is not None else {}
+    duplicates = []
+    offset = 0
+    for chunk in chunks:
+        keys = chunk[key_column] if key_column in chunk.columns else range(offset, offset + len(chunk))
+        offset += len(chunk)
+        for column in columns:
+            if column not in chunk.columns:
+                continue
+            if column not in indexes:
+                indexes[column] = DedupIndex(**index_kwargs)
+            index = indexes[column]
+            for key, text in zip(keys, chunk[column]):
+                if pd.isna(text):
+                    continue
+                matches = index.add(f"{source}:{key}", text)
+                if matches:
+                    duplicates.append((column, f"{source}:{key}", *matches[0]))
+    return indexes, duplicates
+
+
+def results_dedup_metrics(results_path, columns=('ai_response',), threshold=DEFAULT_THRESHOLD):
+    """
+    Near-duplicate ratios of a run's results, read chunk by chunk
+    Returns: dict of `<column>_dedup_ratio` and `<column>_duplicate_rows` metrics
+    """
+    from streaming_pipeline import iter_result_chunks
+
+    chunks = iter_result_chunks(results_path, usecols=['scenario_id', *columns])
+    indexes, _ = index_chunks(chunks, columns, source=Path(results_path).name, threshold=threshold)
+    metrics = {}
+    for column in columns:
+        # A column with no text at all never gets an index
+        index = indexes.get(column) or DedupIndex(threshold=threshold)
+        metrics[f"{column}_dedup_ratio"] = index.dedup_ratio
+        metrics[f"{column}_duplicate_rows"] = index.duplicate_rows
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find near-duplicate scenarios and generations")
+    parser.add_argument("paths", nargs="+", help="Scenario or results CSVs")
+    parser.add_argument("--columns", nargs="+", default=DEDUP_COLUMNS)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--index", default=None,
+                        help="Path prefix of saved indexes to extend (one .npz per column)")
+    parser.add_argument("--output", default=None, help="Write the duplicate pairs and ratios as JSON")
+    args = parser.parse_args()
+
+    indexes = {}
+    if args.index:
+        for column in args.columns:
+            path = Path(f"{args.index}.{column}.npz")
+            if path.exists():
+                indexes[column] = DedupIndex.load(path)
+
+    duplicates = []
+    for path in args.paths:
+        header = pd.read_csv(path, nrows=0).columns
+        chunks = pd.read_csv(path, chunksize=args.chunk_size,
+                             usecols=[c for c in header if c in args.columns or c == 'scenario_id'])
+        # One index per column across all files, so rows appended to one dataset are checked against the others
+        indexes, found = index_chunks(chunks, args.columns, indexes, source=path, threshold=args.threshold)
+        duplicates += found
+
+    print(f"🔁 Near-duplicates at similarity >= {args.threshold}:")
+    for column, index in indexes.items():
+        print(f"   • {column}: {index.duplicate_rows}/{len(index)} rows ({index.dedup_ratio:.1%})")
+    for column, key, duplicate_of, similarity in duplicates[:20]:
+        print(f"   ↳ {column} {key} ≈ {duplicate_of} ({similarity:.2f})")
+
+    if args.index:
+        for column, index in indexes.items():
+            index.save(f"{args.index}.{column}.npz")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "threshold": args.threshold,
+                "ratios": {column: index.dedup_ratio for column, index in indexes.items()},
+                "duplicates": [dict(zip(("column", "key", "duplicate_of", "similarity"), d)) for d in duplicates]
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
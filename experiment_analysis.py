@@ -7,6 +7,10 @@ Compare GPT-2 performance across different story themes
 import pandas as pd
 import numpy as np
 import os
+from keyword_scoring import (ANIME_GENRE_KEYWORDS, SETTING_ATMOSPHERE_KEYWORDS, CHARACTER_KEYWORDS,
+                             MYSTERY_GENRE_KEYWORDS, ON_TOPIC_KEYWORDS, KeywordScorer)
+from response_scoring import ScoreCache, grouped_scores, report_scores, score_responses
+from scenario_store import ScenarioStore
 
 def analyze_experiments():
     print("📊 CYOA EXPERIMENT ANALYSIS")
@@ -14,7 +18,9 @@ def analyze_experiments():
     
     # Load both experiment results
     if os.path.exists('generated_stories_pine_hollow_baseline.csv'):
-        mystery_df = pd.read_csv('generated_stories_pine_hollow_baseline.csv')
+        # Columnar copy with group indexes, so the breakdowns below don't rescan the label columns
+        mystery_store = ScenarioStore('generated_stories_pine_hollow_baseline.csv')
+        mystery_df = mystery_store.df
         print(f"🌲 Pine Hollow Mystery: {len(mystery_df)} scenarios")
     else:
         print("❌ Pine Hollow results not found")
@@ -35,17 +41,16 @@ def analyze_experiments():
     print(f"\n📈 Basic Metrics:")
     print(f"   • Stories generated: {len(mystery_df)}")
     print(f"   • Avg response length: {mystery_df['ai_response'].str.len().mean():.1f} chars")
-    print(f"   • Twin Peaks scenarios: {len(mystery_df[mystery_df['atmosphere_level'] == 'twin_peaks'])}")
-    print(f"   • Stranger Things scenarios: {len(mystery_df[mystery_df['atmosphere_level'] == 'stranger_things'])}")
+    atmosphere_counts = mystery_store.counts('atmosphere_level')
+    print(f"   • Twin Peaks scenarios: {atmosphere_counts.get('twin_peaks', 0)}")
+    print(f"   • Stranger Things scenarios: {atmosphere_counts.get('stranger_things', 0)}")
     
     print(f"\n🎭 Dialogue Style Distribution:")
-    for style in mystery_df['dialogue_style'].unique():
-        count = len(mystery_df[mystery_df['dialogue_style'] == style])
+    for style, count in mystery_store.counts('dialogue_style').items():
         print(f"   • {style}: {count} scenarios")
     
     print(f"\n🌲 Story Branch Distribution:")
-    for branch in mystery_df['branch_type'].unique():
-        count = len(mystery_df[mystery_df['branch_type'] == branch])
+    for branch, count in mystery_store.counts('branch_type').items():
         print(f"   • {branch}: {count} scenarios")
     
     # Quality analysis
@@ -58,26 +63,39 @@ def analyze_experiments():
     print(f"   • Short responses (<100 chars): {len(short_responses)}")
     print(f"   • Long responses (>500 chars): {len(long_responses)}")
     
+    # Quality indicators for every response in one vectorized pass
+    quality_scores = KeywordScorer({
+        'character': CHARACTER_KEYWORDS,
+        'on_topic': ON_TOPIC_KEYWORDS,
+        'atmosphere': SETTING_ATMOSPHERE_KEYWORDS
+    }).score(mystery_df['ai_response'])
+    
+    print(f"   • Mystery elements present: {(quality_scores['on_topic'] > 0).sum()}/{len(mystery_df)}")
+    print(f"   • Character consistency: {(quality_scores['character'] > 0).sum()}/{len(mystery_df)}")
+    print(f"   • Atmospheric: {(quality_scores['atmosphere'] > 0).sum()}/{len(mystery_df)}")
+    
+    # Model-based quality: batched perplexity and similarity to the human response, cached per response
+    score_cache = ScoreCache()
+    model_scores = score_responses(mystery_df, cache=score_cache)
+    report_scores(model_scores, grouped_scores(mystery_df, model_scores))
+    score_cache.close()
+    
     # Sample analysis
     print(f"\n📝 SAMPLE RESPONSE ANALYSIS:")
     
     for idx in range(min(3, len(mystery_df))):
         row = mystery_df.iloc[idx]
         ai_response = row['ai_response']
+        scores = quality_scores.iloc[idx]
         
         print(f"\n🎬 Sample {idx + 1} ({row['atmosphere_level']} - {row['dialogue_style']}):")
         print(f"   📖 Prompt: {row['prompt'][:80]}...")
         print(f"   👤 Human: {row['human_response'][:80]}...")
         print(f"   🤖 AI: {ai_response[:80]}...")
         
-        # Quality indicators
-        coherent = "Detective" in ai_response or "sheriff" in ai_response.lower() or "coffee" in ai_response.lower()
-        on_topic = any(word in ai_response.lower() for word in ['sarah', 'pine', 'mystery', 'disappeared', 'town'])
-        atmosphere = any(word in ai_response.lower() for word in ['forest', 'fog', 'dark', 'strange', 'whisper'])
-        
-        print(f"   ✅ Mystery elements: {'Yes' if on_topic else 'No'}")
-        print(f"   🎭 Character consistency: {'Yes' if coherent else 'No'}")
-        print(f"   🌫️ Atmospheric: {'Yes' if atmosphere else 'No'}")
+        print(f"   ✅ Mystery elements: {'Yes' if scores['on_topic'] else 'No'}")
+        print(f"   🎭 Character consistency: {'Yes' if scores['character'] else 'No'}")
+        print(f"   🌫️ Atmospheric: {'Yes' if scores['atmosphere'] else 'No'}")
     
     # Comparison with anime if available
     if anime_df is not None:
@@ -94,16 +112,10 @@ def analyze_experiments():
         
         print(f"\n🎯 Theme Consistency:")
         # Check for theme-appropriate keywords
-        mystery_keywords = ['detective', 'sheriff', 'mystery', 'disappeared', 'town', 'coffee']
-        anime_keywords = ['magic', 'academy', 'guild', 'festival', 'cherry', 'spirits']
-        
-        mystery_theme_score = mystery_df['ai_response'].apply(
-            lambda x: sum(1 for kw in mystery_keywords if kw in x.lower())
-        ).mean()
+        theme_scorer = KeywordScorer({'mystery': MYSTERY_GENRE_KEYWORDS, 'anime': ANIME_GENRE_KEYWORDS})
         
-        anime_theme_score = anime_df['ai_response'].apply(
-            lambda x: sum(1 for kw in anime_keywords if kw in x.lower())
-        ).mean()
+        mystery_theme_score = theme_scorer.score(mystery_df['ai_response'])['mystery'].mean()
+        anime_theme_score = theme_scorer.score(anime_df['ai_response'])['anime'].mean()
         
         print(f"   • Mystery theme words per response: {mystery_theme_score:.2f}")
         print(f"   • Anime theme words per response: {anime_theme_score:.2f}")
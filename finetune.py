@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Fine-Tuning for Pine Hollow Mystery
+Fine-tunes GPT-2 on the Pine Hollow scenarios and collected dialogue, packing the short samples into
+full-length sequences that keep each sample's attention and positions to itself
+
+Usage:
+    python finetune.py --epochs 3 --batch-size 2 --grad-accum 8
+    python finetune.py --resume          # continue from the latest checkpoint in --output-dir
+"""
+
+import argparse
+import itertools
+import json
+import random
+import shutil
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from dataset_registry import content_hash
+from generation_engine import token_list
+from model_loader import DEFAULT_MODEL_NAME, get_device, load_model
+from token_store import TokenStore
+
+DEFAULT_SCENARIO_DATASETS = ["data/pine_hollow_enhanced_v2.csv", "data/pine_hollow_expanded.csv"]
+DEFAULT_DIALOGUE_DATASETS = ["data/twin_peaks_dialogue.csv"]
+DEFAULT_OUTPUT_DIR = "checkpoints/pine_hollow_gpt2"
+DEFAULT_SEQ_LEN = 1024
+DEFAULT_OPEN_PACKS = 16      # partially filled sequences kept open for best-fit packing
+DEFAULT_SHUFFLE_BUFFER = 64  # packed sequences shuffled together
+IGNORE_INDEX = -100          # label value the loss skips
+
+
+def iter_scenario_samples(paths, tokenizer_name=DEFAULT_MODEL_NAME, tokenizer=None):
+    """
+    Yield each scenario's tokens straight from its dataset's token store
+    """
+    for path in paths:
+        store = TokenStore.for_dataset(path, tokenizer_name, tokenizer=tokenizer)
+        for scenario_id in store.scenario_ids:
+            yield store.tokens(scenario_id)
+
+
+def iter_dialogue_samples(paths, tokenizer, chunk_size=1000):
+    """
+    Yield tokenized `character: line` samples from dialogue CSVs (see data_collection_pipeline.py), chunk by chunk
+    """
+    for path in paths:
+        if not Path(path).exists():
+            print(f"⚠️ No dialogue at {path}; training on scenarios only")
+            continue
+        for chunk in pd.read_csv(path, usecols=['character', 'dialogue'], chunksize=chunk_size):
+            chunk = chunk.dropna()
+            yield from tokenizer([f"{character}: {line}" for character, line in
+                                  zip(chunk['character'], chunk['dialogue'])])['input_ids']
+
+
+def pack_samples(samples, seq_len=DEFAULT_SEQ_LEN, eos_id=None, open_packs=DEFAULT_OPEN_PACKS):
+    """
+    Best-fit pack token samples, each closed with eos, into sequences of at most seq_len tokens
+    Samples longer than a sequence are split into sequence-sized pieces
+    Yields: lists of token id lists whose lengths sum to at most seq_len
+    """
+    packs = []  # [tokens used, pieces]
+    for ids in samples:
+        ids = token_list(ids) + ([eos_id] if eos_id is not None else [])
+        for start in range(0, len(ids), seq_len):
+            piece = ids[start:start + seq_len]
+            fits = [pack for pack in packs if pack[0] + len(piece) <= seq_len]
+            # The fullest pack that still fits leaves the least padding behind
+            pack = max(fits, key=lambda p: p[0]) if fits else [0, []]
+            if not fits:
+                packs.append(pack)
+            pack[0] += len(piece)
+            pack[1].append(piece)
+
+            if pack[0] == seq_len or len(packs) > open_packs:
+                done = pack if pack[0] == seq_len else max(packs, key=lambda p: p[0])
+                packs.remove(done)
+                yield done[1]
+
+    for _, pieces in sorted(packs, key=lambda p: -p[0]):
+        yield pieces
+
+
+def shuffle_stream(items, buffer_size, rng):
+    """
+    Yield items in a buffered random order, so a stream is shuffled without being held in memory
+    """
+    buffer = []
+    for item in items:
+        buffer.append(item)
+        if len(buffer) >= buffer_size:
+            yield buffer.pop(rng.randrange(len(buffer)))
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def collate_packs(packs, seq_len=DEFAULT_SEQ_LEN, pad_id=0):
+    """
+    Build a training batch from packed sequences: positions restart for every sample, attention is causal
+    within a sample only, and no sample is trained to predict the first token of the next
+    Returns: (dict of model inputs, number of real tokens)
+    """
+    import torch
+
+    batch_size = len(packs)
+    input_ids = torch.full((batch_size, seq_len), pad_id, dtype=torch.long)
+    labels = torch.full((batch_size, seq_len), IGNORE_INDEX, dtype=torch.long)
+    position_ids = torch.zeros((batch_size, seq_len), dtype=torch.long)
+    segments = torch.full((batch_size, seq_len), -1, dtype=torch.long)
+
+    real_tokens = 0
+    for row, pieces in enumerate(packs):
+        offset = 0
+        for segment, piece in enumerate(pieces):
+            end = offset + len(piece)
+            input_ids[row, offset:end] = torch.tensor(piece)
+            # Labels are shifted inside the model: position t is predicted from t - 1
+            labels[row, offset + 1:end] = input_ids[row, offset + 1:end]
+            position_ids[row, offset:end] = torch.arange(len(piece))
+            segments[row, offset:end] = segment
+            offset = end
+        real_tokens += offset
+
+    causal = torch.tril(torch.ones(seq_len, seq_len, dtype=torch.bool))
+    same_sample = (segments[:, :, None] == segments[:, None, :]) & (segments[:, :, None] >= 0)
+    # Padding attends to itself only, so its rows never softmax over nothing
+    attention_mask = (same_sample & causal) | torch.eye(seq_len, dtype=torch.bool)
+    return {"input_ids": input_ids, "labels": labels, "position_ids": position_ids,
+            "attention_mask": attention_mask[:, None]}, real_tokens
+
+
+def latest_checkpoint(output_dir):
+    checkpoints = sorted(Path(output_dir).glob("checkpoint-*[0-9]"))
+    return checkpoints[-1] if checkpoints else None
+
+
+def save_checkpoint(output_dir, model, tokenizer, optimizer, scheduler, progress, keep=2):
+    """
+    Write model, tokenizer, optimizer and data position to checkpoint-<step>, keeping the newest `keep`
+    Returns: checkpoint directory
+    """
+    import torch
+
+    path = Path(output_dir) / f"checkpoint-{progress['step']:06d}"
+    # Written beside its final name and renamed, so --resume never picks up a half-written checkpoint
+    tmp_path = path.with_name(path.name + '.tmp')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    model.save_pretrained(tmp_path)
+    tokenizer.save_pretrained(tmp_path)
+    torch.save({"optimizer": optimizer.state_dict(), "scheduler": scheduler.state_dict(),
+                "rng": torch.get_rng_state()}, tmp_path / "trainer_state.pt")
+    (tmp_path / "progress.json").write_text(json.dumps(progress, indent=2))
+    shutil.rmtree(path, ignore_errors=True)
+    tmp_path.rename(path)
+
+    for old in sorted(Path(output_dir).glob("checkpoint-*[0-9]"))[:-keep]:
+        shutil.rmtree(old)
+    return path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fine-tune GPT-2 on Pine Hollow scenarios and dialogue")
+    parser.add_argument("--model-name", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--scenarios", nargs="+", default=DEFAULT_SCENARIO_DATASETS,
+                        help="Scenario CSVs (or .parquet), read through their token stores")
+    parser.add_argument("--dialogue", nargs="*", default=DEFAULT_DIALOGUE_DATASETS,
+                        help="Dialogue CSVs written by data_collection_pipeline.py")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument("--resume", action="store_true", help="Continue from the latest checkpoint in --output-dir")
+    parser.add_argument("--seq-len", type=int, default=DEFAULT_SEQ_LEN, help="Tokens per packed sequence")
+    parser.add_argument("--batch-size", type=int, default=2, help="Packed sequences per forward pass")
+    parser.add_argument("--grad-accum", type=int, default=8, help="Forward passes per optimizer step")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--max-steps", type=int, default=None, help="Stop after this many optimizer steps")
+    parser.add_argument("--learning-rate", type=float, default=5e-5)
+    parser.add_argument("--weight-decay", type=float, default=0.01)
+    parser.add_argument("--warmup-steps", type=int, default=20)
+    parser.add_argument("--save-every", type=int, default=50, help="Optimizer steps between checkpoints")
+    parser.add_argument("--log-every", type=int, default=1, help="Optimizer steps between MLflow metric logs")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-mlflow", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print("🌲 Starting Pine Hollow GPT-2 fine-tuning")
+
+    import torch
+
+    progress = {"epoch": 0, "packs_done": 0, "step": 0, "tokens": 0}
+    checkpoint = latest_checkpoint(args.output_dir) if args.resume else None
+    device = get_device()
+    model, tokenizer = load_model(str(checkpoint) if checkpoint else args.model_name, device)
+    model.train()
+    torch.manual_seed(args.seed)
+
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.learning_rate, weight_decay=args.weight_decay)
+    scheduler = torch.optim.lr_scheduler.LambdaLR(optimizer, lambda step: min(1.0, (step + 1) / args.warmup_steps))
+    if checkpoint:
+        trainer_state = torch.load(checkpoint / "trainer_state.pt", weights_only=False)
+        optimizer.load_state_dict(trainer_state["optimizer"])
+        scheduler.load_state_dict(trainer_state["scheduler"])
+        torch.set_rng_state(trainer_state["rng"])
+        progress = json.loads((checkpoint / "progress.json").read_text())
+        print(f"⏯️ Resuming from {checkpoint} (step {progress['step']}, epoch {progress['epoch'] + 1})")
+
+    tracker = None
+    if not args.no_mlflow:
+        from tracking import BufferedTracker
+        tracker = BufferedTracker("cyoa_model_experiments", "pine_hollow_finetune")
+        tracker.log_params({key: value for key, value in vars(args).items() if key not in ("no_mlflow",)})
+        tracker.log_param("resumed_from_step", progress["step"])
+        for path in args.scenarios + [p for p in args.dialogue if Path(p).exists()]:
+            tracker.log_param(f"data_hash_{Path(path).stem}", content_hash(path))
+
+    eos_id = tokenizer.eos_token_id
+    train_start = time.perf_counter()
+    session_tokens = 0
+    window = {"loss": 0.0, "micro_steps": 0, "packs": 0, "tokens": 0, "slots": 0, "start": time.perf_counter()}
+
+    def optimizer_step():
+        nonlocal window, session_tokens
+        torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+        optimizer.step()
+        scheduler.step()
+        optimizer.zero_grad()
+        # Progress only advances with the weights, so a checkpoint never skips packs it hasn't trained on
+        progress["step"] += 1
+        progress["packs_done"] += window["packs"]
+        progress["tokens"] += window["tokens"]
+        session_tokens += window["tokens"]
+
+        elapsed = time.perf_counter() - window["start"]
+        metrics = {
+            "train_loss": window["loss"] / window["micro_steps"],
+            "learning_rate": scheduler.get_last_lr()[0],
+            "tokens_per_second": window["tokens"] / elapsed if elapsed else 0.0,
+            # Share of sequence slots holding real tokens rather than padding
+            "packing_efficiency": window["tokens"] / window["slots"]
+        }
+        print(f"📈 Step {progress['step']} (epoch {progress['epoch'] + 1}): loss {metrics['train_loss']:.3f}, "
+              f"{metrics['tokens_per_second']:.0f} tok/s, {metrics['packing_efficiency']:.0%} packed")
+        if tracker is not None and progress["step"] % args.log_every == 0:
+            tracker.log_metrics(metrics, step=progress["step"])
+        if progress["step"] % args.save_every == 0:
+            print(f"💾 Checkpoint: {save_checkpoint(args.output_dir, model, tokenizer, optimizer, scheduler, progress)}")
+        window = {"loss": 0.0, "micro_steps": 0, "packs": 0, "tokens": 0, "slots": 0, "start": time.perf_counter()}
+
+    def finished():
+        return args.max_steps is not None and progress["step"] >= args.max_steps
+
+    for epoch in range(progress["epoch"], args.epochs):
+        if epoch != progress["epoch"]:
+            progress.update(epoch=epoch, packs_done=0)
+        samples = itertools.chain(iter_scenario_samples(args.scenarios, args.model_name, tokenizer),
+                                  iter_dialogue_samples(args.dialogue, tokenizer))
+        # Same seed per epoch, so a resumed run sees the same pack order and skips what it already trained on
+        packs = shuffle_stream(pack_samples(samples, args.seq_len, eos_id), DEFAULT_SHUFFLE_BUFFER,
+                               random.Random(args.seed + epoch))
+        packs = itertools.islice(packs, progress["packs_done"], None)
+
+        while not finished():
+            batch = list(itertools.islice(packs, args.batch_size))
+            if not batch:
+                break
+            inputs, real_tokens = collate_packs(batch, args.seq_len, eos_id)
+            loss = model(**{name: tensor.to(device) for name, tensor in inputs.items()}).loss
+            (loss / args.grad_accum).backward()
+
+            window["loss"] += float(loss.detach())
+            window["micro_steps"] += 1
+            window["packs"] += len(batch)
+            window["tokens"] += real_tokens
+            window["slots"] += len(batch) * args.seq_len
+            if window["micro_steps"] == args.grad_accum:
+                optimizer_step()
+
+        # An epoch's last, partial accumulation still makes a step
+        if window["micro_steps"]:
+            optimizer_step()
+        if finished():
+            break
+
+    elapsed = time.perf_counter() - train_start
+    final_path = save_checkpoint(args.output_dir, model, tokenizer, optimizer, scheduler, progress)
+    print(f"\n✅ Trained {progress['step']} steps on {progress['tokens']} tokens "
+          f"({session_tokens / elapsed if elapsed else 0.0:.0f} tok/s this session) -> {final_path}")
+    if tracker is not None:
+        tracker.log_metric("total_tokens", progress["tokens"], step=progress["step"])
+        tracker.log_metric("session_tokens_per_second", session_tokens / elapsed if elapsed else 0.0)
+        if tracker.close():
+            print("✅ Fine-tuning logged to MLflow")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Persistent Generation Cache for Pine Hollow Mystery
+Stores GPT-2 continuations in SQLite keyed by prompt, model, sampling config and seed
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+DEFAULT_CACHE_PATH = ".generation_cache/generations.sqlite"
+DEFAULT_CACHE_MAX_MB = 256
+
+
+def make_cache_key(prompt, model_name, sampling_config, seed=None):
+    """
+    Hash everything that determines a continuation into one cache key
+    """
+    payload = json.dumps({
+        "prompt": prompt,
+        "model_name": model_name,
+        "sampling_config": sampling_config,
+        "seed": seed
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """
+    On-disk prompt -> continuation cache with size-based LRU eviction
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS generations (
+                key TEXT PRIMARY KEY,
+                continuation TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON generations (last_access)")
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """
+        Look up several keys at once
+        Returns: dict of key -> continuation for the keys that were cached
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(unique_keys), 500):
+            chunk = unique_keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, continuation FROM generations WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            found.update(rows)
+
+        if found:
+            now = time.time()
+            self.conn.executemany("UPDATE generations SET last_access = ? WHERE key = ?",
+                                  [(now, key) for key in found])
+            self.conn.commit()
+
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """
+        Store (key, continuation) pairs, then evict least recently used entries if over budget
+        """
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO generations (key, continuation, size_bytes, last_access) VALUES (?, ?, ?, ?)",
+            [(key, text, len(key) + len(text.encode("utf-8")), now) for key, text in items]
+        )
+        self.conn.commit()
+        self._evict()
+
+    def total_bytes(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM generations").fetchone()[0]
+
+    def _evict(self):
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+
+        # Walk entries oldest-first until enough bytes are freed
+        doomed = []
+        for key, size_bytes in self.conn.execute(
+                "SELECT key, size_bytes FROM generations ORDER BY last_access ASC"):
+            doomed.append((key,))
+            excess -= size_bytes
+            if excess <= 0:
+                break
+
+        self.conn.executemany("DELETE FROM generations WHERE key = ?", doomed)
+        self.conn.commit()
+        self.evictions += len(doomed)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_hit_rate": self.hits / lookups if lookups else 0.0,
+            "cache_evictions": self.evictions,
+            "cache_size_bytes": self.total_bytes()
+        }
+
+    def report(self):
+        stats = self.stats()
+        print(f"\n💾 Generation cache: {stats['cache_hits']} hits, {stats['cache_misses']} misses "
+              f"({stats['cache_hit_rate']:.0%} hit rate)")
+        print(f"   • Evicted entries: {stats['cache_evictions']}")
+        print(f"   • Cache size: {stats['cache_size_bytes'] / 1024:.1f} KB at {self.path}")
+        return stats
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+Batched Generation Engine for Pine Hollow Mystery
+Groups scenarios into length-bucketed, left-padded GPT-2 batches
+"""
+
+import hashlib
+
+# torch is imported inside the functions that need it so importing this module stays cheap
+from generation_cache import make_cache_key
+
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_TOP_K = 50  # transformers' sampling default when the experiments were first run
+SENTENCE_END_CHARS = ('.', '!', '?')
+STOP_REASONS = ('eos', 'sentence', 'length', 'cached')
+
+
+def build_prompt(row):
+    """
+    Build the GPT-2 prompt for a scenario row
+    """
+    return f"Mystery Story: {row['prompt']} {row['response']}"
+
+
+def bucket_by_length(lengths, batch_size):
+    """
+    Group item indices so similar-length prompts share a batch
+    Returns: list of index lists, shortest prompts first
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+def derive_seed(base_seed, row_key):
+    """
+    Derive a stable per-row seed, so a row samples the same tokens whichever batch or worker runs it
+    """
+    digest = hashlib.sha256(f"{base_seed}:{row_key}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") & 0x7FFFFFFFFFFFFFFF
+
+
+def token_list(ids):
+    """
+    Plain list of ints from a token id list, tensor or numpy (e.g. memory-mapped) array
+    """
+    return ids.tolist() if hasattr(ids, 'tolist') else list(ids)
+
+
+def cache_layers(past_key_values):
+    """
+    Returns: list of (key, value) tensors per layer, for Cache objects and legacy tuple caches alike
+    """
+    if hasattr(past_key_values, 'layers'):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    if hasattr(past_key_values, 'key_cache'):
+        return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+    return [(layer[0], layer[1]) for layer in past_key_values]
+
+
+def rebuild_cache(layers, like):
+    """
+    Build a cache of the same kind as `like` from per-layer (key, value) tensors
+    """
+    if isinstance(like, tuple):
+        return tuple(layers)
+
+    cache = type(like)()
+    for layer_idx, (keys, values) in enumerate(layers):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+def cache_nbytes(past_key_values):
+    """
+    Memory held by a KV cache, in bytes
+    """
+    return sum(keys.numel() * keys.element_size() + values.numel() * values.element_size()
+               for keys, values in cache_layers(past_key_values))
+
+
+def sampling_probs(logits, temperature=1.0, top_k=DEFAULT_TOP_K):
+    """
+    The distribution sampling draws from: temperature-scaled, top-k filtered softmax of (batch, vocab) logits
+    temperature: one float, or a (batch, 1) tensor of per-row temperatures
+    """
+    import torch
+
+    logits = logits.float() / temperature
+    if top_k:
+        # Keep only the top-k candidates, like the transformers pipeline does
+        kth_best = torch.topk(logits, min(top_k, logits.size(-1))).values[:, -1, None]
+        logits = logits.masked_fill(logits < kth_best, float('-inf'))
+    return torch.softmax(logits, dim=-1)
+
+
+def sample_next_tokens(logits, temperature=1.0, top_k=DEFAULT_TOP_K, do_sample=True, generators=None):
+    """
+    Pick the next token for every row of a (batch, vocab) logits tensor
+    generators: optional per-row torch.Generator list for reproducible sampling
+    """
+    import torch
+
+    if not do_sample:
+        return logits.argmax(dim=-1)
+
+    probs = sampling_probs(logits, temperature, top_k)
+    if generators is None:
+        return torch.multinomial(probs, num_samples=1).squeeze(-1)
+
+    # One draw per row from its own generator keeps rows independent of their batch mates
+    return torch.cat([
+        torch.multinomial(row_probs, num_samples=1, generator=generator)
+        for row_probs, generator in zip(probs, generators)
+    ])
+
+
+class SentenceBoundaryStop:
+    """
+    Stopping criterion: finish a row on the first token that ends a sentence, once it has min_new_tokens
+    """
+
+    def __init__(self, tokenizer, min_new_tokens, device="cpu"):
+        import torch
+
+        self.min_new_tokens = min_new_tokens
+        # GPT-2 tokens are byte-level strings, where ASCII punctuation and quotes appear as themselves
+        tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+        self.is_boundary = torch.tensor([
+            token is not None and token.rstrip('"\')').endswith(SENTENCE_END_CHARS) for token in tokens
+        ], device=device)
+
+    def __call__(self, step, next_tokens):
+        """
+        Returns: bool tensor of rows whose just-sampled token should be their last
+        """
+        return self.is_boundary[next_tokens] & (step + 1 >= self.min_new_tokens)
+
+    def ends_sentence(self, tokens):
+        return len(tokens) >= self.min_new_tokens and bool(self.is_boundary[tokens[-1]])
+
+
+class GenerationEngine:
+    """
+    Shared GPT-2 generation engine used by the experiment scripts
+    """
+
+    def __init__(self, model, tokenizer, batch_size=DEFAULT_BATCH_SIZE, device=None, cache=None, pool=None,
+                 precision=None, draft_model=None, draft_tokens=None):
+        """
+        pool: optional GenerationPool; batches then run in its worker processes and model may be None
+        precision: inference precision the model was loaded with (see model_loader.PRECISIONS)
+        draft_model: optional smaller model sharing GPT-2's vocabulary, for speculative decoding
+        draft_tokens: tokens the draft model proposes per GPT-2 pass
+        """
+        self.model = model.eval() if model is not None else None
+        self.model_name = model.name_or_path if model is not None else pool.model_name
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.device = device or (next(model.parameters()).device if model is not None else "cpu")
+        self.cache = cache
+        self.pool = pool
+        self.precision = precision or (pool.precision if pool is not None else "fp32")
+        self.token_counts = {"prompt_tokens": 0, "generated_tokens": 0}
+        self._sentence_stops = {}
+
+        self.speculative = None
+        if draft_model is not None:
+            from speculative_decoding import DEFAULT_DRAFT_TOKENS, SpeculativeDecoder
+            self.speculative = SpeculativeDecoder(self.model, draft_model, draft_tokens or DEFAULT_DRAFT_TOKENS)
+
+        # GPT-2 has no pad token; left padding keeps every prompt flush with its continuation
+        self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = 'left'
+
+    def generate(self, prompts, max_new_tokens, temperature=0.8, do_sample=True, top_k=DEFAULT_TOP_K, seeds=None,
+                 sentence_stop=None, details=False, prompt_ids=None):
+        """
+        Generate continuations for prompts in length-bucketed batches
+        max_new_tokens: continuation budget in tokens, one int for all prompts or one per prompt
+        seeds: optional per-prompt sampling seeds (see derive_seed)
+        sentence_stop: if set, end a continuation at the first sentence end after this many tokens
+        details: return per-prompt dicts with token accounting instead of plain strings
+        prompt_ids: optional pre-tokenized prompts (e.g. TokenStore slices), so prompts aren't tokenized again
+        Returns: list of continuation strings (or dicts) in original prompt order
+        """
+        if isinstance(max_new_tokens, int):
+            max_new_tokens = [max_new_tokens] * len(prompts)
+        results = [None] * len(prompts)
+        if prompt_ids is None:
+            prompt_lengths = [len(ids) for ids in self.tokenizer(list(prompts))['input_ids']]
+        else:
+            prompt_lengths = [len(ids) for ids in prompt_ids]
+        pending = list(range(len(prompts)))
+
+        cache_keys = None
+        if self.cache is not None:
+            # fp32 keys predate the precision option, so only reduced precisions add it
+            precision = {} if self.precision == "fp32" else {"precision": self.precision}
+            # Speculation keeps the distribution but not the exact tokens a seed draws
+            draft = {} if self.speculative is None else {
+                "draft_model": self.speculative.draft_model_name,
+                "draft_tokens": self.speculative.draft_tokens
+            }
+            cache_keys = [
+                make_cache_key(prompt, self.model_name, {
+                    "max_new_tokens": budget,
+                    "sentence_stop": sentence_stop,
+                    "temperature": temperature,
+                    "do_sample": do_sample,
+                    "top_k": top_k,
+                    **precision,
+                    **draft
+                }, seed=None if seeds is None else seeds[i])
+                for i, (prompt, budget) in enumerate(zip(prompts, max_new_tokens))
+            ]
+            cached = self.cache.get_many(cache_keys)
+            for i, key in enumerate(cache_keys):
+                if key in cached:
+                    # Only the text is cached, so its tokens are recounted and it cost no generation
+                    results[i] = (cached[key], len(self.tokenizer(cached[key])['input_ids']), 'cached')
+            pending = [i for i in pending if results[i] is None]
+            print(f"💾 Cache: {len(prompts) - len(pending)}/{len(prompts)} continuations reused")
+
+        if pending:
+            batches = bucket_by_length([prompt_lengths[i] for i in pending], self.batch_size)
+
+            # Batches are fixed here, before any worker sees them, so results don't depend on worker count
+            jobs = []
+            for batch in batches:
+                jobs.append({
+                    "prompts": [prompts[pending[i]] for i in batch],
+                    # Always produce at least one token
+                    "budgets": [max(max_new_tokens[pending[i]], 1) for i in batch],
+                    "seeds": None if seeds is None else [seeds[pending[i]] for i in batch],
+                    "prompt_ids": None if prompt_ids is None else [token_list(prompt_ids[pending[i]]) for i in batch],
+                    "sentence_stop": sentence_stop
+                })
+            sampling = {"temperature": temperature, "do_sample": do_sample, "top_k": top_k}
+            batch_results = self.pool.map_jobs(jobs, sampling) if self.pool is not None else \
+                (self.run_job(job, sampling) for job in jobs)
+
+            for batch_num, (batch, rows) in enumerate(zip(batches, batch_results), start=1):
+                for i, row in zip(batch, rows):
+                    results[pending[i]] = row
+                    self.token_counts["prompt_tokens"] += prompt_lengths[pending[i]]
+                    self.token_counts["generated_tokens"] += row[1]
+                if self.cache is not None:
+                    self.cache.put_many([(cache_keys[pending[i]], row[0]) for i, row in zip(batch, rows)])
+                print(f"📦 Batch {batch_num}/{len(batches)} - {len(batch)} prompts")
+
+        if not details:
+            return [text for text, _, _ in results]
+        return [
+            {"continuation": text, "prompt_tokens": prompt_length, "generated_tokens": generated,
+             "stop_reason": stop_reason}
+            for (text, generated, stop_reason), prompt_length in zip(results, prompt_lengths)
+        ]
+
+    def run_job(self, job, sampling):
+        """
+        Generate one pre-built batch job (also the entry point for pool workers)
+        Returns: list of (continuation, generated token count, stop reason) per prompt
+        """
+        return self._generate_batch(job["prompts"], job["budgets"], seeds=job["seeds"],
+                                    sentence_stop=job.get("sentence_stop"), prompt_ids=job.get("prompt_ids"),
+                                    **sampling)
+
+    def _generate_batch(self, prompts, budgets, temperature, do_sample, top_k, seeds=None, sentence_stop=None,
+                        prompt_ids=None):
+        """
+        Sample one left-padded batch with a KV cache, stopping each row at its own budget
+        """
+        import torch
+
+        stop = None if sentence_stop is None else self.sentence_stop(sentence_stop)
+        generators = self.make_generators(seeds)
+        with torch.no_grad():
+            if self.speculative is not None:
+                # Rows accept different numbers of drafts per pass, so speculation decodes them one at a time
+                generated = [
+                    self.speculative.generate(self.tokenizer.encode(prompt) if prompt_ids is None else prompt_ids[i],
+                                              budget, temperature, do_sample, top_k,
+                                              None if generators is None else generators[i],
+                                              self.tokenizer.eos_token_id, stop)
+                    for i, (prompt, budget) in enumerate(zip(prompts, budgets))
+                ]
+            else:
+                state = self.prefill(prompts, prompt_ids)
+                generated, _ = self.sample_from(state, budgets, temperature, do_sample, top_k,
+                                                generators=generators, stop_criteria=stop)
+        return self.decode_results(generated, budgets, stop)
+
+    def decode_results(self, generated, budgets, stop=None):
+        """
+        Returns: list of (continuation, generated token count, stop reason) per row of generated token ids
+        """
+        results = []
+        for tokens, budget in zip(generated, budgets):
+            if stop is not None and tokens and stop.ends_sentence(tokens):
+                stop_reason = 'sentence'
+            elif len(tokens) >= budget:
+                stop_reason = 'length'
+            else:
+                stop_reason = 'eos'
+            results.append((self.tokenizer.decode(tokens, skip_special_tokens=True).strip(), len(tokens), stop_reason))
+        return results
+
+    def sentence_stop(self, min_new_tokens):
+        """
+        Returns: SentenceBoundaryStop for this engine's tokenizer (built once per min_new_tokens)
+        """
+        if min_new_tokens not in self._sentence_stops:
+            self._sentence_stops[min_new_tokens] = SentenceBoundaryStop(self.tokenizer, min_new_tokens, self.device)
+        return self._sentence_stops[min_new_tokens]
+
+    def make_generators(self, seeds):
+        """
+        Returns: one seeded torch.Generator per seed, or None when seeds is None
+        """
+        import torch
+
+        if seeds is None:
+            return None
+        return [torch.Generator(device=self.device).manual_seed(seed) for seed in seeds]
+
+    def prefill(self, prompts, prompt_ids=None):
+        """
+        Encode a left-padded batch of prompt strings, or of their token ids when already tokenized
+        Returns: KVState ready to sample from or extend
+        """
+        if prompt_ids is not None:
+            return self._forward(*self._left_pad(prompt_ids))
+        encoded = self.tokenizer(list(prompts), return_tensors='pt', padding=True).to(self.device)
+        return self._forward(encoded['input_ids'], encoded['attention_mask'])
+
+    def extend(self, state, suffix_ids):
+        """
+        Append per-row token id lists to an encoded state, left-padding them against each other
+        Returns: new KVState (the input state's cache is consumed)
+        """
+        import torch
+
+        input_ids, suffix_mask = self._left_pad(suffix_ids)
+        extended = self._forward(input_ids, suffix_mask.to(state.attention_mask.dtype), state)
+
+        # Rows with nothing appended keep the logits they already had
+        empty = torch.tensor([len(ids) == 0 for ids in suffix_ids], device=self.device)
+        extended.next_logits = torch.where(empty[:, None], state.next_logits, extended.next_logits)
+        return extended
+
+    def _left_pad(self, rows):
+        """
+        Returns: (input_ids, attention_mask) tensors of token id rows left-padded with eos
+        """
+        import torch
+
+        eos_id = self.tokenizer.eos_token_id
+        rows = [token_list(ids) for ids in rows]
+        width = max(len(ids) for ids in rows)
+        input_ids = torch.tensor([[eos_id] * (width - len(ids)) + ids for ids in rows], device=self.device)
+        attention_mask = torch.tensor([[0] * (width - len(ids)) + [1] * len(ids) for ids in rows], device=self.device)
+        return input_ids, attention_mask
+
+    def _forward(self, input_ids, new_mask, state=None):
+        import torch
+
+        attention_mask = new_mask if state is None else torch.cat([state.attention_mask, new_mask], dim=-1)
+        # Padding must not shift positions, so count them from each row's first real token
+        position_ids = (attention_mask.cumsum(dim=-1) - 1).clamp(min=0)[:, -input_ids.size(1):]
+        outputs = self.model(input_ids=input_ids,
+                             attention_mask=attention_mask,
+                             position_ids=position_ids,
+                             past_key_values=None if state is None else state.past_key_values,
+                             use_cache=True)
+        return KVState(outputs.past_key_values, attention_mask, outputs.logits[:, -1, :])
+
+    def sample_from(self, state, budgets, temperature=0.8, do_sample=True, top_k=DEFAULT_TOP_K,
+                    generators=None, keep_cache=False, on_step=None, stop_criteria=None):
+        """
+        Sample a continuation for every row of an encoded state, each stopping at eos or its own budget
+        keep_cache: also run the last sampled tokens through the model so the returned state can be extended
+        on_step: optional callback(step, finished) after each sampled token, e.g. for latency timing
+        stop_criteria: optional callable(step, next_tokens) -> bool rows to finish after this token
+        Returns: (per-row lists of generated token ids, KVState after generation)
+        """
+        import torch
+
+        eos_id = self.tokenizer.eos_token_id
+        budgets = torch.tensor(budgets, device=self.device)
+        finished = budgets <= 0
+        steps = []
+
+        for step in range(int(budgets.max())):
+            next_tokens = sample_next_tokens(state.next_logits, temperature, top_k, do_sample, generators)
+            real = ~finished & (next_tokens != eos_id)
+            steps.append((next_tokens, real))
+
+            finished |= ~real | (budgets <= step + 1)
+            if stop_criteria is not None:
+                finished |= stop_criteria(step, next_tokens)
+            if on_step is not None:
+                on_step(step, finished)
+            if finished.all() and not keep_cache:
+                break
+
+            # Finished rows keep stepping with the batch, but their extra positions stay masked out
+            state = self._forward(next_tokens[:, None], real[:, None].to(state.attention_mask.dtype), state)
+            if finished.all():
+                break
+
+        generated = [[] for _ in range(len(budgets))]
+        for next_tokens, real in steps:
+            for row in real.nonzero().flatten().tolist():
+                generated[row].append(int(next_tokens[row]))
+        return generated, state
+
+
+class KVState:
+    """
+    Encoded batch: its KV cache, the mask of real (non-padding) positions and each row's next-token logits
+    """
+
+    def __init__(self, past_key_values, attention_mask, next_logits):
+        self.past_key_values = past_key_values
+        self.attention_mask = attention_mask
+        self.next_logits = next_logits
+
+    def __len__(self):
+        return self.attention_mask.size(0)
+
+    def select(self, rows):
+        """
+        Copy out the given rows (repeats allowed, e.g. [0, 0] forks row 0 in two)
+        Returns: independent KVState
+        """
+        import torch
+
+        index = torch.tensor(rows, device=self.attention_mask.device)
+        layers = [(keys.index_select(0, index), values.index_select(0, index))
+                  for keys, values in cache_layers(self.past_key_values)]
+        return KVState(rebuild_cache(layers, like=self.past_key_values),
+                       self.attention_mask.index_select(0, index),
+                       self.next_logits.index_select(0, index))
+
+    def expand(self, copies):
+        """
+        Repeat every row `copies` times, keeping copies of a row next to each other
+        """
+        return self.select([row for row in range(len(self)) for _ in range(copies)])
+
+    def merge(self, other):
+        """
+        Stack another state's rows after this one's, left-padding whichever cache is shorter
+        Returns: new KVState
+        """
+        import torch
+        import torch.nn.functional as F
+
+        width = max(self.attention_mask.size(1), other.attention_mask.size(1))
+        padded = []
+        for state in (self, other):
+            extra = width - state.attention_mask.size(1)
+            # Padded positions are masked out, so their zero keys and values are never attended to
+            layers = [(F.pad(keys, (0, 0, extra, 0)), F.pad(values, (0, 0, extra, 0)))
+                      for keys, values in cache_layers(state.past_key_values)]
+            padded.append((layers, F.pad(state.attention_mask, (extra, 0))))
+
+        (layers, mask), (other_layers, other_mask) = padded
+        merged = [(torch.cat([keys, other_keys]), torch.cat([values, other_values]))
+                  for (keys, values), (other_keys, other_values) in zip(layers, other_layers)]
+        return KVState(rebuild_cache(merged, like=self.past_key_values), torch.cat([mask, other_mask]),
+                       torch.cat([self.next_logits, other.next_logits]))
+
+    def trim(self):
+        """
+        Drop leading positions that are padding in every row, e.g. after the longest row was selected out
+        """
+        real = self.attention_mask.any(dim=0).nonzero()
+        start = int(real[0]) if len(real) else 0
+        if start == 0:
+            return self
+        layers = [(keys[:, :, start:], values[:, :, start:]) for keys, values in cache_layers(self.past_key_values)]
+        return KVState(rebuild_cache(layers, like=self.past_key_values), self.attention_mask[:, start:],
+                       self.next_logits)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Run Instrumentation for Pine Hollow Mystery
+Per-stage wall-clock timers and counters, with optional cProfile / torch profiler capture, for MLflow
+"""
+
+import cProfile
+import io
+import pstats
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+PROFILERS = ("cprofile", "torch")
+DEFAULT_PROFILE_DIR = "profiles"
+
+
+def add_profile_arguments(parser):
+    """
+    Add the --profile / --profile-dir flags shared by the pipeline scripts
+    """
+    parser.add_argument("--profile", choices=PROFILERS, default=None,
+                        help="Capture a cProfile or torch profiler trace of every stage")
+    parser.add_argument("--profile-dir", default=DEFAULT_PROFILE_DIR,
+                        help="Where profiler output is written before it is logged to MLflow")
+    return parser
+
+
+class StageProfiler:
+    """
+    Times named stages of a run (re-entering a stage adds to its total) and counts work done in them
+    """
+
+    def __init__(self, profile=None, profile_dir=DEFAULT_PROFILE_DIR):
+        self.profile = profile
+        self.profile_dir = Path(profile_dir)
+        self.seconds = {}
+        self.counts = {}
+        self._cprofiles = {}
+        self._torch_tables = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the wrapped block as part of stage `name`
+        """
+        with self._capture(name):
+            start = time.perf_counter()
+            try:
+                yield self
+            finally:
+                self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def iterate(self, name, iterable):
+        """
+        Yield from iterable, timing only the time spent producing each item (e.g. reading chunks)
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, unit, amount):
+        """
+        Record `amount` units of work (tokens, rows, ...) done in stage `name`
+        """
+        key = (name, unit)
+        self.counts[key] = self.counts.get(key, 0) + amount
+
+    @contextmanager
+    def _capture(self, name):
+        if self.profile == "cprofile":
+            profiler = self._cprofiles.setdefault(name, cProfile.Profile())
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+        elif self.profile == "torch":
+            import torch.profiler
+
+            with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU]) as profiler:
+                yield
+            # Keep one chrome trace per stage; later entries of the stage only add to its op table
+            if name not in self._torch_tables:
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                profiler.export_chrome_trace(str(self.profile_dir / f"{name}.trace.json"))
+            self._torch_tables.setdefault(name, []).append(
+                profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=25))
+        else:
+            yield
+
+    def save_profiles(self):
+        """
+        Write collected profiles under profile_dir
+        Returns: list of written paths
+        """
+        if not self._cprofiles and not self._torch_tables:
+            return []
+
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for name, profiler in self._cprofiles.items():
+            paths.append(self.profile_dir / f"{name}.prof")
+            profiler.dump_stats(paths[-1])
+
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(30)
+            paths.append(self.profile_dir / f"{name}.txt")
+            paths[-1].write_text(summary.getvalue())
+
+        for name, tables in self._torch_tables.items():
+            paths.append(self.profile_dir / f"{name}.txt")
+            paths[-1].write_text("\n\n".join(tables))
+            paths.append(self.profile_dir / f"{name}.trace.json")
+        return paths
+
+    def metrics(self):
+        """
+        Returns: dict of MLflow-ready metric names -> values
+        """
+        metrics = {f"stage_{name}_seconds": seconds for name, seconds in self.seconds.items()}
+        metrics["stage_total_seconds"] = sum(self.seconds.values())
+
+        for (name, unit), amount in self.counts.items():
+            metrics[f"stage_{name}_{unit}"] = amount
+            if self.seconds.get(name):
+                metrics[f"stage_{name}_{unit}_per_second"] = amount / self.seconds[name]
+        return metrics
+
+    def report(self):
+        """
+        Print where the run's wall-clock went
+        Returns: metrics()
+        """
+        total = sum(self.seconds.values())
+        print("\n⏱️ Stage breakdown:")
+        for name, seconds in sorted(self.seconds.items(), key=lambda item: -item[1]):
+            share = seconds / total if total else 0.0
+            print(f"   • {name}: {seconds:.2f}s ({share:.0%})")
+        for (name, unit), amount in self.counts.items():
+            print(f"   • {name}: {amount} {unit}")
+        return self.metrics()
+
+    def log_to_mlflow(self, mlflow):
+        """
+        Log stage metrics and any profiles into the active MLflow run
+        """
+        mlflow.log_metrics(self.report())
+        if self.save_profiles():
+            mlflow.log_artifacts(str(self.profile_dir), artifact_path="profiles")
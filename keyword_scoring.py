@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Keyword Scoring for Pine Hollow Mystery
+Scores generated responses against theme keyword sets with vectorized pandas string ops
+"""
+
+import re
+
+import pandas as pd
+
+# Genre words for the mystery vs anime baseline comparison
+MYSTERY_GENRE_KEYWORDS = ['detective', 'sheriff', 'mystery', 'disappeared', 'town', 'coffee']
+ANIME_GENRE_KEYWORDS = ['magic', 'academy', 'guild', 'festival', 'cherry', 'spirits']
+
+# Story elements and the Twin Peaks-to-Stranger Things atmosphere the experiment runs score
+MYSTERY_ELEMENT_KEYWORDS = ['detective', 'sheriff', 'sarah', 'pine', 'mystery']
+SUPERNATURAL_ATMOSPHERE_KEYWORDS = ['fog', 'dark', 'strange', 'alien', 'entity', 'consciousness']
+
+# Quality indicators from the analysis report
+CHARACTER_KEYWORDS = ['detective', 'sheriff', 'coffee']
+ON_TOPIC_KEYWORDS = ['sarah', 'pine', 'mystery', 'disappeared', 'town']
+SETTING_ATMOSPHERE_KEYWORDS = ['forest', 'fog', 'dark', 'strange', 'whisper']
+
+
+class KeywordScorer:
+    """
+    Counts how many distinct keywords of each category appear in each text (case-insensitive)
+    """
+
+    def __init__(self, categories):
+        """
+        categories: dict of category name -> list of keywords
+        """
+        self.categories = {name: [kw.lower() for kw in keywords] for name, keywords in categories.items()}
+
+        # One compiled alternation per category; longer keywords first so the longest wins where two overlap
+        self.patterns = {
+            name: re.compile('|'.join(re.escape(kw) for kw in sorted(set(keywords), key=len, reverse=True)))
+            for name, keywords in self.categories.items()
+        }
+
+    def score(self, texts):
+        """
+        Score every text in one pass per category
+        Returns: DataFrame with one count column per category, aligned with texts
+        """
+        lowered = pd.Series(texts).fillna('').astype(str).str.lower()
+        scores = pd.DataFrame(index=lowered.index)
+
+        for name, pattern in self.patterns.items():
+            # Every match of any keyword in one scan; distinct matches are the distinct keywords present
+            scores[name] = lowered.str.findall(pattern).map(lambda found: len(set(found))).astype(int)
+
+        return scores
+
+    def score_frame(self, df, column='ai_response'):
+        """
+        Returns: df with a `<category>_score` column per category appended
+        """
+        scores = self.score(df[column]).add_suffix('_score')
+        return pd.concat([df, scores], axis=1)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Load Generator for the Pine Hollow Story Server
+Fires story-step requests with Poisson arrivals at a continuous-batching scheduler and reports latency,
+throughput, queue depth and batch occupancy
+
+Usage:
+    python load_generator.py --requests 64 --rate 8                          # scheduler in this process
+    python load_generator.py --url http://localhost:8060 --requests 200 --rate 20
+    python load_generator.py --max-batch-size 1                              # static, one request at a time
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+from batch_server import DEFAULT_MAX_BATCH_SIZE, load_scheduler
+from benchmark_generation import DEFAULT_DATASETS, load_prompts, percentile
+from model_loader import DEFAULT_MODEL_NAME
+
+DEFAULT_REQUESTS = 64
+DEFAULT_RATE = 8.0           # requests per second
+METRICS_INTERVAL = 0.1       # seconds between server metric samples
+
+
+async def http_json(url, payload=None):
+    """
+    GET (payload None) or POST JSON to a batch_server over a fresh connection
+    Returns: decoded JSON response
+    """
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+    method = 'GET' if payload is None else 'POST'
+    writer.write(f"{method} {parts.path or '/'} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+                 f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                 f"Connection: close\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, _, data = response.partition(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    result = json.loads(data)
+    if status != 200:
+        raise RuntimeError(f"HTTP {status}: {result.get('error')}")
+    return result
+
+
+async def run_load(submit, get_metrics, prompts, num_requests, rate, max_new_tokens, seed):
+    """
+    Submit num_requests prompts (cycling through them) with exponential inter-arrival times
+    submit: async callable(prompt, max_new_tokens, seed) -> result dict
+    get_metrics: async callable() -> server metrics dict, sampled while the load runs
+    Returns: (list of (client latency, result or exception), list of metric samples, elapsed seconds)
+    """
+    rng = random.Random(seed)
+    samples = []
+    done = asyncio.Event()
+
+    async def sample_metrics():
+        while not done.is_set():
+            samples.append(await get_metrics())
+            await asyncio.sleep(METRICS_INTERVAL)
+
+    async def one_request(i):
+        start = time.perf_counter()
+        try:
+            result = await submit(prompts[i % len(prompts)], max_new_tokens, seed + i)
+        except Exception as e:
+            result = e
+        return time.perf_counter() - start, result
+
+    sampler = asyncio.create_task(sample_metrics())
+    start = time.perf_counter()
+    tasks = []
+    for i in range(num_requests):
+        tasks.append(asyncio.create_task(one_request(i)))
+        if rate:
+            await asyncio.sleep(rng.expovariate(rate))
+    outcomes = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    done.set()
+    await sampler
+    return outcomes, samples, elapsed
+
+
+def summarize_load(outcomes, samples, elapsed):
+    """
+    Returns: dict of MLflow-ready load test metrics
+    """
+    results = [result for _, result in outcomes if not isinstance(result, Exception)]
+    latencies = [latency for latency, result in outcomes if not isinstance(result, Exception)]
+    tokens = sum(result['generated_tokens'] for result in results)
+    return {
+        "requests": len(outcomes),
+        "failed_requests": len(outcomes) - len(results),
+        "elapsed_seconds": elapsed,
+        "requests_per_second": len(results) / elapsed if elapsed else 0.0,
+        "tokens_per_second": tokens / elapsed if elapsed else 0.0,
+        "latency_p50_seconds": percentile(latencies, 50),
+        "latency_p95_seconds": percentile(latencies, 95),
+        "latency_p99_seconds": percentile(latencies, 99),
+        "queue_wait_p95_seconds": percentile([result['queue_seconds'] for result in results], 95),
+        "first_token_p50_seconds": percentile([result['first_token_seconds'] for result in results], 50),
+        "max_queue_depth": max((sample['queue_depth'] for sample in samples), default=0),
+        "mean_batch_occupancy": (sum(sample['batch_occupancy'] for sample in samples) / len(samples)
+                                 if samples else 0.0)
+    }
+
+
+async def load_test(args, prompts):
+    if args.url:
+        base = args.url.rstrip('/')
+        return await run_load(
+            lambda prompt, max_new_tokens, seed: http_json(
+                f"{base}/generate", {"prompt": prompt, "max_new_tokens": max_new_tokens, "seed": seed}),
+            lambda: http_json(f"{base}/metrics"),
+            prompts, args.requests, args.rate, args.max_new_tokens, args.seed)
+
+    scheduler = load_scheduler(args.model_name, args.max_batch_size)
+
+    async def get_metrics():
+        return scheduler.metrics()
+
+    server = asyncio.create_task(scheduler.run())
+    try:
+        return await run_load(lambda prompt, max_new_tokens, seed: scheduler.submit(prompt, max_new_tokens, seed=seed),
+                              get_metrics, prompts, args.requests, args.rate, args.max_new_tokens, args.seed)
+    finally:
+        server.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test continuous-batching story generation")
+    parser.add_argument("--url", default=None,
+                        help="batch_server.py to send requests to; by default a scheduler runs in this process")
+    parser.add_argument("--model-name", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE,
+                        help="Batch size of the in-process scheduler")
+    parser.add_argument("--data", nargs="+", default=DEFAULT_DATASETS, help="Scenario CSVs to draw prompts from")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS)
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help="Mean arrivals per second (0 sends every request at once)")
+    parser.add_argument("--max-new-tokens", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="Write the load test metrics as JSON")
+    parser.add_argument("--no-mlflow", action="store_true")
+    args = parser.parse_args()
+
+    prompts = [prompt for _, _, prompt in load_prompts(args.data)]
+    target = args.url or f"in-process scheduler (batch of up to {args.max_batch_size})"
+    print(f"🌲 Sending {args.requests} story steps at {args.rate or 'unlimited'}/s to {target}")
+
+    outcomes, samples, elapsed = asyncio.run(load_test(args, prompts))
+    metrics = summarize_load(outcomes, samples, elapsed)
+
+    print(f"\n📊 {metrics['requests'] - metrics['failed_requests']}/{metrics['requests']} requests in "
+          f"{metrics['elapsed_seconds']:.1f}s ({metrics['requests_per_second']:.2f} req/s, "
+          f"{metrics['tokens_per_second']:.1f} tok/s)")
+    print(f"   • Latency p50 {metrics['latency_p50_seconds']:.2f}s, p95 {metrics['latency_p95_seconds']:.2f}s, "
+          f"p99 {metrics['latency_p99_seconds']:.2f}s")
+    print(f"   • Queue wait p95 {metrics['queue_wait_p95_seconds']:.2f}s, "
+          f"first token p50 {metrics['first_token_p50_seconds']:.2f}s")
+    print(f"   • Max queue depth {metrics['max_queue_depth']}, "
+          f"mean batch occupancy {metrics['mean_batch_occupancy']:.0%}")
+    for _, result in outcomes:
+        if isinstance(result, Exception):
+            print(f"   ⚠️ {type(result).__name__}: {result}")
+            break
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"target": target, "rate": args.rate, "metrics": metrics}, f, indent=2)
+        print(f"📁 Results: {args.output}")
+
+    if not args.no_mlflow:
+        from tracking import BufferedTracker
+        tracker = BufferedTracker("cyoa_model_experiments", "pine_hollow_load_test")
+        tracker.log_param("target", "http" if args.url else "in_process")
+        tracker.log_param("max_batch_size", None if args.url else args.max_batch_size)
+        tracker.log_param("rate", args.rate)
+        tracker.log_param("max_new_tokens", args.max_new_tokens)
+        tracker.log_metrics(metrics)
+        if tracker.close():
+            print("✅ Load test logged to MLflow")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Model Loader for Pine Hollow Mystery
+Lazily imports torch/transformers, loads GPT-2 once per process and can keep it warm in a local worker
+
+Usage:
+    python model_loader.py --serve          # keep a warm GPT-2 worker running
+    python run_mystery_experiment.py --warm-worker
+"""
+
+import argparse
+import importlib.util
+import os
+import secrets
+import time
+from contextlib import contextmanager
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+
+DEFAULT_MODEL_NAME = "gpt2"
+PRECISIONS = ("fp32", "bf16", "int8")
+WARM_WORKER_HOST = "localhost"
+WARM_WORKER_PORT = 6150
+# Messages are pickles, so each worker start writes a fresh authkey only this user can read
+WARM_WORKER_KEY_DIR = Path.home() / ".cache" / "pine_hollow"
+
+# Seconds spent per startup stage in this process
+STARTUP_TIMINGS = {}
+
+# (model_name, device, precision) -> (model, tokenizer), so weights load once per process
+_LOADED_MODELS = {}
+
+
+@contextmanager
+def timed(stage):
+    """
+    Add the wall-clock time of the wrapped block to STARTUP_TIMINGS[stage]
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[stage] = STARTUP_TIMINGS.get(stage, 0.0) + time.perf_counter() - start
+
+
+def get_device():
+    """
+    Pick the torch device, importing torch on first use
+    """
+    with timed("import_torch"):
+        import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def load_model(model_name=DEFAULT_MODEL_NAME, device=None, precision="fp32"):
+    """
+    Load GPT-2 and its tokenizer, reusing an already-loaded copy in this process
+    precision: "fp32", "bf16" or "int8" (dynamic quantization, CPU only)
+    Returns: (model, tokenizer)
+    """
+    device = device or get_device()
+    key = (model_name, device, precision)
+    if key in _LOADED_MODELS:
+        return _LOADED_MODELS[key]
+
+    tokenizer = load_tokenizer(model_name)
+
+    with timed("import_transformers"):
+        from transformers import GPT2LMHeadModel
+
+    with timed("load_weights"):
+        model = _load_weights(GPT2LMHeadModel, model_name)
+
+    with timed("move_to_device"):
+        model.to(device).eval()
+
+    if precision != "fp32":
+        with timed("apply_precision"):
+            model = apply_precision(model, precision, device)
+
+    _LOADED_MODELS[key] = (model, tokenizer)
+    return model, tokenizer
+
+
+def apply_precision(model, precision, device="cpu"):
+    """
+    Convert a loaded fp32 model for reduced-precision inference
+    Returns: the converted model (int8 returns a new module tree)
+    """
+    import torch
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; expected one of {PRECISIONS}")
+    if precision == "bf16":
+        if device == "cuda" and not torch.cuda.is_bf16_supported():
+            raise ValueError("bf16 is not supported on this GPU")
+        return model.to(torch.bfloat16)
+    if precision == "int8":
+        if device != "cpu":
+            raise ValueError("int8 dynamic quantization only runs on CPU")
+        from torch.ao.quantization import quantize_dynamic
+
+        # GPT-2's attention/MLP projections are Conv1D, which dynamic quantization does not recognise
+        _convert_conv1d_to_linear(model)
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8).eval()
+    return model
+
+
+def _convert_conv1d_to_linear(module):
+    import torch
+    from transformers.pytorch_utils import Conv1D
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            # Conv1D stores its weight as (in, out); Linear wants (out, in)
+            linear = torch.nn.Linear(child.weight.size(0), child.nf)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            _convert_conv1d_to_linear(child)
+
+
+def load_tokenizer(model_name=DEFAULT_MODEL_NAME):
+    """
+    Load just the GPT-2 tokenizer (enough for a parent process that hands generation to workers)
+    """
+    with timed("import_transformers"):
+        from transformers import GPT2Tokenizer
+
+    with timed("load_tokenizer"):
+        return GPT2Tokenizer.from_pretrained(model_name)
+
+
+def _load_weights(model_class, model_name):
+    if importlib.util.find_spec("safetensors") is None:
+        return model_class.from_pretrained(model_name)
+
+    # safetensors checkpoints are memory-mapped rather than unpickled into fresh buffers
+    try:
+        return model_class.from_pretrained(model_name, use_safetensors=True)
+    except OSError:
+        return model_class.from_pretrained(model_name, use_safetensors=False)
+
+
+def report_startup_times():
+    """
+    Print the startup breakdown collected so far
+    Returns: dict of MLflow-ready metric names -> seconds
+    """
+    if not STARTUP_TIMINGS:
+        return {}
+
+    print("\n⏱️ Startup breakdown:")
+    for stage, seconds in STARTUP_TIMINGS.items():
+        print(f"   • {stage}: {seconds:.2f}s")
+    print(f"   • total: {sum(STARTUP_TIMINGS.values()):.2f}s")
+
+    return {f"startup_{stage}_seconds": seconds for stage, seconds in STARTUP_TIMINGS.items()}
+
+
+def warm_worker_key_path(port=WARM_WORKER_PORT):
+    return WARM_WORKER_KEY_DIR / f"warm_worker-{port}.key"
+
+
+def _write_warm_worker_key(port):
+    """
+    Write a random authkey readable by this user only
+    Returns: the key
+    """
+    key = secrets.token_bytes(32)
+    WARM_WORKER_KEY_DIR.mkdir(parents=True, exist_ok=True, mode=0o700)
+    path = warm_worker_key_path(port)
+    path.unlink(missing_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+class WarmWorkerClient:
+    """
+    Sends generation requests to a warm worker started with `python model_loader.py --serve`
+    """
+
+    def __init__(self, model_name, host=WARM_WORKER_HOST, port=WARM_WORKER_PORT, options=None):
+        """
+        options: engine settings the worker applies to this client's requests
+                 (batch_size, cache_path - None for no cache - and cache_max_bytes)
+        """
+        self.model_name = model_name
+        self.address = (host, port)
+        self.options = options or {}
+        # A missing key file means no worker is running (FileNotFoundError is an OSError)
+        self.authkey = warm_worker_key_path(port).read_bytes()
+
+    def _request(self, message):
+        with Client(self.address, authkey=self.authkey) as conn:
+            conn.send(message)
+            reply = conn.recv()
+        if "error" in reply:
+            raise RuntimeError(f"Warm worker failed: {reply['error']}")
+        return reply
+
+    def generate(self, prompts, **kwargs):
+        """
+        Same interface as GenerationEngine.generate, run inside the worker process
+        """
+        return self._request({"op": "generate", "prompts": list(prompts), "kwargs": kwargs,
+                              "options": self.options})["continuations"]
+
+
+def connect_warm_worker(model_name=DEFAULT_MODEL_NAME, host=WARM_WORKER_HOST, port=WARM_WORKER_PORT,
+                        precision="fp32", options=None):
+    """
+    Returns: WarmWorkerClient if a worker serving model_name at this precision is listening, else None
+    """
+    try:
+        client = WarmWorkerClient(model_name, host, port, options)
+        reply = client._request({"op": "ping"})
+    except (ConnectionRefusedError, OSError, EOFError):
+        return None
+
+    if reply.get("model_name") != model_name:
+        print(f"⚠️ Warm worker serves {reply.get('model_name')}, not {model_name}")
+        return None
+    if reply.get("precision", "fp32") != precision:
+        print(f"⚠️ Warm worker runs {reply.get('precision', 'fp32')}, not {precision}")
+        return None
+    return client
+
+
+def serve_warm_worker(model_name=DEFAULT_MODEL_NAME, batch_size=None, host=WARM_WORKER_HOST,
+                      port=WARM_WORKER_PORT, cache_path=None, precision="fp32"):
+    """
+    Load GPT-2 once and answer generation requests until a shutdown request arrives
+    batch_size, cache_path: defaults for clients that don't send their own options
+    """
+    from multiprocessing import AuthenticationError
+
+    from generation_cache import GenerationCache
+    from generation_engine import DEFAULT_BATCH_SIZE, GenerationEngine
+
+    model, tokenizer = load_model(model_name, precision=precision)
+    engine = GenerationEngine(model, tokenizer, batch_size=batch_size or DEFAULT_BATCH_SIZE, precision=precision)
+    defaults = {"batch_size": engine.batch_size, "cache_path": cache_path}
+    caches = {}  # (path, max bytes) -> GenerationCache, opened on first use
+    report_startup_times()
+
+    def configure(options):
+        options = {**defaults, **(options or {})}
+        engine.batch_size = int(options["batch_size"])
+        engine.cache = None
+        if options["cache_path"]:
+            key = (str(options["cache_path"]), options.get("cache_max_bytes"))
+            if key not in caches:
+                caches[key] = GenerationCache(key[0], **({"max_bytes": key[1]} if key[1] else {}))
+            engine.cache = caches[key]
+
+    authkey = _write_warm_worker_key(port)
+    try:
+        with Listener((host, port), authkey=authkey) as listener:
+            print(f"🔥 Warm {model_name} worker listening on {host}:{port}")
+            running = True
+            while running:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, OSError, EOFError) as e:
+                    print(f"⚠️ Rejected connection: {e!r}")
+                    continue
+                # One bad client gets an error reply (if it is still there), never stops the worker
+                with conn:
+                    try:
+                        message = conn.recv()
+                        if message["op"] == "shutdown":
+                            conn.send({"model_name": model_name})
+                            running = False
+                        elif message["op"] == "ping":
+                            conn.send({"model_name": model_name, "precision": precision})
+                        else:
+                            configure(message.get("options"))
+                            continuations = engine.generate(message["prompts"], **message["kwargs"])
+                            conn.send({"continuations": continuations})
+                    except Exception as e:
+                        print(f"⚠️ Request failed: {e!r}")
+                        try:
+                            conn.send({"error": repr(e)})
+                        except Exception:
+                            pass
+    finally:
+        warm_worker_key_path(port).unlink(missing_ok=True)
+
+    print("👋 Warm worker stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep a warm GPT-2 worker for the experiment scripts")
+    parser.add_argument("--serve", action="store_true", help="Start the warm worker")
+    parser.add_argument("--shutdown", action="store_true", help="Stop a running warm worker")
+    parser.add_argument("--model-name", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--port", type=int, default=WARM_WORKER_PORT)
+    parser.add_argument("--cache-path", default=None,
+                        help="Optional generation cache used by the worker")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32")
+    args = parser.parse_args()
+
+    if args.shutdown:
+        try:
+            WarmWorkerClient(args.model_name, port=args.port)._request({"op": "shutdown"})
+            print("✅ Warm worker shut down")
+        except (ConnectionRefusedError, OSError, EOFError):
+            print("❌ No warm worker running")
+    elif args.serve:
+        serve_warm_worker(args.model_name, args.batch_size, port=args.port, cache_path=args.cache_path,
+                          precision=args.precision)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
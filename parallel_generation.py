@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Multi-Process Generation for Pine Hollow Mystery
+Spreads GenerationEngine batches across CPU worker processes that each load GPT-2 once
+
+Rows sample with their own derived seeds and batches are formed before dispatch, so the
+generated text is identical whatever the worker count (for a fixed --threads-per-worker).
+"""
+
+import multiprocessing
+
+from model_loader import DEFAULT_MODEL_NAME
+
+DEFAULT_THREADS_PER_WORKER = 1
+
+# Set inside each worker process by _init_worker
+_worker_engine = None
+
+
+def _init_worker(model_name, threads_per_worker, precision):
+    global _worker_engine
+
+    import torch
+    from generation_engine import GenerationEngine
+    from model_loader import load_model
+
+    # One intra-op thread per worker avoids oversubscribing cores across processes
+    torch.set_num_threads(threads_per_worker)
+    model, tokenizer = load_model(model_name, device="cpu", precision=precision)
+    _worker_engine = GenerationEngine(model, tokenizer, precision=precision)
+
+
+def _run_worker_job(args):
+    job, sampling = args
+    return _worker_engine.run_job(job, sampling)
+
+
+class GenerationPool:
+    """
+    Process pool of GPT-2 workers pulling batch jobs from a shared queue
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL_NAME, workers=None,
+                 threads_per_worker=DEFAULT_THREADS_PER_WORKER, precision="fp32"):
+        self.model_name = model_name
+        self.precision = precision
+        self.workers = workers or multiprocessing.cpu_count()
+
+        # spawn gives every worker a clean torch runtime instead of a forked copy of ours
+        context = multiprocessing.get_context("spawn")
+        self.pool = context.Pool(self.workers, initializer=_init_worker,
+                                 initargs=(model_name, threads_per_worker, precision))
+        print(f"🧵 Started {self.workers} generation workers ({threads_per_worker} threads each)")
+
+    def map_jobs(self, jobs, sampling):
+        """
+        Run batch jobs across the workers
+        Returns: iterator of per-job continuations in job order
+        """
+        # chunksize=1 lets idle workers pull the next batch as soon as they finish one
+        return self.pool.imap(_run_worker_job, [(job, sampling) for job in jobs], chunksize=1)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Quality Scoring for Pine Hollow Mystery
+Batched GPT-2 perplexity and a reduced-precision quality check against the fp32 baseline
+
+Usage:
+    python quality_scoring.py --precision int8
+"""
+
+import argparse
+import time
+
+import pandas as pd
+
+from generation_engine import GenerationEngine, bucket_by_length, build_prompt, derive_seed, token_list
+from keyword_scoring import SUPERNATURAL_ATMOSPHERE_KEYWORDS, MYSTERY_ELEMENT_KEYWORDS, KeywordScorer
+from model_loader import DEFAULT_MODEL_NAME, PRECISIONS, load_model
+from streaming_pipeline import DEFAULT_CHUNK_SIZE, iter_scenario_chunks
+from token_store import TokenStore
+
+DEFAULT_QUALITY_DATASETS = ["data/pine_hollow_enhanced_v2.csv", "data/pine_hollow_expanded.csv"]
+DEFAULT_MAX_PERPLEXITY_INCREASE = 0.05  # relative, on the human reference responses
+DEFAULT_MAX_KEYWORD_DROP = 0.5          # mean keywords per response, per category
+DEFAULT_QUALITY_LIMIT = 32              # scenarios an experiment run re-generates for its quality check
+
+
+def perplexities(model, tokenizer, texts, contexts=None, batch_size=8, context_ids=None):
+    """
+    Perplexity of each text, optionally conditioned on a context that is not itself scored
+    context_ids: the contexts already tokenized (e.g. TokenStore slices), used instead of contexts
+    Returns: list of floats aligned with texts
+    """
+    import torch
+
+    device = next(model.parameters()).device
+    max_positions = model.config.n_positions
+    eos_id = tokenizer.eos_token_id
+    contexts = contexts or [""] * len(texts)
+
+    if context_ids is not None:
+        contexts = [token_list(ids) for ids in context_ids]
+    rows = []
+    for context, text in zip(contexts, texts):
+        if isinstance(context, str):
+            context = tokenizer.encode(context) if context else [eos_id]
+        text_ids = tokenizer.encode(text)
+        ids = ((context or [eos_id]) + text_ids)[-max_positions:]
+        rows.append((ids, min(len(text_ids), len(ids) - 1)))
+
+    results = [float('nan')] * len(rows)
+    with torch.no_grad():
+        # Similar lengths share a batch, so little compute goes to padding
+        for batch_rows in bucket_by_length([len(ids) for ids, _ in rows], batch_size):
+            batch = [rows[i] for i in batch_rows]
+            width = max(len(ids) for ids, _ in batch)
+            # Left-padded like the generation engine, with positions counted from each row's first token
+            input_ids = torch.tensor([[eos_id] * (width - len(ids)) + ids for ids, _ in batch], device=device)
+            attention_mask = torch.tensor([[0] * (width - len(ids)) + [1] * len(ids) for ids, _ in batch],
+                                          device=device)
+            position_ids = (attention_mask.cumsum(dim=-1) - 1).clamp(min=0)
+            logits = model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids).logits
+
+            log_probs = torch.log_softmax(logits[:, :-1].float(), dim=-1)
+            token_log_probs = log_probs.gather(-1, input_ids[:, 1:, None]).squeeze(-1)
+            for row, (index, (_, scored)) in enumerate(zip(batch_rows, batch)):
+                if scored > 0:
+                    nll = -token_log_probs[row, -scored:].mean()
+                    results[index] = float(torch.exp(nll))
+    return results
+
+
+def load_scenarios(paths, limit=None):
+    """
+    Read prompt/response pairs chunk by chunk, stopping as soon as `limit` scenarios are in hand
+    """
+    chunk_size = min(limit, DEFAULT_CHUNK_SIZE) if limit else DEFAULT_CHUNK_SIZE
+    frames, rows = [], 0
+    for path in paths:
+        for chunk in iter_scenario_chunks(path, chunk_size, usecols=['prompt', 'response']):
+            chunk = chunk.head(limit - rows) if limit else chunk
+            frames.append(chunk.drop(columns='scenario_id').assign(source=path))
+            rows += len(chunk)
+            if limit and rows >= limit:
+                return pd.concat(frames, ignore_index=True)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _generate(engine, prompts, max_new_tokens, seeds, prompt_ids=None, temperature=0.8):
+    start = time.perf_counter()
+    continuations = engine.generate(prompts, max_new_tokens, temperature, seeds=seeds, prompt_ids=prompt_ids)
+    return continuations, time.perf_counter() - start
+
+
+def precision_quality_check(model_name=DEFAULT_MODEL_NAME, precision="int8", data_paths=DEFAULT_QUALITY_DATASETS,
+                            max_new_tokens=40, seed=42, limit=None,
+                            max_perplexity_increase=DEFAULT_MAX_PERPLEXITY_INCREASE,
+                            max_keyword_drop=DEFAULT_MAX_KEYWORD_DROP, temperature=0.8):
+    """
+    Generate the same seeded scenarios at fp32 and at `precision`, then compare keyword scores and perplexity
+    limit: scenarios to check, read from the start of data_paths (None checks every one)
+    temperature: sampling temperature, matching the run being checked
+    Returns: dict of MLflow-ready metrics plus 'passed'
+    """
+    import math
+
+    scenarios = load_scenarios(data_paths, limit)
+    prompts = [build_prompt(row) for row in scenarios.to_dict('records')]
+    seeds = [derive_seed(seed, f"{source}:{idx}") for idx, source in zip(scenarios.index, scenarios['source'])]
+    # Each file's rows are its scenario ids, in order
+    stores = {path: TokenStore.for_dataset(path, model_name) for path in data_paths}
+    prompt_ids = [stores[source].tokens(scenario_id) for scenario_id, source in
+                  zip(scenarios.groupby('source', sort=False).cumcount(), scenarios['source'])]
+    scorer = KeywordScorer({'mystery': MYSTERY_ELEMENT_KEYWORDS, 'atmosphere': SUPERNATURAL_ATMOSPHERE_KEYWORDS})
+
+    results = {}
+    models = {}
+    for name in ("fp32", precision):
+        model, tokenizer = load_model(model_name, "cpu", precision=name)
+        models[name] = model
+        engine = GenerationEngine(model, tokenizer, precision=name)
+        continuations, seconds = _generate(engine, prompts, max_new_tokens, seeds, prompt_ids, temperature)
+        keyword_scores = scorer.score(continuations).mean()
+
+        # Teacher-forced perplexity on the human responses isolates numerical drift from sampling luck
+        reference_ppl = perplexities(model, tokenizer, scenarios['response'].tolist(), context_ids=prompt_ids)
+        results[name] = {
+            'continuations': continuations,
+            'seconds': seconds,
+            'mystery_score': float(keyword_scores['mystery']),
+            'atmosphere_score': float(keyword_scores['atmosphere']),
+            'reference_perplexity': sum(reference_ppl) / len(reference_ppl)
+        }
+
+    # Judge each precision's own generations with the fp32 model
+    for name in results:
+        generated_ppl = [p for p in perplexities(models["fp32"], tokenizer, results[name]['continuations'],
+                                                 context_ids=prompt_ids) if not math.isnan(p)]
+        results[name]['generated_perplexity'] = sum(generated_ppl) / len(generated_ppl) if generated_ppl else 0.0
+
+    baseline, candidate = results["fp32"], results[precision]
+    perplexity_increase = candidate['reference_perplexity'] / baseline['reference_perplexity'] - 1
+    keyword_drop = max(baseline[f'{category}_score'] - candidate[f'{category}_score']
+                       for category in ('mystery', 'atmosphere'))
+
+    metrics = {'scenarios': len(prompts), 'perplexity_increase': perplexity_increase, 'keyword_drop': keyword_drop,
+               'speedup': baseline['seconds'] / candidate['seconds'] if candidate['seconds'] else 0.0}
+    for name, label in (("fp32", "baseline"), (precision, "candidate")):
+        for key in ('mystery_score', 'atmosphere_score', 'reference_perplexity', 'generated_perplexity', 'seconds'):
+            metrics[f'{label}_{key}'] = results[name][key]
+    metrics['passed'] = perplexity_increase <= max_perplexity_increase and keyword_drop <= max_keyword_drop
+    return metrics
+
+
+def report_quality_check(precision, metrics):
+    """
+    Print a quality check result
+    Returns: dict of quality_* metrics for MLflow
+    """
+    status = "✅ passed" if metrics['passed'] else "⚠️ FAILED"
+    print(f"\n🔬 {precision} quality check vs fp32 ({metrics['scenarios']} scenarios): {status}")
+    print(f"   • Reference perplexity: {metrics['baseline_reference_perplexity']:.2f} -> "
+          f"{metrics['candidate_reference_perplexity']:.2f} ({metrics['perplexity_increase']:+.1%})")
+    print(f"   • Mystery score: {metrics['baseline_mystery_score']:.2f} -> {metrics['candidate_mystery_score']:.2f}")
+    print(f"   • Atmosphere score: {metrics['baseline_atmosphere_score']:.2f} -> "
+          f"{metrics['candidate_atmosphere_score']:.2f}")
+    print(f"   • Generation speedup: {metrics['speedup']:.2f}x")
+    return {f"quality_{name}": float(value) for name, value in metrics.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check reduced-precision GPT-2 quality against fp32")
+    parser.add_argument("--model-name", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--precision", choices=[p for p in PRECISIONS if p != "fp32"], default="int8")
+    parser.add_argument("--data", nargs="+", default=DEFAULT_QUALITY_DATASETS)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--max-new-tokens", type=int, default=40)
+    parser.add_argument("--temperature", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-perplexity-increase", type=float, default=DEFAULT_MAX_PERPLEXITY_INCREASE)
+    parser.add_argument("--max-keyword-drop", type=float, default=DEFAULT_MAX_KEYWORD_DROP)
+    parser.add_argument("--no-mlflow", action="store_true")
+    args = parser.parse_args()
+
+    metrics = precision_quality_check(args.model_name, args.precision, args.data, args.max_new_tokens, args.seed,
+                                      args.limit, args.max_perplexity_increase, args.max_keyword_drop,
+                                      args.temperature)
+    quality_metrics = report_quality_check(args.precision, metrics)
+
+    if not args.no_mlflow:
+        from tracking import BufferedTracker
+        tracker = BufferedTracker("cyoa_model_experiments", f"pine_hollow_{args.precision}_quality_check")
+        tracker.log_param("model_name", args.model_name)
+        tracker.log_param("precision", args.precision)
+        tracker.log_metrics(quality_metrics)
+        if tracker.close():
+            print("✅ Quality check logged to MLflow")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Response Scoring for Pine Hollow Mystery
+Batched perplexity and human/AI embedding similarity for generated responses, cached per response hash
+
+Usage:
+    python response_scoring.py generated_stories_pine_hollow_baseline.csv
+    python response_scoring.py generated_stories_expanded_pine_hollow.csv --reference-model gpt2-medium
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import sqlite3
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from generation_engine import bucket_by_length
+from model_loader import DEFAULT_MODEL_NAME, get_device, load_model
+from quality_scoring import perplexities
+
+DEFAULT_SCORE_CACHE_PATH = ".generation_cache/scores.sqlite"
+DEFAULT_SCORE_BATCH_SIZE = 16
+SCORE_GROUP_COLUMNS = ['atmosphere_level', 'dialogue_style']
+
+
+def score_key(metric, model_name, text, context=""):
+    """
+    Hash a metric, the scoring model and the texts it is computed from into one cache key
+    """
+    payload = json.dumps({"metric": metric, "model_name": model_name, "text": text, "context": context},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ScoreCache:
+    """
+    On-disk response hash -> score cache, so rescoring a results file only scores new responses
+    """
+
+    def __init__(self, path=DEFAULT_SCORE_CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, value REAL)")
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """
+        Returns: dict of key -> score for the keys that were cached
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        for start in range(0, len(unique_keys), 500):
+            chunk = unique_keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(f"SELECT key, value FROM scores WHERE key IN ({placeholders})", chunk)
+            # SQLite stores NaN as NULL
+            found.update((key, float('nan') if value is None else value) for key, value in rows)
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        self.conn.executemany("INSERT OR REPLACE INTO scores (key, value) VALUES (?, ?)", list(items))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def cached_scores(cache, keys, compute):
+    """
+    Look scores up by key and compute only the missing ones
+    compute: function of a list of row positions -> list of scores for those rows
+    Returns: list of scores aligned with keys
+    """
+    found = cache.get_many(keys) if cache is not None else {}
+    # Identical responses share a key and are scored once
+    first_rows = {}
+    for i, key in enumerate(keys):
+        if key not in found:
+            first_rows.setdefault(key, i)
+    missing = list(first_rows.values())
+    if missing:
+        computed = compute(missing)
+        fresh = {keys[i]: value for i, value in zip(missing, computed)}
+        if cache is not None:
+            cache.put_many(fresh.items())
+        found.update(fresh)
+    return [found[key] for key in keys]
+
+
+def embeddings(model, tokenizer, texts, batch_size=DEFAULT_SCORE_BATCH_SIZE):
+    """
+    Mean-pooled, L2-normalized last hidden states of the language model
+    Returns: float tensor of shape (len(texts), hidden size); empty texts get NaN rows, like their perplexity
+    """
+    import torch
+
+    device = next(model.parameters()).device
+    max_positions = model.config.n_positions
+    eos_id = tokenizer.eos_token_id
+    rows = [tokenizer.encode(text)[:max_positions] for text in texts]
+
+    # Nothing to embed: a NaN row keeps its similarity out of the means instead of scoring a lone eos
+    pooled = [None if ids else torch.full((model.config.n_embd,), float('nan')) for ids in rows]
+    embedded = [i for i, ids in enumerate(rows) if ids]
+    with torch.no_grad():
+        for bucket in bucket_by_length([len(rows[i]) for i in embedded], batch_size):
+            batch_rows = [embedded[i] for i in bucket]
+            batch = [rows[i] for i in batch_rows]
+            width = max(len(ids) for ids in batch)
+            input_ids = torch.tensor([[eos_id] * (width - len(ids)) + ids for ids in batch], device=device)
+            attention_mask = torch.tensor([[0] * (width - len(ids)) + [1] * len(ids) for ids in batch],
+                                          device=device)
+            position_ids = (attention_mask.cumsum(dim=-1) - 1).clamp(min=0)
+            hidden = model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                           output_hidden_states=True).hidden_states[-1].float()
+
+            mask = attention_mask[:, :, None].float()
+            means = torch.nn.functional.normalize((hidden * mask).sum(dim=1) / mask.sum(dim=1), dim=-1)
+            for index, vector in zip(batch_rows, means.cpu()):
+                pooled[index] = vector
+    return torch.stack(pooled) if pooled else torch.empty(0)
+
+
+def score_responses(results_df, model_name=DEFAULT_MODEL_NAME, reference_model=None,
+                    batch_size=DEFAULT_SCORE_BATCH_SIZE, cache=None):
+    """
+    Score each AI response: perplexity given its prompt, optionally under a reference model too,
+    and cosine similarity to the human response
+    Returns: DataFrame aligned with results_df
+    """
+    prompts = results_df['prompt'].fillna('').astype(str).tolist()
+    ai_responses = results_df['ai_response'].fillna('').astype(str).tolist()
+    human_responses = results_df['human_response'].fillna('').astype(str).tolist()
+    scores = pd.DataFrame(index=results_df.index)
+
+    def models(name):
+        # Only loaded once something isn't cached; load_model keeps it for the next chunk
+        return load_model(name, get_device())
+
+    def perplexity(name):
+        return lambda rows: perplexities(*models(name), [ai_responses[i] for i in rows],
+                                         contexts=[prompts[i] for i in rows], batch_size=batch_size)
+
+    def similarity(rows):
+        ai_vectors = embeddings(*models(model_name), [ai_responses[i] for i in rows], batch_size)
+        human_vectors = embeddings(*models(model_name), [human_responses[i] for i in rows], batch_size)
+        return (ai_vectors * human_vectors).sum(dim=-1).tolist()
+
+    scorers = [(model_name, 'perplexity')] + ([(reference_model, 'reference_perplexity')] if reference_model else [])
+    for name, column in scorers:
+        keys = [score_key('perplexity', name, text, prompt) for text, prompt in zip(ai_responses, prompts)]
+        scores[column] = cached_scores(cache, keys, perplexity(name))
+
+    keys = [score_key('embedding_similarity', model_name, ai, human)
+            for ai, human in zip(ai_responses, human_responses)]
+    scores['embedding_similarity'] = cached_scores(cache, keys, similarity)
+    # Also covers scores cached before empty responses were embedded as NaN
+    scores.loc[[not text for text in ai_responses], 'embedding_similarity'] = float('nan')
+    return scores
+
+
+def grouped_scores(results_df, scores, group_columns=SCORE_GROUP_COLUMNS):
+    """
+    Returns: dict of group column -> DataFrame of mean scores and row counts per value
+    """
+    report = {}
+    for column in group_columns:
+        if column in results_df.columns:
+            grouped = scores.groupby(results_df[column], observed=True)
+            report[column] = grouped.mean().assign(rows=grouped.size())
+    return report
+
+
+def report_scores(scores, groups):
+    """
+    Print overall and per-group scores
+    Returns: dict of MLflow-ready metrics
+    """
+    metrics = {f"mean_{name}": float(value) for name, value in scores.mean().items() if not math.isnan(value)}
+    print(f"\n🧪 Response scores ({len(scores)} responses):")
+    for name, value in metrics.items():
+        print(f"   • {name}: {value:.3f}")
+
+    for column, table in groups.items():
+        print(f"\n   By {column}:")
+        for value, row in table.iterrows():
+            details = ", ".join(f"{name} {row[name]:.2f}" for name in scores.columns)
+            print(f"   • {value} ({int(row['rows'])}): {details}")
+            for name in scores.columns:
+                if not math.isnan(row[name]):
+                    metrics[f"{name}_{column}_{str(value).strip()}"] = float(row[name])
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score generated responses with perplexity and embedding similarity")
+    parser.add_argument("results", help="Results file written by an experiment run (.csv or .parquet)")
+    parser.add_argument("--model-name", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--reference-model", default=None,
+                        help="Second model to compute perplexity under, e.g. gpt2-medium")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_SCORE_BATCH_SIZE)
+    parser.add_argument("--cache-path", default=DEFAULT_SCORE_CACHE_PATH)
+    parser.add_argument("--output", default=None, help="Write per-response scores to this CSV")
+    parser.add_argument("--no-mlflow", action="store_true")
+    args = parser.parse_args()
+
+    from streaming_pipeline import iter_result_chunks
+
+    cache = ScoreCache(args.cache_path)
+    start = time.perf_counter()
+    frames, score_frames = [], []
+    for chunk in iter_result_chunks(args.results):
+        frames.append(chunk[[c for c in chunk.columns if c in ['scenario_id', *SCORE_GROUP_COLUMNS]]])
+        score_frames.append(score_responses(chunk, args.model_name, args.reference_model, args.batch_size, cache))
+    results_df = pd.concat(frames, ignore_index=True)
+    scores = pd.concat(score_frames, ignore_index=True)
+    elapsed = time.perf_counter() - start
+
+    metrics = report_scores(scores, grouped_scores(results_df, scores))
+    print(f"\n⚡ Scored in {elapsed:.1f}s ({cache.hits} cached, {cache.misses} computed)")
+    if args.output:
+        pd.concat([results_df, scores], axis=1).to_csv(args.output, index=False)
+        print(f"📁 Scores: {args.output}")
+
+    if not args.no_mlflow:
+        from tracking import BufferedTracker
+        tracker = BufferedTracker("cyoa_model_experiments", "pine_hollow_response_scoring")
+        tracker.log_param("results", args.results)
+        tracker.log_param("model_name", args.model_name)
+        tracker.log_param("reference_model", args.reference_model)
+        tracker.log_metrics(metrics)
+        tracker.log_metric("scoring_seconds", elapsed)
+        if tracker.close():
+            print("✅ Response scores logged to MLflow")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
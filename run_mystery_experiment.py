@@ -4,112 +4,306 @@ Quick Pine Hollow Mystery Experiment
 Test GPT-2 on Twin Peaks-inspired mystery scenarios
 """
 
-import pandas as pd
-import mlflow
-from transformers import GPT2LMHeadModel, GPT2Tokenizer, pipeline
-import torch
+import argparse
+import os
 import warnings
+from best_of_n import DEFAULT_BEST_OF, RERANK_COLUMNS, BestOfNSampler, report_best_of
+from dataset_registry import DatasetRegistry
+from dedup_index import results_dedup_metrics
+from generation_cache import DEFAULT_CACHE_MAX_MB, DEFAULT_CACHE_PATH, GenerationCache
+from generation_engine import DEFAULT_BATCH_SIZE, GenerationEngine, build_prompt, derive_seed
+from instrumentation import StageProfiler, add_profile_arguments
+# torch and transformers are imported lazily (mlflow by the tracker thread) so --help and warm-worker runs start fast
+from model_loader import (PRECISIONS, connect_warm_worker, get_device, load_model, load_tokenizer,
+                          report_startup_times)
+from parallel_generation import DEFAULT_THREADS_PER_WORKER, GenerationPool
+from quality_scoring import DEFAULT_QUALITY_LIMIT, precision_quality_check, report_quality_check
+from speculative_decoding import (DEFAULT_DRAFT_TOKENS, DEFAULT_SPEEDUP_SAMPLE, measure_speedup,
+                                  report_speculative)
+from streaming_pipeline import (DEFAULT_CHUNK_SIZE, ResultWriter, count_values, iter_scenario_chunks,
+                                summarize_results)
+from token_store import TokenStore
+from tracking import BufferedTracker
 warnings.filterwarnings('ignore')
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pine Hollow mystery baseline experiment")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Scenarios generated per forward pass")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH,
+                        help="SQLite file holding previously generated continuations")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_CACHE_MAX_MB,
+                        help="Evict least recently used continuations beyond this size")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always regenerate instead of replaying cached continuations")
+    parser.add_argument("--warm-worker", action="store_true",
+                        help="Generate through a worker started with `python model_loader.py --serve`")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Generation processes, each loading its own GPT-2 (CPU only)")
+    parser.add_argument("--threads-per-worker", type=int, default=DEFAULT_THREADS_PER_WORKER,
+                        help="torch intra-op threads inside each worker process")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Base seed; every scenario samples with a seed derived from it")
+    parser.add_argument("--data", default="data/pine_hollow_enhanced_v2.csv",
+                        help="Scenario CSV, or its .parquet from scenario_store.py, to generate from")
+    parser.add_argument("--output", default="generated_stories_pine_hollow_baseline.csv",
+                        help="Results file (.csv, or .parquet for a directory of row-group parts)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Scenarios read, generated and written per chunk")
+    parser.add_argument("--resume", action="store_true",
+                        help="Keep existing results and skip scenarios already in --output")
+    parser.add_argument("--max-new-tokens", type=int, default=40,
+                        help="Continuation budget per scenario, in GPT-2 tokens")
+    parser.add_argument("--min-new-tokens", type=int, default=20,
+                        help="Tokens generated before a sentence end may stop the continuation early")
+    parser.add_argument("--no-sentence-stop", action="store_true",
+                        help="Always generate the full --max-new-tokens budget")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32",
+                        help="Inference precision: fp32, bf16 or int8 dynamic quantization (CPU)")
+    parser.add_argument("--skip-quality-check", action="store_true",
+                        help="Don't compare a reduced precision against fp32 on this dataset")
+    parser.add_argument("--quality-limit", type=int, default=DEFAULT_QUALITY_LIMIT,
+                        help="Scenarios the reduced-precision quality check re-generates at both precisions")
+    parser.add_argument("--draft-model", default=None,
+                        help="Smaller model that drafts tokens for GPT-2 to verify (speculative decoding), "
+                             "e.g. distilgpt2")
+    parser.add_argument("--draft-tokens", type=int, default=DEFAULT_DRAFT_TOKENS,
+                        help="Tokens the draft model proposes per GPT-2 forward pass")
+    parser.add_argument("--speedup-sample", type=int, default=DEFAULT_SPEEDUP_SAMPLE,
+                        help="Scenarios re-timed without the draft model to measure its speedup (0 skips)")
+    parser.add_argument("--best-of", type=int, default=DEFAULT_BEST_OF,
+                        help="Sample this many continuations per scenario and keep the best by keyword/atmosphere "
+                             "score and perplexity")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    if args.draft_model and (args.workers > 1 or args.warm_worker):
+        parser.error("--draft-model decodes in this process; it can't be combined with --workers or --warm-worker")
+    if args.draft_tokens < 1:
+        parser.error("--draft-tokens must be at least 1")
+    if args.quality_limit < 1:
+        parser.error("--quality-limit must be at least 1")
+    if args.best_of < 1:
+        parser.error("--best-of must be at least 1")
+    if args.best_of > 1 and (args.workers > 1 or args.warm_worker or args.draft_model):
+        parser.error("--best-of reranks with the local model; it can't be combined with --workers, --warm-worker "
+                     "or --draft-model")
+    return args
+
 def main():
+    args = parse_args()
+    profiler = StageProfiler(args.profile, args.profile_dir)
+    # The MLflow run is created in the background while the model loads
+    tracker = BufferedTracker("cyoa_model_experiments", "pine_hollow_mystery_baseline")
     print("🌲 Starting Pine Hollow Mystery Experiment")
-    print(f"⚡ Using device: {'GPU' if torch.cuda.is_available() else 'CPU'}")
     
-    # Load our enhanced mystery dataset
-    mystery_df = pd.read_csv('data/pine_hollow_enhanced_v2.csv')
-    print(f"📚 Loaded {len(mystery_df)} mystery scenarios")
-    print(f"🎬 Atmosphere progression: {mystery_df['atmosphere_level'].value_counts().to_dict()}")
-    print(f"🎭 Dialogue styles: {mystery_df['dialogue_style'].nunique()} unique styles")
+    # Profile our enhanced mystery dataset without loading every column
+    with profiler.stage("profile_data"):
+        profile = count_values(args.data, ['atmosphere_level', 'dialogue_style'], args.chunk_size)
+    num_scenarios = sum(profile['atmosphere_level'].values())
+    print(f"📚 Found {num_scenarios} mystery scenarios")
+    print(f"🎬 Atmosphere progression: {profile['atmosphere_level']}")
+    print(f"🎭 Dialogue styles: {len(profile['dialogue_style'])} unique styles")
     
     # Load GPT-2 model
     print("\n🤖 Loading GPT-2 model...")
     model_name = "gpt2"
-    tokenizer = GPT2Tokenizer.from_pretrained(model_name)
-    model = GPT2LMHeadModel.from_pretrained(model_name)
-    tokenizer.pad_token = tokenizer.eos_token
+    cache = None
+    pool = None
+    with profiler.stage("load_model"):
+        # The worker generates with this run's batch size and cache settings, not the ones it started with
+        worker_options = {"batch_size": args.batch_size, "cache_path": None if args.no_cache else args.cache_path,
+                          "cache_max_bytes": int(args.cache_max_mb * 1024 * 1024)}
+        engine = connect_warm_worker(model_name, precision=args.precision,
+                                     options=worker_options) if args.warm_worker else None
+        if engine is not None:
+            print("🔥 Using warm GPT-2 worker")
+        else:
+            cache = None if args.no_cache else GenerationCache(args.cache_path, int(args.cache_max_mb * 1024 * 1024))
+            if args.workers > 1:
+                # Each worker loads its own copy; this process only needs the tokenizer for bucketing
+                pool = GenerationPool(model_name, args.workers, args.threads_per_worker, args.precision)
+                engine = GenerationEngine(None, load_tokenizer(model_name), batch_size=args.batch_size,
+                                          cache=cache, pool=pool)
+            else:
+                # Dynamic int8 quantization only has CPU kernels
+                device = "cpu" if args.precision == "int8" else get_device()
+                print(f"⚡ Using device: {'GPU' if device == 'cuda' else 'CPU'} ({args.precision})")
+                model, tokenizer = load_model(model_name, device, precision=args.precision)
+                draft_model = None
+                if args.draft_model:
+                    print(f"✏️ Drafting with {args.draft_model} ({args.draft_tokens} tokens per GPT-2 pass)")
+                    draft_model, _ = load_model(args.draft_model, device, precision=args.precision)
+                engine = GenerationEngine(model, tokenizer, batch_size=args.batch_size, cache=cache,
+                                          precision=args.precision, draft_model=draft_model,
+                                          draft_tokens=args.draft_tokens)
+            print("✅ GPT-2 model loaded")
+    best_of = BestOfNSampler(engine, args.best_of) if args.best_of > 1 else None
     
-    generator = pipeline('text-generation', 
-                        model=model, 
-                        tokenizer=tokenizer,
-                        device=0 if torch.cuda.is_available() else -1)
-    print("✅ GPT-2 model loaded")
+    # Prompts are tokenized once per dataset version, then read as memory-mapped token slices
+    with profiler.stage("token_store"):
+        token_store = TokenStore.for_dataset(args.data, model_name, tokenizer=getattr(engine, 'tokenizer', None))
     
-    # Generate mystery story responses
+    # Generate mystery story responses chunk by chunk, writing each chunk before the next
     print("\n🌫️ Generating mystery story responses...")
-    generated_stories = []
+    writer = ResultWriter(args.output, resume=args.resume)
     
-    for idx, row in mystery_df.iterrows():
-        prompt = f"Mystery Story: {row['prompt']} {row['response']}"
-        
-        # Generate AI response
-        ai_response = generator(
-            prompt,
-            max_length=len(prompt.split()) + 40,
-            temperature=0.8,
-            do_sample=True,
-            pad_token_id=tokenizer.eos_token_id,
-            num_return_sequences=1
-        )[0]['generated_text']
-        
-        # Extract generated part
-        ai_continuation = ai_response[len(prompt):].strip()
+    speedup_sample = None
+    chunks = iter_scenario_chunks(args.data, args.chunk_size, skip_ids=writer.completed_ids)
+    for mystery_df in profiler.iterate("read_scenarios", chunks):
+        prompts = [build_prompt(row) for row in mystery_df.to_dict('records')]
+        seeds = [derive_seed(args.seed, idx) for idx in mystery_df['scenario_id']]
+        if speedup_sample is None:
+            speedup_sample = (prompts[:args.speedup_sample], seeds[:args.speedup_sample])
+        with profiler.stage("generate"):
+            if best_of is not None:
+                # Sampled and reranked outside the continuation cache, which holds one text per key
+                generations = best_of.generate(
+                    prompts,
+                    args.max_new_tokens,
+                    temperature=0.8,
+                    seeds=seeds,
+                    sentence_stop=None if args.no_sentence_stop else args.min_new_tokens,
+                    prompt_ids=token_store.many(mystery_df['scenario_id'])
+                )
+            else:
+                generations = engine.generate(
+                    prompts,
+                    max_new_tokens=args.max_new_tokens,
+                    temperature=0.8,
+                    do_sample=True,
+                    seeds=seeds,
+                    sentence_stop=None if args.no_sentence_stop else args.min_new_tokens,
+                    details=True,
+                    prompt_ids=token_store.many(mystery_df['scenario_id'])
+                )
         
-        generated_stories.append({
-            'prompt': row['prompt'],
-            'human_response': row['response'],
-            'ai_response': ai_continuation,
-            'branch_type': row['branch_type'],
-            'atmosphere_level': row['atmosphere_level'],
-            'dialogue_style': row['dialogue_style'],
-            'choice_a': row['choice_a'],
-            'choice_b': row['choice_b']
-        })
+        chunk_results = mystery_df[['scenario_id', 'prompt', 'response', 'branch_type', 'atmosphere_level',
+                                    'dialogue_style', 'choice_a', 'choice_b']].rename(columns={'response': 'human_response'})
+        chunk_results.insert(3, 'ai_response', [g['continuation'] for g in generations])
+        # Per-scenario token accounting for capacity planning
+        for column in ('prompt_tokens', 'generated_tokens', 'stop_reason'):
+            chunk_results[column] = [g[column] for g in generations]
+        if best_of is not None:
+            # The winner's score breakdown, so reranking can be audited per scenario
+            for column in RERANK_COLUMNS:
+                chunk_results[column] = [g[column] for g in generations]
+        with profiler.stage("write_results"):
+            writer.write(chunk_results)
+        profiler.count("write_results", "rows", len(chunk_results))
         
-        print(f"📝 Generated story {idx + 1}/{len(mystery_df)} - {row['atmosphere_level']} atmosphere")
+        for idx, atmosphere in zip(mystery_df['scenario_id'], mystery_df['atmosphere_level']):
+            print(f"📝 Generated story {idx + 1}/{num_scenarios} - {atmosphere} atmosphere")
+    
+    if pool is not None:
+        pool.close()
+    for unit, amount in getattr(engine, 'token_counts', {}).items():
+        profiler.count("generate", unit, amount)
+    
+    speculative_metrics = {}
+    if getattr(engine, 'speculative', None) is not None:
+        speculative_metrics = engine.speculative.report()
+        sample_prompts, sample_seeds = speedup_sample or ([], [])
+        if sample_prompts:
+            # The same first scenarios with and without drafting, so the speedup is measured on this run's data
+            with profiler.stage("speedup_check"):
+                speculative_metrics.update(measure_speedup(
+                    engine, sample_prompts, args.max_new_tokens, temperature=0.8, seeds=sample_seeds,
+                    sentence_stop=None if args.no_sentence_stop else args.min_new_tokens))
+        report_speculative(speculative_metrics, args.draft_model)
     
-    results_df = pd.DataFrame(generated_stories)
+    best_of_metrics = {}
+    if best_of is not None:
+        best_of_metrics = best_of.report()
+        report_best_of(best_of_metrics, args.best_of)
+    
+    with profiler.stage("summarize"):
+        summary = summarize_results(args.output, count_columns=['atmosphere_level', 'stop_reason'])
+    
+    # Repetitive generations show up as near-duplicate continuations across scenarios
+    with profiler.stage("dedup"):
+        dedup_metrics = results_dedup_metrics(args.output)
+    print(f"🔁 Near-duplicate AI responses: {dedup_metrics['ai_response_duplicate_rows']} "
+          f"({dedup_metrics['ai_response_dedup_ratio']:.1%})")
+    
+    quality_metrics = {}
+    if args.precision != "fp32" and not args.skip_quality_check:
+        # Same seeded scenarios at fp32 and at the reduced precision, scored side by side
+        with profiler.stage("quality_check"):
+            quality_metrics = report_quality_check(args.precision, precision_quality_check(
+                model_name, args.precision, [args.data], args.max_new_tokens, seed=args.seed,
+                limit=args.quality_limit, temperature=0.8))
     
     # Display sample results
     print("\n🌲 PINE HOLLOW MYSTERY RESULTS (Sample)")
     print("=" * 80)
     
-    for idx in range(min(3, len(results_df))):
-        row = results_df.iloc[idx]
+    for idx, (_, row) in enumerate(summary['samples'].iterrows()):
         print(f"\n🎬 SCENARIO {idx + 1}: {row['branch_type']} ({row['atmosphere_level']})")
         print(f"📖 PROMPT: {row['prompt'][:100]}...")
         print(f"👤 HUMAN: {row['human_response'][:150]}...")
         print(f"🤖 AI: {row['ai_response'][:150]}...")
         print(f"🎭 Style: {row['dialogue_style']}")
     
-    # Save results
-    results_df.to_csv('generated_stories_pine_hollow_baseline.csv', index=False)
-    
-    # Log to MLflow
+    # Log to MLflow from a background thread; an unreachable tracking store spools instead of failing
     print("\n📊 Logging to MLflow...")
-    mlflow.set_experiment("cyoa_model_experiments")
-    
-    with mlflow.start_run(run_name="pine_hollow_mystery_baseline"):
+    with profiler.stage("mlflow_logging"):
         # Parameters
-        mlflow.log_param("model_name", model_name)
-        mlflow.log_param("story_theme", "pine_hollow_mystery")
-        mlflow.log_param("data_source", "twin_peaks_inspired")
-        mlflow.log_param("num_scenarios", len(mystery_df))
-        mlflow.log_param("atmosphere_progression", "twin_peaks_to_stranger_things")
-        
+        tracker.log_param("model_name", model_name)
+        tracker.log_param("story_theme", "pine_hollow_mystery")
+        tracker.log_param("data_source", "twin_peaks_inspired")
+        tracker.log_param("num_scenarios", num_scenarios)
+        tracker.log_param("atmosphere_progression", "twin_peaks_to_stranger_things")
+        tracker.log_param("batch_size", args.batch_size)
+        tracker.log_param("workers", args.workers)
+        tracker.log_param("seed", args.seed)
+        tracker.log_param("data_hash", DatasetRegistry().register(args.data))
+        tracker.log_param("token_store", token_store.path.name)
+        tracker.log_param("precision", args.precision)
+        tracker.log_param("draft_model", args.draft_model)
+        if args.draft_model:
+            tracker.log_param("draft_tokens", args.draft_tokens)
+        tracker.log_param("best_of", args.best_of)
+        tracker.log_param("max_new_tokens", args.max_new_tokens)
+        tracker.log_param("sentence_stop", None if args.no_sentence_stop else args.min_new_tokens)
+    
         # Metrics
-        mlflow.log_metric("stories_generated", len(results_df))
-        mlflow.log_metric("avg_response_length", results_df['ai_response'].str.len().mean())
-        mlflow.log_metric("twin_peaks_stories", len(results_df[results_df['atmosphere_level'] == 'twin_peaks']))
-        mlflow.log_metric("stranger_things_stories", len(results_df[results_df['atmosphere_level'] == 'stranger_things']))
-        
+        tracker.log_metric("stories_generated", summary['rows'])
+        tracker.log_metric("stories_generated_this_run", writer.rows_written)
+        tracker.log_metric("avg_response_length", summary['avg_response_length'])
+        for column in ('avg_prompt_tokens', 'avg_generated_tokens'):
+            if column in summary:
+                tracker.log_metric(column, summary[column])
+        for reason, count in summary['counts']['stop_reason'].items():
+            tracker.log_metric(f"stop_{reason}_count", count)
+        tracker.log_metric("twin_peaks_stories", summary['counts']['atmosphere_level'].get('twin_peaks', 0))
+        tracker.log_metric("stranger_things_stories", summary['counts']['atmosphere_level'].get('stranger_things', 0))
+    
+        if cache is not None:
+            for name, value in cache.report().items():
+                tracker.log_metric(name, value)
+        for name, value in report_startup_times().items():
+            tracker.log_metric(name, value)
+        tracker.log_metrics(dedup_metrics)
+        if speculative_metrics:
+            tracker.log_metrics(speculative_metrics)
+        if best_of_metrics:
+            tracker.log_metrics(best_of_metrics)
+        if quality_metrics:
+            tracker.log_metrics(quality_metrics)
+    
         # Artifacts
-        mlflow.log_artifact('generated_stories_pine_hollow_baseline.csv')
-        mlflow.log_artifact('data/pine_hollow_enhanced_v2.csv')
-        
+        if os.path.isdir(args.output):
+            tracker.log_artifacts(args.output, artifact_path=os.path.basename(args.output))
+        else:
+            tracker.log_artifact(args.output)
+        tracker.log_artifact(args.data)
+    
+    profiler.log_to_mlflow(tracker)
+    if tracker.close():
         print("✅ Experiment logged to MLflow")
     
     print(f"\n🎯 EXPERIMENT COMPLETE!")
-    print(f"📁 Results: generated_stories_pine_hollow_baseline.csv")
+    print(f"📁 Results: {args.output}")
     print(f"🌐 MLflow UI: http://localhost:5000")
     print(f"📊 Compare with anime baseline to see the difference!")
 
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Columnar Scenario Store for Pine Hollow Mystery
+Keeps scenario CSVs as Parquet with dictionary-encoded categoricals and precomputed group counts
+
+Usage:
+    python scenario_store.py data/pine_hollow_expanded.csv data/pine_hollow_enhanced_v2.csv
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import pandas as pd
+
+# Low-cardinality labels repeated on every row
+CATEGORICAL_COLUMNS = ('branch_type', 'atmosphere_level', 'dialogue_style', 'story_arc')
+GROUP_COUNTS_KEY = b'pine_hollow.group_counts'
+
+
+def parquet_path_for(csv_path):
+    return Path(csv_path).with_suffix('.parquet')
+
+
+def build_group_counts(df, columns=CATEGORICAL_COLUMNS):
+    """
+    Returns: dict of column -> {value: row count}, in first-seen order, for the categorical columns present
+    """
+    counts = {}
+    for column in columns:
+        if column in df.columns:
+            sizes = df.groupby(column, observed=True, sort=False).size()
+            counts[column] = {str(value): int(size) for value, size in sizes.items()}
+    return counts
+
+
+def convert_csv(csv_path, parquet_path=None):
+    """
+    Write a scenario CSV as Parquet: categoricals dictionary-encoded, group counts in the file metadata
+    Returns: path of the Parquet file
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    parquet_path = Path(parquet_path or parquet_path_for(csv_path))
+    df = pd.read_csv(csv_path)
+    if 'scenario_id' not in df.columns:
+        # Same ids iter_scenario_chunks assigns: the row position in the CSV
+        df.insert(0, 'scenario_id', range(len(df)))
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Counts only: the footer stays a few bytes per label however many rows the file holds
+    metadata = {**(table.schema.metadata or {}), GROUP_COUNTS_KEY: json.dumps(build_group_counts(df)).encode('utf-8')}
+    pq.write_table(table.replace_schema_metadata(metadata), parquet_path, compression='zstd')
+    return parquet_path
+
+
+def read_group_counts(parquet_path):
+    """
+    Read the stored group counts from the Parquet footer, without touching the data pages
+    """
+    import pyarrow.parquet as pq
+
+    metadata = pq.read_schema(parquet_path).metadata or {}
+    return json.loads(metadata[GROUP_COUNTS_KEY]) if GROUP_COUNTS_KEY in metadata else None
+
+
+def ensure_parquet(path):
+    """
+    Returns: Parquet path for a scenario file, (re)building it when the CSV is newer
+    """
+    path = Path(path)
+    if path.suffix == '.parquet':
+        return path
+
+    parquet_path = parquet_path_for(path)
+    if not parquet_path.exists() or parquet_path.stat().st_mtime < path.stat().st_mtime:
+        convert_csv(path, parquet_path)
+    return parquet_path
+
+
+class ScenarioStore:
+    """
+    Memory-mapped scenario table with group lookups over the dictionary codes of the label columns
+    """
+
+    def __init__(self, path, columns=None):
+        """
+        path: scenario .parquet file, or a CSV (converted next to it on first use)
+        columns: optional subset of columns to load
+        """
+        import pyarrow.parquet as pq
+
+        self.path = ensure_parquet(path)
+        self.df = pq.read_table(self.path, columns=columns, memory_map=True).to_pandas()
+        self.group_counts = read_group_counts(self.path) or build_group_counts(self.df)
+        self._positions = {}
+
+    def __len__(self):
+        return len(self.df)
+
+    def positions(self, column):
+        """
+        Row positions of each value, grouped from the column's categorical codes on first use
+        Returns: dict of value -> positions array, in first-seen order
+        """
+        if column not in self._positions:
+            groups = self.df.groupby(column, observed=True, sort=False).indices
+            self._positions[column] = {str(value): positions for value, positions in groups.items()}
+        return self._positions[column]
+
+    def group(self, column, value):
+        """
+        Returns: rows where column == value
+        """
+        return self.df.iloc[self.positions(column).get(str(value), [])]
+
+    def groups(self, column):
+        """
+        Returns: dict of value -> rows, in first-seen order
+        """
+        return {value: self.df.iloc[positions] for value, positions in self.positions(column).items()}
+
+    def counts(self, column):
+        """
+        Returns: dict of value -> row count, straight from the footer when the file has them
+        """
+        if column in self.group_counts:
+            return dict(self.group_counts[column])
+        return {value: len(positions) for value, positions in self.positions(column).items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert scenario CSVs to indexed Parquet")
+    parser.add_argument("paths", nargs="+", help="Scenario CSV files")
+    args = parser.parse_args()
+
+    for csv_path in args.paths:
+        parquet_path = convert_csv(csv_path)
+        csv_size = Path(csv_path).stat().st_size
+        parquet_size = parquet_path.stat().st_size
+        print(f"🗂️ {csv_path} -> {parquet_path} ({csv_size / 1024:.1f}KB -> {parquet_size / 1024:.1f}KB)")
+
+
+if __name__ == "__main__":
+    main()
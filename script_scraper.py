@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Script Scraper for Pine Hollow Mystery
+Fetches script pages concurrently with per-host rate limits and an on-disk HTTP cache, then parses dialogue rows
+
+Usage:
+    python script_scraper.py --base-url http://localhost:8000/ --pages ep01.html ep02.html
+    # offline: serve fixture pages with `python -m http.server 8000` from their directory
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+import pandas as pd
+
+from data_collection_pipeline import DIALOGUE_COLUMNS, iter_dialogue, iter_text_lines
+
+DEFAULT_CACHE_DIR = ".http_cache"
+DEFAULT_WORKERS = 8
+DEFAULT_HOST_INTERVAL = 1.0  # seconds between requests to the same host
+DEFAULT_TIMEOUT = 30
+USER_AGENT = "pine-hollow-cyoa/1.0 (script research)"
+
+
+class HostRateLimiter:
+    """
+    Spaces requests to each host at least min_interval apart, across all fetcher threads
+    """
+
+    def __init__(self, min_interval=DEFAULT_HOST_INTERVAL):
+        self.min_interval = min_interval
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlsplit(url).netloc
+        # Reserve the slot under the lock, sleep outside it so other hosts aren't held up
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        time.sleep(max(0.0, slot - now))
+
+
+class HttpCache:
+    """
+    Response bodies on disk with their ETag/Last-Modified validators, keyed by URL
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+        return self.cache_dir / f"{key}.body", self.cache_dir / f"{key}.json"
+
+    def get(self, url):
+        """
+        Returns: (meta dict, body bytes), or None if the URL was never fetched
+        """
+        body_path, meta_path = self._paths(url)
+        if not (body_path.exists() and meta_path.exists()):
+            return None
+        return json.loads(meta_path.read_text()), body_path.read_bytes()
+
+    def validators(self, url):
+        """
+        Returns: conditional request headers for a cached URL
+        """
+        cached = self.get(url)
+        if cached is None:
+            return {}
+        meta = cached[0]
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def put(self, url, body, headers, encoding):
+        body_path, meta_path = self._paths(url)
+        meta = {"url": url, "etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified"),
+                "encoding": encoding, "fetched_at": time.strftime('%Y-%m-%dT%H:%M:%S')}
+        # Body first, meta last: a reader only trusts a body once its meta exists
+        for path, data in ((body_path, body), (meta_path, json.dumps(meta).encode('utf-8'))):
+            tmp_path = path.with_suffix(path.suffix + '.tmp')
+            tmp_path.write_bytes(data)
+            tmp_path.replace(path)
+
+
+class ScriptFetcher:
+    """
+    Thread-pool fetcher that revalidates cached pages instead of downloading them again
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, workers=DEFAULT_WORKERS, host_interval=DEFAULT_HOST_INTERVAL,
+                 timeout=DEFAULT_TIMEOUT):
+        self.cache = HttpCache(cache_dir)
+        self.limiter = HostRateLimiter(host_interval)
+        self.workers = workers
+        self.timeout = timeout
+        self.stats = Counter()
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+    def _session(self):
+        # requests.Session isn't documented as thread-safe, so each worker keeps its own
+        if not hasattr(self._local, "session"):
+            import requests
+            self._local.session = requests.Session()
+            self._local.session.headers["User-Agent"] = USER_AGENT
+        return self._local.session
+
+    def _count(self, status):
+        with self._stats_lock:
+            self.stats[status] += 1
+
+    def fetch(self, url):
+        """
+        Fetch one page, sending If-None-Match/If-Modified-Since when it is cached
+        Returns: (page text, 'fetched' or 'revalidated')
+        """
+        self.limiter.wait(url)
+        response = self._session().get(url, headers=self.cache.validators(url), timeout=self.timeout)
+
+        if response.status_code == 304:
+            cached = self.cache.get(url)
+            if cached is not None:
+                meta, body = cached
+                self._count("revalidated")
+                return body.decode(meta["encoding"] or 'utf-8', errors='replace'), "revalidated"
+            # The cache entry went away after its validators were sent; ask for the whole page instead
+            self.limiter.wait(url)
+            response = self._session().get(url, timeout=self.timeout)
+
+        response.raise_for_status()
+        encoding = response.encoding or 'utf-8'
+        self.cache.put(url, response.content, response.headers, encoding)
+        self._count("fetched")
+        return response.content.decode(encoding, errors='replace'), "fetched"
+
+    def fetch_all(self, urls):
+        """
+        Yield (url, page text) as each page arrives; failed pages are reported and skipped
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.fetch, url): url for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    text, _ = future.result()
+                except Exception as e:
+                    self._count("failed")
+                    print(f"⚠️ Could not fetch {url}: {type(e).__name__}: {e}")
+                    continue
+                yield url, text
+
+
+def parse_script_page(html, source=None):
+    """
+    Turn a screenplay-formatted script page into dialogue rows
+    Returns: list of dicts with character, dialogue, context and source
+    """
+    return list(iter_dialogue(iter_text_lines([html]), source=source))
+
+
+def scrape_scripts(urls, fetcher=None):
+    """
+    Fetch script pages concurrently and parse each one as soon as it arrives
+    Returns: DataFrame with character, dialogue, context and source
+    """
+    fetcher = fetcher or ScriptFetcher()
+    rows = []
+    for url, text in fetcher.fetch_all(urls):
+        page_rows = parse_script_page(text, source=url)
+        print(f"📜 {url}: {len(page_rows)} lines of dialogue")
+        rows.extend(page_rows)
+
+    # as_completed order depends on timing; keep the output in the order the pages were asked for
+    order = {url: i for i, url in enumerate(urls)}
+    rows.sort(key=lambda row: order[row["source"]])
+    return pd.DataFrame(rows, columns=DIALOGUE_COLUMNS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape script pages into dialogue rows")
+    parser.add_argument("--base-url", required=True, help="Site the script pages live under")
+    parser.add_argument("--pages", nargs="+", required=True, help="Script page paths relative to --base-url")
+    parser.add_argument("--output", default="data/twin_peaks_dialogue.csv")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--host-interval", type=float, default=DEFAULT_HOST_INTERVAL,
+                        help="Minimum seconds between requests to one host")
+    args = parser.parse_args()
+
+    fetcher = ScriptFetcher(args.cache_dir, args.workers, args.host_interval)
+    start = time.perf_counter()
+    dialogue_df = scrape_scripts([urljoin(args.base_url, page) for page in args.pages], fetcher)
+    dialogue_df.to_csv(args.output, index=False)
+
+    print(f"✅ {len(dialogue_df)} dialogue rows from {len(args.pages)} pages in {time.perf_counter() - start:.1f}s "
+          f"({dict(fetcher.stats)}) -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
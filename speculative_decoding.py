@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Speculative Decoding for Pine Hollow Mystery
+A small draft model (e.g. distilgpt2) proposes a few tokens and GPT-2 verifies them in one forward pass,
+accepting or resampling so every token is still distributed as plain temperature/top-k sampling from GPT-2
+"""
+
+import time
+from collections import Counter
+
+from generation_engine import DEFAULT_TOP_K, cache_layers, rebuild_cache, sampling_probs
+
+DEFAULT_DRAFT_TOKENS = 4
+DEFAULT_SPEEDUP_SAMPLE = 8
+
+
+def crop_cache(past_key_values, length):
+    """
+    Keep the first `length` positions of a KV cache, e.g. to drop rejected draft tokens
+    """
+    layers = [(keys[:, :, :length], values[:, :, :length]) for keys, values in cache_layers(past_key_values)]
+    return rebuild_cache(layers, like=past_key_values)
+
+
+class SpeculativeDecoder:
+    """
+    Draft-then-verify decoding of one prompt at a time, for per-turn latency rather than batch throughput
+    """
+
+    def __init__(self, model, draft_model, draft_tokens=DEFAULT_DRAFT_TOKENS):
+        # Proposals are token ids, so both models must share GPT-2's vocabulary
+        if draft_model.config.vocab_size != model.config.vocab_size:
+            raise ValueError(f"Draft model vocabulary ({draft_model.config.vocab_size}) doesn't match "
+                             f"the target's ({model.config.vocab_size})")
+        if draft_tokens < 1:
+            raise ValueError(f"draft_tokens must be at least 1, got {draft_tokens}")
+        self.model = model.eval()
+        self.draft_model = draft_model.eval()
+        self.draft_model_name = draft_model.name_or_path
+        self.draft_tokens = draft_tokens
+        self.device = next(model.parameters()).device
+        self.stats = Counter()
+
+    def _forward(self, model, tokens, past_key_values):
+        import torch
+
+        outputs = model(input_ids=torch.tensor([tokens], device=self.device), past_key_values=past_key_values,
+                        use_cache=True)
+        return outputs.logits[0], outputs.past_key_values
+
+    def _pick(self, probs, do_sample, generator):
+        import torch
+
+        if not do_sample:
+            return int(probs.argmax())
+        return int(torch.multinomial(probs, num_samples=1, generator=generator))
+
+    def _accepts(self, token, target_probs, draft_probs, do_sample, generator):
+        import torch
+
+        if not do_sample:
+            return token == int(target_probs.argmax())
+        # Accept with probability min(1, p/q); rejections are corrected from the residual below
+        u = float(torch.rand(1, generator=generator, device=self.device))
+        return u * float(draft_probs[token]) < float(target_probs[token])
+
+    def generate(self, prompt_ids, budget, temperature=0.8, do_sample=True, top_k=DEFAULT_TOP_K, generator=None,
+                 eos_id=None, stop_criteria=None):
+        """
+        Continue one tokenized prompt until eos, its budget or stop_criteria.ends_sentence
+        Returns: list of generated token ids (eos excluded)
+        """
+        # Each cache holds every committed token except the `pending` ones, which are fed on the next pass
+        target_past = draft_past = None
+        target_length = draft_length = len(prompt_ids) - 1
+        if target_length:
+            _, target_past = self._forward(self.model, prompt_ids[:-1], None)
+            _, draft_past = self._forward(self.draft_model, prompt_ids[:-1], None)
+        target_pending = draft_pending = [prompt_ids[-1]]
+
+        generated = []
+        while True:
+            # Drafts past the budget would only be thrown away
+            k = min(self.draft_tokens, budget - len(generated))
+            proposals, draft_probs = [], []
+            inputs = draft_pending
+            for _ in range(k):
+                logits, draft_past = self._forward(self.draft_model, inputs, draft_past)
+                draft_length += len(inputs)
+                probs = sampling_probs(logits[-1:], temperature, top_k)[0]
+                proposals.append(self._pick(probs, do_sample, generator))
+                draft_probs.append(probs)
+                inputs = proposals[-1:]
+
+            # One GPT-2 pass scores every proposal, plus the token after the last one
+            logits, target_past = self._forward(self.model, target_pending + proposals, target_past)
+            target_length += len(target_pending) + k
+            target_probs = sampling_probs(logits[len(target_pending) - 1:], temperature, top_k)
+
+            accepted = 0
+            for token, p, q in zip(proposals, target_probs, draft_probs):
+                if not self._accepts(token, p, q, do_sample, generator):
+                    break
+                accepted += 1
+            if accepted < k and not do_sample:
+                # Greedy rejected the draft because it wasn't GPT-2's argmax, so the argmax replaces it
+                next_token = self._pick(target_probs[accepted], do_sample, generator)
+            elif accepted < k:
+                residual = (target_probs[accepted] - draft_probs[accepted]).clamp(min=0)
+                next_token = self._pick(residual if residual.sum() > 0 else target_probs[accepted],
+                                        do_sample, generator)
+            else:
+                next_token = self._pick(target_probs[k], do_sample, generator)
+
+            self.stats["proposed"] += k
+            self.stats["accepted"] += accepted
+            self.stats["target_passes"] += 1
+
+            # Rejected proposals leave both caches; the draft never saw its own last proposal
+            if accepted < k:
+                target_length -= k - accepted
+                target_past = crop_cache(target_past, target_length)
+            kept = min(accepted, k - 1)
+            if kept < k - 1:
+                draft_length -= k - 1 - kept
+                draft_past = crop_cache(draft_past, draft_length)
+            target_pending = [next_token]
+            draft_pending = proposals[kept:accepted] + [next_token]
+
+            for token in proposals[:accepted] + [next_token]:
+                if token == eos_id:
+                    return self._finish(generated)
+                generated.append(token)
+                if len(generated) >= budget or (stop_criteria is not None and stop_criteria.ends_sentence(generated)):
+                    return self._finish(generated)
+
+    def _finish(self, generated):
+        self.stats["generated_tokens"] += len(generated)
+        return generated
+
+    def report(self):
+        """
+        Returns: dict of MLflow-ready speculative decoding metrics
+        """
+        proposed, passes = self.stats["proposed"], self.stats["target_passes"]
+        return {
+            "speculative_acceptance_rate": self.stats["accepted"] / proposed if proposed else 0.0,
+            # Plain sampling makes exactly one GPT-2 pass per token
+            "speculative_tokens_per_target_pass": self.stats["generated_tokens"] / passes if passes else 0.0,
+            "speculative_target_passes": passes
+        }
+
+
+def measure_speedup(engine, prompts, max_new_tokens, temperature=0.8, seeds=None, sentence_stop=None):
+    """
+    Time the same prompts with and without the engine's draft model, one prompt per batch as in an
+    interactive turn, bypassing the continuation cache
+    Returns: dict of seconds per generated token either way and the speedup
+    """
+    decoder = engine.speculative
+    saved = (engine.cache, engine.speculative, engine.batch_size, dict(engine.token_counts), Counter(decoder.stats))
+    engine.cache, engine.batch_size = None, 1
+    seconds_per_token = {}
+    try:
+        for name, speculative in (("speculative", decoder), ("plain", None)):
+            engine.speculative = speculative
+            start = time.perf_counter()
+            generations = engine.generate(prompts, max_new_tokens, temperature, seeds=seeds,
+                                          sentence_stop=sentence_stop, details=True)
+            tokens = sum(g['generated_tokens'] for g in generations)
+            seconds_per_token[name] = (time.perf_counter() - start) / max(tokens, 1)
+    finally:
+        engine.cache, engine.speculative, engine.batch_size, engine.token_counts, decoder.stats = saved
+
+    return {
+        "speculative_seconds_per_token": seconds_per_token["speculative"],
+        "plain_seconds_per_token": seconds_per_token["plain"],
+        "speculative_speedup": seconds_per_token["plain"] / seconds_per_token["speculative"]
+    }
+
+
+def report_speculative(metrics, draft_model_name):
+    """
+    Print a run's speculative decoding metrics
+    """
+    line = (f"\n🎯 Speculative decoding with {draft_model_name}: "
+            f"{metrics['speculative_acceptance_rate']:.0%} of drafts accepted, "
+            f"{metrics['speculative_tokens_per_target_pass']:.2f} tokens per GPT-2 pass")
+    if "speculative_speedup" in metrics:
+        line += f", {metrics['speculative_speedup']:.2f}x plain sampling speed"
+    print(line)
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Interactive Story Session Server for Pine Hollow Mystery
+Keeps each player's GPT-2 KV cache between turns so a choice only processes the new text
+
+Usage:
+    python story_session.py --port 8050
+    curl -X POST localhost:8050/sessions -d '{"scenario_id": 0}'
+    curl -X POST localhost:8050/sessions/<session_id>/choose -d '{"choice": "a"}'
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from generation_engine import DEFAULT_TOP_K, build_prompt, cache_nbytes, derive_seed, sample_next_tokens
+from model_loader import DEFAULT_MODEL_NAME, load_model
+
+DEFAULT_MAX_CACHE_MB = 512
+DEFAULT_IDLE_SECONDS = 15 * 60
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_SESSION_TTL_SECONDS = 24 * 60 * 60
+CHOICE_TEMPLATE = " You choose: {choice}."
+
+
+class StorySession:
+    """
+    One player's story so far plus the KV cache that encodes it
+    """
+
+    def __init__(self, session_id, choices=None, seed=None):
+        self.session_id = session_id
+        self.choices = choices or {}
+        self.seed = seed
+        self.turns = 0
+        self.story_ids = []        # every token of the story so far
+        self.pending_ids = []      # sampled tokens not yet run through the model
+        self.past_key_values = None
+        self.last_active = time.time()
+
+    @property
+    def is_warm(self):
+        return self.past_key_values is not None
+
+
+class StorySessionManager:
+    """
+    Runs story turns against cached sessions, evicts caches under a memory budget and
+    drops abandoned sessions
+    """
+
+    def __init__(self, model, tokenizer, max_cache_mb=DEFAULT_MAX_CACHE_MB, idle_seconds=DEFAULT_IDLE_SECONDS,
+                 max_sessions=DEFAULT_MAX_SESSIONS, session_ttl=DEFAULT_SESSION_TTL_SECONDS):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.device = next(model.parameters()).device
+        self.max_cache_bytes = int(max_cache_mb * 1024 * 1024)
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.max_positions = model.config.n_positions
+        self.sessions = OrderedDict()  # least recently used first
+        self.lock = threading.Lock()
+        self.stats = {'turns': 0, 'tokens_processed': 0, 'cold_rebuilds': 0, 'evictions': 0, 'expired_sessions': 0}
+
+    def start(self, opening_text, choices=None, seed=None):
+        """
+        Open a session and encode its opening text once
+        Returns: session id
+        """
+        with self.lock:
+            session = StorySession(uuid.uuid4().hex, choices, seed)
+            session.pending_ids = self.tokenizer.encode(opening_text)
+            self.sessions[session.session_id] = session
+            self._advance(session, max_new_tokens=0)
+            self._evict()
+            return session.session_id
+
+    def choose(self, session_id, choice, max_new_tokens=40, temperature=0.8, top_k=DEFAULT_TOP_K):
+        """
+        Append the player's choice ('a', 'b' or free text) and generate the next story beat
+        Returns: generated continuation text
+        """
+        # The story tail kept on a rebuild needs room for at least one token besides the new ones
+        if not 1 <= max_new_tokens < self.max_positions - 1:
+            raise ValueError(f"max_new_tokens must be between 1 and {self.max_positions - 2}, got {max_new_tokens}")
+        if not 0 < temperature < float('inf'):
+            raise ValueError("temperature must be positive")
+
+        with self.lock:
+            if session_id not in self.sessions:
+                raise KeyError(f"unknown session {session_id}")
+            session = self.sessions[session_id]
+            self.sessions.move_to_end(session_id)
+
+            choice_text = session.choices.get(choice, choice)
+            session.pending_ids += self.tokenizer.encode(CHOICE_TEMPLATE.format(choice=choice_text))
+            session.choices = {}
+
+            generated = self._advance(session, max_new_tokens, temperature, top_k)
+            session.turns += 1
+            self.stats['turns'] += 1
+            self._evict()
+            return self.tokenizer.decode(generated, skip_special_tokens=True).strip()
+
+    def end(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def _advance(self, session, max_new_tokens, temperature=0.8, top_k=DEFAULT_TOP_K):
+        """
+        Run pending tokens through the model, then sample up to max_new_tokens
+        """
+        import torch
+
+        # Leave room in GPT-2's context window; otherwise rebuild from the most recent tokens
+        total = len(session.story_ids) + len(session.pending_ids) + max_new_tokens
+        if total > self.max_positions or not session.is_warm:
+            self._rebuild(session, max_new_tokens)
+
+        generator = None
+        if session.seed is not None:
+            generator = torch.Generator(device=self.device).manual_seed(derive_seed(session.seed, session.turns))
+
+        generated = []
+        eos_id = self.tokenizer.eos_token_id
+        with torch.no_grad():
+            input_ids = session.pending_ids
+            for step in range(max_new_tokens + 1):
+                outputs = self.model(input_ids=torch.tensor([input_ids], device=self.device),
+                                     past_key_values=session.past_key_values, use_cache=True)
+                session.past_key_values = outputs.past_key_values
+                session.story_ids += input_ids
+                self.stats['tokens_processed'] += len(input_ids)
+
+                if step == max_new_tokens:
+                    break
+                next_token = sample_next_tokens(outputs.logits[:, -1, :], temperature, top_k,
+                                                generators=None if generator is None else [generator])
+                next_token = int(next_token[0])
+                if next_token == eos_id:
+                    break
+                generated.append(next_token)
+                input_ids = [next_token]
+
+        session.pending_ids = []
+        session.last_active = time.time()
+        return generated
+
+    def _rebuild(self, session, max_new_tokens):
+        """
+        Re-encode a cold or overflowing session from the tail of its story
+        """
+        if session.story_ids:
+            self.stats['cold_rebuilds'] += 1
+        keep = self.max_positions - max_new_tokens - 1
+        story = (session.story_ids + session.pending_ids)[-keep:]
+        session.story_ids = []
+        session.pending_ids = story
+        session.past_key_values = None
+
+    @staticmethod
+    def _cache_bytes(caches):
+        return sum(cache_nbytes(cache) for cache in caches if cache is not None)
+
+    def cache_bytes(self):
+        with self.lock:
+            caches = [s.past_key_values for s in self.sessions.values()]
+        return self._cache_bytes(caches)
+
+    def _evict(self):
+        """
+        Drop sessions past their TTL or over the session limit, then KV caches of idle sessions,
+        then least recently used caches until under budget
+        Sessions that only lose their cache keep their story and are re-encoded if the player comes back
+        """
+        now = time.time()
+        for session_id in [sid for sid, s in self.sessions.items() if now - s.last_active > self.session_ttl]:
+            del self.sessions[session_id]
+            self.stats['expired_sessions'] += 1
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+            self.stats['expired_sessions'] += 1
+
+        for session in self.sessions.values():
+            if session.is_warm and now - session.last_active > self.idle_seconds:
+                session.past_key_values = None
+                self.stats['evictions'] += 1
+
+        total = self._cache_bytes(s.past_key_values for s in self.sessions.values())
+        for session in self.sessions.values():
+            if total <= self.max_cache_bytes:
+                break
+            if session.is_warm:
+                total -= cache_nbytes(session.past_key_values)
+                session.past_key_values = None
+                self.stats['evictions'] += 1
+
+    def status(self):
+        # Snapshot under the lock; other threads add, end and prune sessions
+        with self.lock:
+            stats = dict(self.stats)
+            caches = [s.past_key_values for s in self.sessions.values()]
+        return {
+            **stats,
+            'sessions': len(caches),
+            'warm_sessions': sum(1 for cache in caches if cache is not None),
+            'cache_mb': self._cache_bytes(caches) / (1024 * 1024)
+        }
+
+
+def make_handler(manager, scenarios_df):
+    class StoryRequestHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get('Content-Length', 0))
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def do_GET(self):
+            try:
+                if self.path == '/status':
+                    self._reply(200, manager.status())
+                else:
+                    self._reply(404, {'error': 'not found'})
+            except Exception as e:
+                self._reply(500, {'error': repr(e)})
+
+        def do_POST(self):
+            try:
+                request = self._read_json()
+                if not isinstance(request, dict):
+                    raise TypeError("request body must be a JSON object")
+                parts = self.path.strip('/').split('/')
+                if parts == ['sessions']:
+                    scenario_id = int(request.get('scenario_id', 0))
+                    if not 0 <= scenario_id < len(scenarios_df):
+                        raise ValueError(f"scenario_id must be between 0 and {len(scenarios_df) - 1}")
+                    seed = request.get('seed')
+                    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int) or seed < 0):
+                        raise ValueError(f"seed must be a non-negative integer, got {seed!r}")
+                    row = scenarios_df.iloc[scenario_id]
+                    choices = {'a': row['choice_a'], 'b': row['choice_b']}
+                    session_id = manager.start(build_prompt(row), choices, seed)
+                    self._reply(200, {'session_id': session_id, 'story': row['response'], 'choices': choices})
+                elif len(parts) == 3 and parts[0] == 'sessions' and parts[2] == 'choose':
+                    choice = request.get('choice')
+                    if not isinstance(choice, str) or not choice:
+                        raise ValueError(f"choice must be a non-empty string, got {choice!r}")
+                    continuation = manager.choose(parts[1], choice,
+                                                  max_new_tokens=int(request.get('max_new_tokens', 40)),
+                                                  temperature=float(request.get('temperature', 0.8)))
+                    self._reply(200, {'session_id': parts[1], 'story': continuation})
+                else:
+                    self._reply(404, {'error': 'not found'})
+            except KeyError as e:
+                # Request fields are checked above, so this is the session lookup
+                self._reply(404, {'error': str(e.args[0])})
+            except (ValueError, TypeError) as e:
+                self._reply(400, {'error': str(e)})
+            except Exception as e:
+                # Whatever went wrong, the client still gets an answer
+                self._reply(500, {'error': repr(e)})
+
+        def do_DELETE(self):
+            try:
+                parts = self.path.strip('/').split('/')
+                if len(parts) == 2 and parts[0] == 'sessions':
+                    manager.end(parts[1])
+                    self._reply(200, {'session_id': parts[1]})
+                else:
+                    self._reply(404, {'error': 'not found'})
+            except Exception as e:
+                self._reply(500, {'error': repr(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return StoryRequestHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve interactive Pine Hollow story sessions")
+    parser.add_argument("--model-name", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--data", default="data/pine_hollow_expanded.csv")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--max-cache-mb", type=float, default=DEFAULT_MAX_CACHE_MB,
+                        help="KV cache memory budget across all sessions")
+    parser.add_argument("--idle-seconds", type=float, default=DEFAULT_IDLE_SECONDS,
+                        help="Drop a session's KV cache after this long without a turn")
+    parser.add_argument("--max-sessions", type=int, default=DEFAULT_MAX_SESSIONS,
+                        help="Drop the least recently used sessions beyond this many")
+    parser.add_argument("--session-ttl-seconds", type=float, default=DEFAULT_SESSION_TTL_SECONDS,
+                        help="Drop a session entirely after this long without a turn")
+    args = parser.parse_args()
+    if args.max_sessions < 1:
+        parser.error("--max-sessions must be at least 1")
+
+    print("🌲 Starting Pine Hollow story session server")
+    scenarios_df = pd.read_csv(args.data)
+    model, tokenizer = load_model(args.model_name)
+    manager = StorySessionManager(model, tokenizer, args.max_cache_mb, args.idle_seconds,
+                                  args.max_sessions, args.session_ttl_seconds)
+
+    server = ThreadingHTTPServer(('localhost', args.port), make_handler(manager, scenarios_df))
+    print(f"🎮 Serving {len(scenarios_df)} scenarios on http://localhost:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Story server stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Streaming Scenario Pipeline for Pine Hollow Mystery
+Reads scenario CSVs in chunks and writes generated results incrementally, so runs can resume
+"""
+
+import os
+import shutil
+from collections import Counter
+from pathlib import Path
+
+import pandas as pd
+
+DEFAULT_CHUNK_SIZE = 256
+TOKEN_COLUMNS = ('prompt_tokens', 'generated_tokens')
+
+
+def iter_scenario_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE, skip_ids=None, usecols=None):
+    """
+    Yield scenario DataFrames chunk by chunk, each with a stable `scenario_id` (row position in the file)
+    skip_ids: scenario ids to drop, e.g. the ones a previous run already completed
+    """
+    for chunk in _read_scenario_chunks(path, chunk_size, usecols):
+        if 'scenario_id' not in chunk.columns:
+            # read_csv keeps counting the index across chunks, so it is the row position
+            chunk.insert(0, 'scenario_id', chunk.index)
+        if skip_ids:
+            chunk = chunk[~chunk['scenario_id'].isin(skip_ids)]
+        if len(chunk):
+            yield chunk
+
+
+def count_values(path, columns, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Value counts for a few columns without loading the rest of the file
+    Returns: dict of column -> {value: count}
+    """
+    if _is_parquet(path):
+        # Scenario Parquet files carry their group counts, so counting reads only the footer
+        from scenario_store import read_group_counts
+        group_counts = read_group_counts(path) or {}
+        if all(column in group_counts for column in columns):
+            return {column: dict(Counter(group_counts[column]).most_common()) for column in columns}
+
+    counts = {column: Counter() for column in columns}
+    for chunk in _read_scenario_chunks(path, chunk_size, list(columns)):
+        for column in columns:
+            counts[column].update(chunk[column].value_counts().to_dict())
+    return {column: dict(counter.most_common()) for column, counter in counts.items()}
+
+
+def _is_parquet(path):
+    return str(path).endswith('.parquet')
+
+
+def _read_scenario_chunks(path, chunk_size, usecols=None):
+    if not _is_parquet(path):
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=usecols)
+        return
+
+    import pyarrow.parquet as pq
+    # Files from scenario_store.py already carry scenario_id; keep it even when not asked for
+    parquet = pq.ParquetFile(path, memory_map=True)
+    if usecols is not None and 'scenario_id' in parquet.schema_arrow.names:
+        usecols = ['scenario_id'] + [c for c in usecols if c != 'scenario_id']
+    offset = 0
+    for batch in parquet.iter_batches(batch_size=chunk_size, columns=usecols):
+        chunk = batch.to_pandas()
+        chunk.index = range(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+
+def iter_result_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE, usecols=None):
+    """
+    Yield chunks of a results file written by ResultWriter
+    """
+    path = Path(path)
+    if not path.exists():
+        return
+
+    if _is_parquet(path):
+        # One part file per written chunk, read back in write order
+        for part in sorted(path.glob('part-*.parquet')):
+            yield pd.read_parquet(part, columns=usecols)
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=usecols)
+
+
+def completed_scenario_ids(path):
+    """
+    Returns: set of scenario ids already present in a results file
+    """
+    path = Path(path)
+    if path.is_file() and 'scenario_id' not in pd.read_csv(path, nrows=0).columns:
+        raise ValueError(f"{path} predates resumable runs (no scenario_id column); rerun without --resume")
+
+    completed = set()
+    for chunk in iter_result_chunks(path, usecols=['scenario_id']):
+        completed.update(chunk['scenario_id'].tolist())
+    return completed
+
+
+class ResultWriter:
+    """
+    Appends result rows to a CSV file (or a directory of Parquet parts) as they are generated
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = Path(path)
+        self.rows_written = 0
+        self.completed_ids = completed_scenario_ids(self.path) if resume else set()
+
+        if not resume and self.path.exists():
+            if self.path.is_dir():
+                shutil.rmtree(self.path)
+            else:
+                self.path.unlink()
+
+        if self.completed_ids:
+            print(f"⏯️ Resuming: {len(self.completed_ids)} scenarios already in {self.path}")
+
+    def write(self, results_df):
+        """
+        Persist one chunk of results before the next chunk is generated
+        """
+        if results_df.empty:
+            return
+
+        if _is_parquet(self.path):
+            self.path.mkdir(parents=True, exist_ok=True)
+            part_num = len(list(self.path.glob('part-*.parquet')))
+            results_df.to_parquet(self.path / f"part-{part_num:05d}.parquet", index=False)
+        else:
+            write_header = not self.path.exists() or os.path.getsize(self.path) == 0
+            if not write_header:
+                existing = list(pd.read_csv(self.path, nrows=0).columns)
+                if existing != list(results_df.columns):
+                    # Appending would silently shift values under the wrong headers
+                    raise ValueError(f"{self.path} has columns {existing}, this run writes "
+                                     f"{list(results_df.columns)}; rerun without --resume")
+            results_df.to_csv(self.path, mode='a', header=write_header, index=False)
+
+        self.rows_written += len(results_df)
+        self.completed_ids.update(results_df['scenario_id'].tolist())
+
+
+def summarize_results(path, count_columns=(), sample_rows=3, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Stream a results file once for the run summary
+    Returns: dict with rows, avg_response_length, avg_<token column> when present,
+             per-column value counts and the first sample rows
+    """
+    rows = 0
+    total_chars = 0
+    token_totals = {}
+    counts = {column: Counter() for column in count_columns}
+    samples = []
+
+    for chunk in iter_result_chunks(path, chunk_size):
+        lengths = chunk['ai_response'].fillna('').str.len()
+        rows += len(chunk)
+        total_chars += int(lengths.sum())
+        for column in TOKEN_COLUMNS:
+            if column in chunk.columns:
+                token_totals[column] = token_totals.get(column, 0) + int(chunk[column].sum())
+        for column in count_columns:
+            if column in chunk.columns:
+                counts[column].update(chunk[column].value_counts().to_dict())
+        if sum(len(sample) for sample in samples) < sample_rows:
+            samples.append(chunk.head(sample_rows))
+
+    return {
+        'rows': rows,
+        'avg_response_length': total_chars / rows if rows else 0.0,
+        **{f'avg_{column}': total / rows for column, total in token_totals.items() if rows},
+        'counts': {column: dict(counter) for column, counter in counts.items()},
+        'samples': pd.concat(samples).head(sample_rows) if samples else pd.DataFrame()
+    }
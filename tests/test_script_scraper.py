@@ -0,0 +1,78 @@
+"""
+Script scraper tests against a fixture page served by http.server
+"""
+
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from script_scraper import ScriptFetcher, scrape_scripts
+
+FIXTURES = Path(__file__).parent / "fixtures"
+PAGE = "twin_peaks_ep01.html"
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    # SimpleHTTPRequestHandler sends Last-Modified and answers If-Modified-Since with a 304
+    server = ThreadingHTTPServer(("localhost", 0), partial(_QuietHandler, directory=str(FIXTURES)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetcher(tmp_path):
+    return ScriptFetcher(cache_dir=tmp_path / "http_cache", workers=2, host_interval=0)
+
+
+def test_scrape_parses_dialogue_rows(base_url, fetcher):
+    url = base_url + PAGE
+    dialogue_df = scrape_scripts([url], fetcher)
+
+    assert dialogue_df.to_dict("records") == [
+        {"character": "Cooper", "dialogue": "Diane, 6:18 a.m., room 315, Great Northern Hotel. Slept pretty well.",
+         "context": "INT. GREAT NORTHERN HOTEL - COOPER'S ROOM - MORNING", "source": url},
+        {"character": "Truman", "dialogue": "Best pie in the county.",
+         "context": "INT. DOUBLE R DINER - DAY", "source": url},
+        {"character": "Cooper", "dialogue": "Damn good coffee. And hot!",
+         "context": "INT. DOUBLE R DINER - DAY", "source": url},
+    ]
+    assert fetcher.stats == {"fetched": 1}
+
+
+def test_cached_page_is_revalidated(base_url, fetcher):
+    url = base_url + PAGE
+    text, status = fetcher.fetch(url)
+    assert status == "fetched"
+    assert "If-Modified-Since" in fetcher.cache.validators(url)
+
+    revalidated_text, status = fetcher.fetch(url)
+    assert status == "revalidated"
+    assert revalidated_text == text
+
+
+def test_vanished_cache_entry_is_fetched_again(base_url, fetcher, monkeypatch):
+    url = base_url + PAGE
+    text, _ = fetcher.fetch(url)
+
+    # Validators go out, then the entry disappears before the 304 comes back
+    validators = fetcher.cache.validators(url)
+    for path in fetcher.cache.cache_dir.iterdir():
+        path.unlink()
+    monkeypatch.setattr(fetcher.cache, "validators", lambda _: validators)
+
+    refetched_text, status = fetcher.fetch(url)
+    assert status == "fetched"
+    assert refetched_text == text
+    assert fetcher.cache.get(url) is not None
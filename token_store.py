@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Token Store for Pine Hollow Mystery
+Tokenizes every scenario prompt once into a flat memory-mapped uint16 array with an offsets index,
+so generation, perplexity scoring and fine-tuning read token slices instead of re-tokenizing
+
+Usage:
+    python token_store.py data/pine_hollow_expanded.csv data/pine_hollow_enhanced_v2.csv
+"""
+
+import argparse
+import hashlib
+import json
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+
+from dataset_registry import DatasetRegistry, content_hash, transform_id
+from generation_engine import build_prompt
+from model_loader import DEFAULT_MODEL_NAME, load_tokenizer
+from streaming_pipeline import DEFAULT_CHUNK_SIZE, iter_scenario_chunks
+
+DEFAULT_STORE_DIR = ".token_store"
+TOKEN_DTYPE = np.uint16  # GPT-2's 50257-token vocabulary fits in 16 bits
+
+
+def store_path(dataset_path, tokenizer_name=DEFAULT_MODEL_NAME, store_dir=DEFAULT_STORE_DIR, dataset_hash=None):
+    """
+    Directory of a dataset's token store, keyed by its content hash, the tokenizer and the prompt template
+    """
+    dataset_hash = dataset_hash or content_hash(dataset_path)
+    key = hashlib.sha256(f"{dataset_hash}:{tokenizer_name}:{transform_id(build_prompt)}".encode('utf-8'))
+    return Path(store_dir) / f"{Path(dataset_path).stem}-{key.hexdigest()[:16]}"
+
+
+def build_token_store(dataset_path, tokenizer_name=DEFAULT_MODEL_NAME, store_dir=DEFAULT_STORE_DIR,
+                      chunk_size=DEFAULT_CHUNK_SIZE, tokenizer=None):
+    """
+    Tokenize a scenario CSV (or its Parquet copy) chunk by chunk into tokens.bin, offsets.npy and ids.npy
+    Returns: the store's directory
+    """
+    dataset_hash = content_hash(dataset_path)
+    path = store_path(dataset_path, tokenizer_name, store_dir, dataset_hash)
+    tokenizer = tokenizer or load_tokenizer(tokenizer_name)
+    if len(tokenizer) > np.iinfo(TOKEN_DTYPE).max + 1:
+        raise ValueError(f"{tokenizer_name} has {len(tokenizer)} tokens, more than {TOKEN_DTYPE.__name__} can hold")
+
+    # Built beside its final name and renamed into place, so a half-built store is never opened
+    tmp_path = path.with_name(path.name + '.tmp')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    offsets, scenario_ids = [0], []
+    with open(tmp_path / 'tokens.bin', 'wb') as f:
+        for chunk in iter_scenario_chunks(dataset_path, chunk_size, usecols=['prompt', 'response']):
+            prompts = [build_prompt(row) for row in chunk.to_dict('records')]
+            for ids in tokenizer(prompts)['input_ids']:
+                f.write(np.asarray(ids, dtype=TOKEN_DTYPE).tobytes())
+                offsets.append(offsets[-1] + len(ids))
+            scenario_ids += chunk['scenario_id'].tolist()
+    np.save(tmp_path / 'offsets.npy', np.asarray(offsets, dtype=np.int64))
+    np.save(tmp_path / 'ids.npy', np.asarray(scenario_ids, dtype=np.int64))
+
+    meta = {
+        "dataset": str(dataset_path),
+        "dataset_hash": dataset_hash,
+        "tokenizer": tokenizer_name,
+        "template": transform_id(build_prompt),
+        "scenarios": len(scenario_ids),
+        "tokens": offsets[-1]
+    }
+    (tmp_path / 'meta.json').write_text(json.dumps(meta, indent=2))
+    shutil.rmtree(path, ignore_errors=True)
+    tmp_path.rename(path)
+
+    # Stores of the dataset's earlier content are superseded by this one
+    for old_path in path.parent.glob(f"{Path(dataset_path).stem}-*"):
+        old_meta = old_path / 'meta.json'
+        if old_path == path or not old_meta.exists():
+            continue
+        if json.loads(old_meta.read_text()).get("tokenizer") == tokenizer_name:
+            shutil.rmtree(old_path)
+
+    DatasetRegistry().register(path, inputs={str(dataset_path): dataset_hash}, transform=meta["template"],
+                               rows=len(scenario_ids))
+    return path
+
+
+class TokenStore:
+    """
+    Read-only view of a built store: token slices are memory-mapped, never copied or re-tokenized
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / 'meta.json').read_text())
+        # np.memmap can't map an empty file
+        self.token_ids = (np.memmap(self.path / 'tokens.bin', dtype=TOKEN_DTYPE, mode='r')
+                          if self.meta["tokens"] else np.empty(0, dtype=TOKEN_DTYPE))
+        self.offsets = np.load(self.path / 'offsets.npy', mmap_mode='r')
+        self.scenario_ids = np.load(self.path / 'ids.npy')
+        self._rows = {int(scenario_id): row for row, scenario_id in enumerate(self.scenario_ids)}
+
+    @classmethod
+    def for_dataset(cls, dataset_path, tokenizer_name=DEFAULT_MODEL_NAME, store_dir=DEFAULT_STORE_DIR, tokenizer=None):
+        """
+        Open the store for a dataset's current content, building it first if the content changed
+        """
+        path = store_path(dataset_path, tokenizer_name, store_dir)
+        if not (path / 'meta.json').exists():
+            print(f"🔤 Tokenizing {dataset_path} into {path}")
+            path = build_token_store(dataset_path, tokenizer_name, store_dir, tokenizer=tokenizer)
+        return cls(path)
+
+    @property
+    def dataset_hash(self):
+        return self.meta["dataset_hash"]
+
+    def __len__(self):
+        return len(self.scenario_ids)
+
+    def __contains__(self, scenario_id):
+        return int(scenario_id) in self._rows
+
+    def tokens(self, scenario_id):
+        """
+        Returns: uint16 view of a scenario's prompt tokens
+        """
+        row = self._rows[int(scenario_id)]
+        return self.token_ids[self.offsets[row]:self.offsets[row + 1]]
+
+    def many(self, scenario_ids):
+        return [self.tokens(scenario_id) for scenario_id in scenario_ids]
+
+    def lengths(self):
+        """
+        Returns: token count per scenario, in store order
+        """
+        return np.diff(self.offsets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-tokenize scenario datasets into memory-mapped token stores")
+    parser.add_argument("paths", nargs="+", help="Scenario CSVs (or .parquet from scenario_store.py)")
+    parser.add_argument("--tokenizer", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--store-dir", default=DEFAULT_STORE_DIR)
+    args = parser.parse_args()
+
+    for path in args.paths:
+        start = time.perf_counter()
+        store = TokenStore(build_token_store(path, args.tokenizer, args.store_dir))
+        print(f"✅ {path}: {len(store)} scenarios, {store.meta['tokens']} tokens "
+              f"@ {store.dataset_hash} in {time.perf_counter() - start:.1f}s -> {store.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Buffered MLflow Tracking for Pine Hollow Mystery
+Queues params, metrics and artifacts, sends them with log_batch from a background thread and
+spools them to disk when the tracking store is unreachable, to be replayed by a later run
+
+Usage:
+    python tracking.py --replay     # push spooled runs once the tracking store is back
+"""
+
+import argparse
+import atexit
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+DEFAULT_SPOOL_DIR = ".mlflow_spool"
+DEFAULT_FLUSH_INTERVAL = 5.0
+MAX_BATCH_RECORDS = 100  # stays under log_batch's per-call param, tag and metric limits
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _client():
+    from mlflow import MlflowClient
+    return MlflowClient()
+
+
+def _send(client, run_id, records, before_call=None, on_sent=None):
+    """
+    Push records to a run in order: runs of scalars through log_batch, artifacts one upload at a time
+    before_call: optional callback(count) before each call, with how many records it carries
+    on_sent: optional callback(count) once that call succeeded, so the caller knows which prefix is confirmed
+    """
+    from mlflow.entities import Metric, Param, RunTag
+
+    start = 0
+    while start < len(records):
+        end = start + 1
+        if records[start]["type"] != "artifact":
+            while end < len(records) and end - start < MAX_BATCH_RECORDS and records[end]["type"] != "artifact":
+                end += 1
+        if before_call is not None:
+            before_call(end - start)
+
+        batch = records[start:end]
+        if batch[0]["type"] != "artifact":
+            client.log_batch(
+                run_id,
+                metrics=[Metric(r["key"], r["value"], r["timestamp"], r["step"]) for r in batch
+                         if r["type"] == "metric"],
+                params=[Param(r["key"], r["value"]) for r in batch if r["type"] == "param"],
+                tags=[RunTag(r["key"], r["value"]) for r in batch if r["type"] == "tag"]
+            )
+        elif Path(batch[0]["path"]).is_dir():
+            client.log_artifacts(run_id, batch[0]["path"], batch[0]["artifact_path"])
+        else:
+            client.log_artifact(run_id, batch[0]["path"], batch[0]["artifact_path"])
+
+        if on_sent is not None:
+            on_sent(end - start)
+        start = end
+
+
+def _unsent(client, run_id, records):
+    """
+    Drop records the run already has, e.g. a batch whose call timed out after the store applied it
+    Returns: the records still to send
+    """
+    run = client.get_run(run_id)
+    histories = {}
+    artifacts = {}
+    unsent = []
+    for record in records:
+        if record["type"] == "param":
+            sent = run.data.params.get(record["key"]) == record["value"]
+        elif record["type"] == "tag":
+            sent = run.data.tags.get(record["key"]) == record["value"]
+        elif record["type"] == "metric":
+            if record["key"] not in histories:
+                histories[record["key"]] = {(m.value, m.timestamp, m.step)
+                                            for m in client.get_metric_history(run_id, record["key"])}
+            sent = (record["value"], record["timestamp"], record["step"]) in histories[record["key"]]
+        else:
+            folder = record["artifact_path"]
+            if folder not in artifacts:
+                artifacts[folder] = {Path(a.path).name for a in client.list_artifacts(run_id, folder)}
+            sent = Path(record["path"]).name in artifacts[folder]
+        if not sent:
+            unsent.append(record)
+    return unsent
+
+
+def _get_or_create_run(client, experiment_name, run_name, run_id=None):
+    if run_id is not None:
+        return run_id
+    experiment = client.get_experiment_by_name(experiment_name)
+    experiment_id = experiment.experiment_id if experiment else client.create_experiment(experiment_name)
+    return client.create_run(experiment_id, run_name=run_name).info.run_id
+
+
+class BufferedTracker:
+    """
+    Drop-in for the mlflow.log_* calls the scripts make, without blocking on the tracking store
+    """
+
+    def __init__(self, experiment_name, run_name, spool_dir=DEFAULT_SPOOL_DIR,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, replay_spooled=True):
+        self.experiment_name = experiment_name
+        self.run_name = run_name
+        self.spool_dir = Path(spool_dir)
+        self.flush_interval = flush_interval
+        self.replay_spooled = replay_spooled
+        self.run_id = None
+        self.offline = False
+        self.sent = 0
+
+        self._pending = []   # records not yet confirmed by the tracking store, oldest first
+        self._in_flight = 0  # leading _pending records handed to a call that hasn't returned
+        self._params = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closing = False
+        self._stopped = False
+        self._closed = False
+        self._status = "FINISHED"
+        self._thread = threading.Thread(target=self._worker, name="mlflow-tracker", daemon=True)
+        self._thread.start()
+        # A script that dies before close() still ends its run, as FAILED, instead of leaving it RUNNING
+        atexit.register(self._close_at_exit)
+
+    # Same call shapes as the mlflow module, so callers can pass the tracker where mlflow was used
+
+    def log_param(self, key, value):
+        value = str(value)
+        # mlflow rejects changed params; fail here rather than poisoning a whole batch later
+        if self._params.setdefault(key, value) != value:
+            raise ValueError(f"Param {key!r} already logged as {self._params[key]!r}, not {value!r}")
+        self._enqueue({"type": "param", "key": key, "value": value})
+
+    def log_params(self, params):
+        for key, value in params.items():
+            self.log_param(key, value)
+
+    def log_metric(self, key, value, step=None):
+        self._enqueue({"type": "metric", "key": key, "value": float(value), "timestamp": _now_ms(),
+                       "step": step or 0})
+
+    def log_metrics(self, metrics, step=None):
+        for key, value in metrics.items():
+            self.log_metric(key, value, step)
+
+    def set_tag(self, key, value):
+        self._enqueue({"type": "tag", "key": key, "value": str(value)})
+
+    def log_artifact(self, local_path, artifact_path=None):
+        self._enqueue({"type": "artifact", "path": str(local_path), "artifact_path": artifact_path})
+
+    def log_artifacts(self, local_dir, artifact_path=None):
+        self.log_artifact(local_dir, artifact_path)
+
+    def _enqueue(self, record):
+        with self._lock:
+            self._pending.append(record)
+
+    def _worker(self):
+        try:
+            client = _client()
+            self.run_id = _get_or_create_run(client, self.experiment_name, self.run_name)
+        except Exception as e:
+            self._go_offline(e)
+            return
+
+        if self.replay_spooled:
+            # Earlier spools must not take this run offline if one of them can't be replayed
+            try:
+                replay_spool(self.spool_dir, client=client)
+            except Exception as e:
+                print(f"⚠️ Could not replay spooled MLflow runs: {type(e).__name__}: {e}")
+
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            closing = self._closing
+
+            with self._lock:
+                batch = list(self._pending)
+            if batch:
+                try:
+                    _send(client, self.run_id, batch, before_call=self._start_call, on_sent=self._confirm)
+                except _Stopped:
+                    return
+                except Exception as e:
+                    # The failed call stays in flight: the store may or may not have applied it
+                    self._go_offline(e)
+                    return
+
+            if closing:
+                with self._lock:
+                    done = not self._pending
+                if done:
+                    client.set_terminated(self.run_id, status=self._status)
+                    return
+
+    def _start_call(self, count):
+        with self._lock:
+            if self._stopped:
+                raise _Stopped()
+            self._in_flight = count
+
+    def _confirm(self, count):
+        with self._lock:
+            del self._pending[:count]
+            self._in_flight = 0
+            self.sent += count
+
+    def _go_offline(self, error):
+        self.offline = True
+        print(f"⚠️ MLflow tracking unavailable ({type(error).__name__}: {error}); spooling to {self.spool_dir}")
+
+    def flush(self):
+        self._wake.set()
+
+    def close(self, timeout=60.0, status=None):
+        """
+        Send what is left, or spool it if the store is unreachable or too slow
+        status: how the run ended, "FINISHED" unless given (e.g. "FAILED")
+        Returns: True if everything reached the tracking store
+        """
+        if self._closed:
+            return not self.offline
+        self._closed = True
+        self._status = status or self._status
+        self._closing = True
+        self._wake.set()
+        self._thread.join(timeout)
+
+        # The worker starts no further call once stopped, so nothing spooled below can also be sent by it
+        with self._lock:
+            self._stopped = True
+            remaining = list(self._pending)
+            in_flight = self._in_flight
+            self._pending.clear()
+        if not remaining and not self.offline and not self._thread.is_alive():
+            return True
+
+        # Unconfirmed records are spooled; a replay into the same run skips any the store did apply
+        spool_path = self._spool(remaining)
+        self.offline = True
+        print(f"💾 Spooled {len(remaining)} MLflow records to {spool_path} ({in_flight} unconfirmed in flight); "
+              f"replay with `python tracking.py --replay`")
+        return False
+
+    def _close_at_exit(self):
+        if not self._closed:
+            self.close(timeout=10.0, status="FAILED")
+
+    def _spool(self, records):
+        path = self.spool_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        # Written under a temporary name and renamed, so a concurrent replay never reads half a spool
+        final_path, path = path, path.with_name(path.name + ".tmp")
+        (path / "artifacts").mkdir(parents=True, exist_ok=True)
+
+        # Copy artifacts now, the originals may be overwritten before the replay
+        for i, record in enumerate(records):
+            if record["type"] != "artifact" or not Path(record["path"]).exists():
+                continue
+            source = Path(record["path"])
+            # One folder per record keeps the original file name, which becomes the artifact name
+            target = path / "artifacts" / f"{i:04d}" / source.name
+            target.parent.mkdir()
+            if source.is_dir():
+                shutil.copytree(source, target)
+            else:
+                shutil.copy2(source, target)
+            record = dict(record, path=str(target.relative_to(path)))
+            records[i] = record
+
+        meta = {"experiment_name": self.experiment_name, "run_name": self.run_name, "run_id": self.run_id,
+                "status": self._status}
+        (path / "meta.json").write_text(json.dumps(meta, indent=2))
+        with open(path / "records.jsonl", "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        path.rename(final_path)
+        return final_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.close(status="FAILED" if exc_type is not None else None)
+
+
+class _Stopped(Exception):
+    """
+    Raised in the tracker thread when close() has taken over its pending records
+    """
+
+
+def _claim(path):
+    """
+    Atomically rename a spool to one only this process owns, so concurrent runs never replay it twice
+    Returns: the claimed path, or None if another process got there first
+    """
+    claimed = path.with_name(f"{path.name.split('.')[0]}.claimed-{os.getpid()}")
+    try:
+        path.rename(claimed)
+    except OSError:
+        return None
+    return claimed
+
+
+def _claimable(path):
+    """
+    Unclaimed spools, plus ones claimed by a process that has since died mid-replay
+    """
+    if path.name.endswith(".tmp") or not (path / "meta.json").exists():
+        return False
+    if ".claimed-" not in path.name:
+        return True
+    try:
+        os.kill(int(path.name.rsplit("-", 1)[1]), 0)
+    except ProcessLookupError:
+        return True
+    except (OSError, ValueError):
+        pass
+    return False
+
+
+def replay_spool(spool_dir=DEFAULT_SPOOL_DIR, client=None):
+    """
+    Send every spooled run to the tracking store, removing each spool once it is through
+    Returns: number of runs replayed
+    """
+    spool_dir = Path(spool_dir)
+    if not spool_dir.exists():
+        return 0
+
+    client = client or _client()
+    replayed = 0
+    for path in sorted(p for p in spool_dir.iterdir() if _claimable(p)):
+        claimed = _claim(path)
+        if claimed is None:
+            continue
+        try:
+            meta = json.loads((claimed / "meta.json").read_text())
+            records = [json.loads(line) for line in (claimed / "records.jsonl").read_text().splitlines() if line]
+            for record in records:
+                if record["type"] == "artifact" and not Path(record["path"]).is_absolute():
+                    record["path"] = str(claimed / record["path"])
+
+            run_id = _get_or_create_run(client, meta["experiment_name"], meta["run_name"], meta["run_id"])
+            # A run that already exists may hold part of the spool: a call in flight at close, or an earlier replay
+            to_send = _unsent(client, run_id, records) if meta["run_id"] else records
+            _send(client, run_id, to_send)
+            client.set_terminated(run_id, status=meta.get("status", "FINISHED"))
+        except Exception:
+            # Released for the next replay
+            claimed.rename(path.with_name(path.name.split('.')[0]))
+            raise
+        shutil.rmtree(claimed)
+        replayed += 1
+        print(f"📤 Replayed {len(to_send)}/{len(records)} spooled records into run {meta['run_name']} ({run_id})")
+    return replayed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay MLflow records spooled while the tracking store was down")
+    parser.add_argument("--replay", action="store_true")
+    parser.add_argument("--spool-dir", default=DEFAULT_SPOOL_DIR)
+    args = parser.parse_args()
+
+    if args.replay:
+        print(f"✅ Replayed {replay_spool(args.spool_dir)} spooled runs")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()